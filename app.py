@@ -1,36 +1,46 @@
 import json
 import time
+from functools import partial
 
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, request
+from flask import Blueprint, Flask, Response, current_app, request, stream_with_context
 
-from helper import config
+from helper import cache, config, metrics, profiling
+from helper.catalog import catalog
+from helper.scheduling import BackgroundJobs, ClusterScheduler, app_job
+from helper.startup import Warmup
 from helper.utils import init_db, logger
-from models.patients import Notifications, RecommenderPatients, db
+from models import migrations
+from models.jobs import ArmedRound, JobLease
+from models.patients import NotificationOutbox, Notifications, RecommenderPatients, db
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://' + config.postgres_user + ':' + config.postgres_pass + '@' \
-										+ config.postgres_host + ':' + config.postgres_port + '/' + config.postgres_db
-logger.debug(app.config['SQLALCHEMY_DATABASE_URI'])
+api = Blueprint("api", __name__)
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-if config.drop_tables == "yes":
-	logger.debug("init drop = True")
-	init_db(db, app, drop=True)
-else:
-	logger.debug("init drop = False")
-	init_db(db, app, drop=False)
-
-
-@app.route("/status", methods=['GET'])
+@api.route("/status", methods=['GET'])
 def status():
 	return "Running"
 
 
+@api.route("/ready", methods=['GET'])
+def ready():
+	"""
+	Check if the warm-up tasks started with the application finished, e.g. the first patient synchronization.
+
+	:return: response: Readiness, status of the warm-up tasks and startup time.
+	"""
+	warmup = current_app.extensions["warmup"]
+	response = {
+		"ready": warmup.ready(),
+		"tasks": warmup.get_status(),
+		"startup": warmup.startup
+	}
+	return json.dumps(response, indent=3), 200 if response["ready"] else 503
+
+
 # Recommender calls
 
-@app.route("/recommender/update_patient_db", methods=['GET'])
+@api.route("/recommender/update_patient_db", methods=['GET'])
 def update():
 	"""
 	Update the patient database.
@@ -39,25 +49,20 @@ def update():
 	"""
 	response = {
 		"rec_patients": [],
-		"total": None
+		"total": None,
+		"sync": None
 	}
-	patients, total = RecommenderPatients.update_db()
+	patients, total, sync = RecommenderPatients.update_db()
 	if total:
 		response["total"] = total
+		response["sync"] = sync
 
 		for patient in patients:
 			response["rec_patients"].append(patient.get_dict())
 	return json.dumps(response, indent=3)
 
 
-scheduler = BackgroundScheduler()
-with app.app_context():
-	logger.info("First database update")
-	time.sleep(5)
-	update()
-
-
-@app.route("/recommender/update_par_day", methods=['POST'])
+@api.route("/recommender/update_par_day", methods=['POST'])
 def update_par():
 	"""
 	Update par day of specific patient.
@@ -75,24 +80,23 @@ def update_par():
 	patient_reference = data.get('patient_identity_management_key')
 	par_day = data.get('par_day')
 
-	with app.app_context():
-		patient = RecommenderPatients.get_by_ccdr_ref(patient_reference)
+	patient = RecommenderPatients.get_by_ccdr_ref(patient_reference)
 
-		if not patient:
-			return {
-				"status": "User doesn’t exist",
-				"statusCode": 1007
-			}
-		patient.par_day = par_day
-		patient.save()
+	if not patient:
+		return {
+			"status": "User doesn’t exist",
+			"statusCode": 1007
+		}
+	patient.par_day = par_day
+	patient.save()
 
-		response["patient_identity_management_key"] = patient_reference
-		response["par_day"] = par_day
+	response["patient_identity_management_key"] = patient_reference
+	response["par_day"] = par_day
 
 	return json.dumps(response, indent=3), 200
 
 
-@app.route("/recommender/update_par_day_total", methods=['GET'])
+@api.route("/recommender/update_par_day_total", methods=['GET'])
 def update_par_total():
 	"""
 	Updates par day of every patient
@@ -105,21 +109,64 @@ def update_par_total():
 		"total": None
 	}
 
-	with app.app_context():
-		patients, total = RecommenderPatients.update_db()
-		for patient in patients:
-			patient.par_day = 0
-			patient.save()
+	patients, total, _ = RecommenderPatients.update_db()
+	for patient in patients:
+		patient.par_day = 0
+		patient.save()
 
 	response["total"] = total
 
 	return json.dumps(response, indent=3), 200
 
 
+@api.route("/recommender/cache_stats", methods=['GET'])
+def cache_stats():
+	"""
+	Get the statistics of the upstream response caches.
+
+	:return: response: Size, hits, misses and evictions by cache.
+	"""
+	return json.dumps(cache.stats(), indent=3), 200
+
+
+@api.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+	"""
+	Get the metrics of the process in the Prometheus text format: upstream latency and errors, round duration and
+	patients, notifications, database commits and caches.
+
+	:return: Metrics text
+	"""
+	return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@api.route("/recommender/profiling", methods=['GET', 'POST'])
+def profiling_rounds():
+	"""
+	Profile the next run of a round, e.g. its next scheduled run. A single run triggered through its endpoint is
+	profiled with the profile=yes query parameter. Profiles are written to the profiles folder of the logs directory.
+
+	:return: response: Rounds profiled on their next run.
+	"""
+	if request.method == 'POST':
+		name = (request.get_json() or {}).get("round")
+		if name not in [job_id for job_id, _, _ in scheduled_rounds]:
+			return {
+				"status": "Unknown round",
+				"statusCode": 1010
+			}
+		profiling.arm(name)
+
+	response = {
+		"rounds": profiling.get_armed()
+	}
+	return json.dumps(response, indent=3), 200
+
+
 # Notifications calls
 
-@scheduler.scheduled_job('cron', id='update_and_par', day='*', hour='12', minute='13')
-@app.route("/notification/daily_par", methods=['GET'])
+@api.route("/notification/daily_par", methods=['GET'])
+@profiling.profiled("update_and_par")
 def daily_par():
 	"""
 	Send daily par notification to patients.
@@ -131,17 +178,50 @@ def daily_par():
 		"patients": None
 	}
 
-	with app.app_context():
-		update()
-		patients = RecommenderPatients.notifications_round(receiver="par")
-		if patients:
-			response["patients"] = patients
+	update()
+	patients = RecommenderPatients.notifications_round(receiver="par")
+	if patients:
+		response["patients"] = patients
+
+	# Refresh the patient activity in the background, it is read when PAR notifications are read
+	current_app.extensions["background"].submit(
+		"activity_refresh", app_job(current_app._get_current_object(), refresh_activity))
+
+	return json.dumps(response, indent=3), 200
+
+
+@api.route("/recommender/refresh_activity", methods=['GET'])
+def refresh_activity():
+	"""
+	Store the activity of every patient from their IPAQ questionnaires.
+
+	:return: response: Total number of patients refreshed.
+	"""
+	response = {
+		"patients": None
+	}
+
+	patients = RecommenderPatients.refresh_activity()
+	if patients:
+		response["patients"] = patients
 
 	return json.dumps(response, indent=3), 200
 
 
-@scheduler.scheduled_job('cron', id='game_notifications', day='*', hour='19', minute='15')
-@app.route("/notification/game_notifications", methods=['GET'])
+@api.route("/recommender/activity_report", methods=['GET'])
+def activity_report():
+	"""
+	Summarize the stored activity of the patients by organization.
+
+	:return: response: Activity category counts and mean MET value by organization.
+	"""
+	response = RecommenderPatients.activity_report()
+
+	return json.dumps(response, indent=3), 200
+
+
+@api.route("/notification/game_notifications", methods=['GET'])
+@profiling.profiled("game_notifications")
 def game_notifications():
 	"""
 	Send game notifications to patients.
@@ -153,17 +233,16 @@ def game_notifications():
 		"patients": None
 	}
 
-	with app.app_context():
-		update()
-		patients = RecommenderPatients.notifications_round(receiver="game")
-		if patients:
-			response["patients"] = patients
+	update()
+	patients = RecommenderPatients.game_round()
+	if patients:
+		response["patients"] = patients
 
 	return json.dumps(response, indent=3), 200
 
 
-@scheduler.scheduled_job('cron', id='daily_check_ipaq', day='*', hour='17', minute='35')
-@app.route("/notification/daily_check_ipaq", methods=['GET'])
+@api.route("/notification/daily_check_ipaq", methods=['GET'])
+@profiling.profiled("daily_check_ipaq")
 def weekly_check_ipaq():
 	"""
 	Check weekly IPAQ filled reminder to patients.
@@ -175,16 +254,15 @@ def weekly_check_ipaq():
 		"patients": None
 	}
 
-	with app.app_context():
-		patients = Notifications.check_ipaq()
-		if patients:
-			response["patients"] = patients
+	patients = Notifications.check_ipaq()
+	if patients:
+		response["patients"] = patients
 
 	return json.dumps(response, indent=3), 200
 
 
-@scheduler.scheduled_job('cron', id='weekly_goals', day='*', hour='10', minute='01')
-@app.route("/notification/weekly_goals", methods=['GET'])
+@api.route("/notification/weekly_goals", methods=['GET'])
+@profiling.profiled("weekly_goals")
 def weekly_goals():
 	"""
 	Send weekly goals to patients.
@@ -196,17 +274,16 @@ def weekly_goals():
 		"patients": None
 	}
 
-	with app.app_context():
-		update()
-		patients = RecommenderPatients.notifications_round(receiver="goals")
-		if patients:
-			response["patients"] = patients
+	update()
+	patients = RecommenderPatients.notifications_round(receiver="goals")
+	if patients:
+		response["patients"] = patients
 
 	return json.dumps(response, indent=3), 200
 
 
-@scheduler.scheduled_job('cron', id='scores_injection', day='*', hour='18', minute='32')
-@app.route("/notification/scores_injection", methods=['GET'])
+@api.route("/notification/scores_injection", methods=['GET'])
+@profiling.profiled("scores_injection")
 def schedule_scores_injection():
 	"""
 	Send scores injection to patients.
@@ -218,17 +295,16 @@ def schedule_scores_injection():
 		"patients": None
 	}
 
-	with app.app_context():
-		update()
-		patients = RecommenderPatients.notifications_round(receiver="multimodal")
-		if patients:
-			response["patients"] = patients
+	update()
+	patients = RecommenderPatients.notifications_round(receiver="multimodal")
+	if patients:
+		response["patients"] = patients
 
 	return json.dumps(response, indent=3), 200
 
 
-@scheduler.scheduled_job('cron', id='hydration', day='*', hour='11', minute='22')
-@app.route("/notification/hydration", methods=['GET'])
+@api.route("/notification/hydration", methods=['GET'])
+@profiling.profiled("hydration")
 def schedule_hydration():
 	"""
 	Send hydration notifications to patients.
@@ -240,17 +316,28 @@ def schedule_hydration():
 		"patients": None
 	}
 
-	with app.app_context():
-		update()
-		patients = RecommenderPatients.notifications_round(receiver="hydration")
-		if patients:
-			response["patients"] = patients
+	update()
+	patients = RecommenderPatients.notifications_round(receiver="hydration")
+	if patients:
+		response["patients"] = patients
+
+	return json.dumps(response, indent=3), 200
+
+
+@api.route("/notification/dispatch_outbox", methods=['GET'])
+def dispatch_outbox():
+	"""
+	Send the pending notifications of the outbox.
+
+	:return: response: Number of notifications sent, retried and failed.
+	"""
+	response = NotificationOutbox.dispatch()
 
 	return json.dumps(response, indent=3), 200
 
 
 # Send to the backend the unique identifier of the notification message when the user reads the notification
-@app.route("/notification/readStatus", methods=['POST'])
+@api.route("/notification/readStatus", methods=['POST'])
 def notification_read():
 	"""
 	Check notification as read.
@@ -260,22 +347,23 @@ def notification_read():
 	content = request.get_json()
 	notification_id = content.get("messageId")
 
-	with app.app_context():
-		if notification_id:
-			return Notifications.check_notification_status(notification_id)
-		else:
-			return {
-				"status": "Field can’t be null",
-				"statusCode": 1010
-			}
+	if notification_id:
+		return Notifications.check_notification_status(notification_id)
+	else:
+		return {
+			"status": "Field can’t be null",
+			"statusCode": 1010
+		}
 
 
 # This method is used to receive all the notification that have been sent to a patient in a specific organization,
 # as well as the read status of these notifications.
-@app.route("/notification/getNotifications", methods=['POST'])
+@api.route("/notification/getNotifications", methods=['POST'])
 def get_notifications():
 	"""
-	Get notifications as well as status notification.
+	Get notifications as well as status notification. With "limit", returns a page of notifications and the cursor
+	to request the next one in "after". With "stream", the list is streamed as it is read from the database, it cannot
+	be combined with "limit".
 
 	:return: List of notifications with information.
 	"""
@@ -286,37 +374,53 @@ def get_notifications():
 		organization = data.get("organization_code")
 		date_start = data.get("date_start")
 		date_end = data.get("date_end")
+		limit = data.get("limit")
+		after = data.get("after")
+		stream = data.get("stream")
+
+		if stream and limit:
+			# A streamed list has no room for the cursor of the next page
+			return {
+				"status": "Stream can’t be combined with limit",
+				"statusCode": 1011
+			}, 400
 
 		notifications = []
 
-		with app.app_context():
-			if patient_reference:
-				patient = RecommenderPatients.get_by_ccdr_ref(patient_reference)
-				if patient:
-					for notification in patient.get_notifications():
-						dates = [notification.datetime_sent, date_start, date_end]
-						notification_range = Notifications.check_timestamp(dates)
-						if notification_range:
-							notification_dict = notification.get_dict()
-							body = {
-								"message": notification_dict["msg"],
-								"date_sent": notification_dict["datetime_sent"],
-								"date_read": notification_dict["datetime_read"],
-								"isReadStatus": notification_dict["read"],
-								"user": patient_reference
-							}
-							notifications.append(body)
-					return json.dumps(notifications, indent=3), 200
-				else:
-					return {
-						"status": "User doesn’t exist",
-						"statusCode": 1007
+		if patient_reference:
+			patient = RecommenderPatients.get_by_ccdr_ref(patient_reference)
+			if patient:
+				query = Notifications.get_by_patient(
+					patient_reference, date_start, date_end, after, paginated=bool(limit or after))
+				if limit:
+					limit = min(int(limit), config.notifications_page_limit)
+					query = query.limit(limit)
+
+				if stream:
+					return Response(stream_with_context(stream_notifications(query)), mimetype="application/json")
+
+				last = None
+				for notification in query:
+					notifications.append(notification_body(notification))
+					last = notification
+
+				if limit:
+					response = {
+						"notifications": notifications,
+						"next": last.get_cursor() if len(notifications) == limit else None
 					}
+					return json.dumps(response), 200
+				return json.dumps(notifications, indent=3), 200
 			else:
 				return {
-					"status": "Field can’t be null",
-					"statusCode": 1010
+					"status": "User doesn’t exist",
+					"statusCode": 1007
 				}
+		else:
+			return {
+				"status": "Field can’t be null",
+				"statusCode": 1010
+			}
 	except Exception as e:
 		logger.error(e)
 		return {
@@ -325,7 +429,122 @@ def get_notifications():
 		}
 
 
-scheduler.start()
+def notification_body(notification):
+	"""
+	Get the notification information returned to the backend.
+
+	:param notification: Notification
+	:return: Notification information
+	"""
+	notification_dict = notification.get_dict()
+	return {
+		"message": notification_dict["msg"],
+		"date_sent": notification_dict["datetime_sent"],
+		"date_read": notification_dict["datetime_read"],
+		"isReadStatus": notification_dict["read"],
+		"user": notification_dict["patient"]
+	}
+
+
+def stream_notifications(query):
+	"""
+	Stream a JSON list of notifications as the rows come off the database cursor.
+
+	:param query: Query of notifications
+	:return: Generator of JSON chunks
+	"""
+	yield "["
+	separator = ""
+	try:
+		for notification in query.yield_per(config.notifications_stream_batch):
+			yield separator + json.dumps(notification_body(notification))
+			separator = ","
+	except Exception as e:
+		# The stream ends without closing the list, a truncated list must not look complete
+		logger.error("Streaming notifications: {}".format(e))
+		raise
+	yield "]"
+
+
+# Scheduled rounds: job id, function and cron fields
+scheduled_rounds = [
+	('update_and_par', daily_par, {"day": '*', "hour": '12', "minute": '13'}),
+	('game_notifications', game_notifications, {"day": '*', "hour": '19', "minute": '15'}),
+	('daily_check_ipaq', weekly_check_ipaq, {"day": '*', "hour": '17', "minute": '35'}),
+	('weekly_goals', weekly_goals, {"day": '*', "hour": '10', "minute": '01'}),
+	('scores_injection', schedule_scores_injection, {"day": '*', "hour": '18', "minute": '32'}),
+	('hydration', schedule_hydration, {"day": '*', "hour": '11', "minute": '22'}),
+]
+
+
+def create_app():
+	"""
+	Create the application: database, routes and scheduled rounds. The schema migrations and the first patient
+	synchronization run in the background after the application starts, /ready reports when they finished. The
+	scheduler starts once the migrations are applied.
+
+	:return: Application instance
+	"""
+	started = time.perf_counter()
+	app = Flask(__name__)
+	app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://' + config.postgres_user + ':' + config.postgres_pass + \
+											'@' + config.postgres_host + ':' + config.postgres_port + '/' + \
+											config.postgres_db
+	logger.debug(app.config['SQLALCHEMY_DATABASE_URI'])
+
+	app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+	# Every round worker holds its own session
+	app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {"pool_size": max(5, config.round_workers + 1)}
+
+	logger.debug("init drop = {}".format(config.drop_tables == "yes"))
+	init_db(db, app, drop=config.drop_tables == "yes")
+	app.register_blueprint(api)
+
+	if config.scheduler_mode == "cluster":
+		# Every cron job runs in a single process of the cluster
+		scheduler = ClusterScheduler(app, JobLease)
+	else:
+		scheduler = BackgroundScheduler()
+	for job_id, func, fields in scheduled_rounds:
+		scheduler.add_job(app_job(app, func), 'cron', id=job_id, **fields)
+	if config.notification_mode == "outbox":
+		scheduler.add_job(app_job(app, dispatch_outbox), 'interval', id='outbox_dispatch',
+						  seconds=config.outbox_interval)
+	app.extensions["scheduler"] = scheduler
+	# Rounds armed for profiling are shared by the processes, the one running the round profiles it
+	profiling.armed_rounds = ArmedRound
+	# Jobs started by the rounds, e.g. the activity refresh, also run when the scheduler is off
+	app.extensions["background"] = BackgroundJobs()
+
+	warmup = Warmup(app)
+	# Schema migrations and the category backfill run first, the scheduled rounds and the tasks that read the tables
+	# only run if they succeeded
+	warmup.add("migrations", partial(migrations.upgrade, db, app), required=True)
+	if config.scheduler_mode != "off":
+		warmup.add("scheduler", scheduler.start)
+	warmup.add("patients", update)
+	warmup.add("catalog", catalog.get_snapshot)
+	warmup.add("evaluation", warmup_evaluation)
+	app.extensions["warmup"] = warmup
+	warmup.start()
+
+	warmup.startup = round(time.perf_counter() - started, 3)
+	if warmup.startup > config.startup_budget:
+		logger.warning("Application created in {}s, over the startup budget of {}s".format(
+			warmup.startup, config.startup_budget))
+	else:
+		logger.info("Application created in {}s".format(warmup.startup))
+	return app
+
+
+def warmup_evaluation():
+	"""
+	Import the evaluation modules and NumPy, loaded on first use otherwise.
+
+	:return: None
+	"""
+	from models import evaluation, ipaq  # noqa: F401
+
 
 if __name__ == '__main__':
-	app.run(host=config.flask_host, port=config.flask_port)
+	create_app().run(host=config.flask_host, port=config.flask_port)
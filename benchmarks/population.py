@@ -0,0 +1,96 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+
+organizations = ["001", "002", "003", "004", "005", "006"]
+diagnoses = [None, "0", "1", "2", "3", "4", "5", "6", "7"]
+messages = {
+	"PAR": "Synthetic physical activity recommendation",
+	"IPAQ": "Synthetic IPAQ reminder",
+	"HYDRATION": "Synthetic hydration reminder",
+	"GOALS": "Synthetic weekly goals message",
+	"MULTIMODAL": "Synthetic multimodal message",
+	"GAME": "Synthetic game message",
+}
+
+
+def population(size, seed=1):
+	"""
+	Get a synthetic population of patients. Smaller populations of the same seed are a prefix of the larger ones.
+
+	:param size: Number of patients
+	:param seed: Seed of the synthetic data
+	:return: List of patients
+	"""
+	generator = random.Random("{}:population".format(seed))
+	patients = []
+	for index in range(size):
+		patients.append({
+			"ccdr_reference": "BENCH{:07d}".format(index),
+			"organization": generator.choice(organizations),
+			"par_day": generator.randint(0, 40),
+			# Patients removed from the central database are kept inactive
+			"status": generator.random() >= 0.05,
+			"diagnosis": generator.choice(diagnoses),
+		})
+	return patients
+
+
+def notifications(patient, count, generator, now):
+	"""
+	Get the stored notifications of a patient. The last one was sent yesterday, so some patients are due for the IPAQ
+	check.
+
+	:param patient: Synthetic patient
+	:param count: Number of notifications
+	:param generator: Random generator
+	:param now: Current date and time
+	:return: List of notifications
+	"""
+	rows = []
+	for index in range(count):
+		kind = generator.choice(list(messages))
+		category = "PAR/{}".format(generator.randint(1, 40)) if kind == "PAR" else kind
+		sent = now - timedelta(days=1 if index == count - 1 else generator.randint(2, 40),
+							   seconds=generator.randint(0, 86399))
+		read = generator.random() < 0.6
+		rows.append({
+			"id": str(uuid.UUID(int=generator.getrandbits(128), version=4)),
+			"read": read,
+			"msg": messages[kind],
+			"datetime_sent": sent,
+			"datetime_read": sent + timedelta(hours=generator.randint(1, 48)) if read else None,
+			"receiver": "mobile",
+			"patient": patient["ccdr_reference"],
+			"category": category,
+		})
+	return rows
+
+
+def seed_database(session, patients, notifications_per_patient=5, seed=1, chunk=5000):
+	"""
+	Insert the synthetic population and its stored notifications with multi-row inserts, in chunks.
+
+	:param session: Database session
+	:param patients: Synthetic population
+	:param notifications_per_patient: Stored notifications of every patient
+	:param seed: Seed of the synthetic data
+	:param chunk: Patients by insert
+	:return: Number of notifications inserted
+	"""
+	from models.patients import Notifications, RecommenderPatients
+
+	generator = random.Random("{}:notifications".format(seed))
+	now = datetime.now()
+	inserted = 0
+	for start in range(0, len(patients), chunk):
+		rows = patients[start:start + chunk]
+		session.execute(RecommenderPatients.__table__.insert(), rows)
+		stored = []
+		for patient in rows:
+			stored.extend(notifications(patient, notifications_per_patient, generator, now))
+		if stored:
+			session.execute(Notifications.__table__.insert(), stored)
+		inserted = inserted + len(stored)
+		session.commit()
+	return inserted
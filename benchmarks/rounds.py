@@ -0,0 +1,336 @@
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager, nullcontext
+from functools import partial, wraps
+
+from benchmarks import stubs
+
+upstream_variables = ["CCDR_URL", "IDM_URL", "RMQ_URL", "ACTIONLIB_URL", "FUSIONLIB_URL", "BACKEND_URL"]
+receivers = ["par", "game", "goals", "multimodal", "hydration"]
+benchmark_names = ["update_db", "check_ipaq"] + receivers + ["game_round"]
+
+
+class RoundTrips:
+	"""
+	Count the database round trips of the process: statements, commits, rollbacks and connection resets. Executemany
+	inserts are sent by pages of multi-row statements, other executemany statements take a round trip by row.
+	"""
+
+	def __init__(self):
+		self.count = 0
+		self.lock = threading.Lock()
+
+	def add(self, amount=1):
+		"""
+		:param amount: Round trips
+		:return: None
+		"""
+		with self.lock:
+			self.count = self.count + amount
+
+	def listen(self):
+		"""
+		Count the round trips of every engine.
+
+		:return: None
+		"""
+		from sqlalchemy import event
+		from sqlalchemy.engine import Engine
+		from sqlalchemy.pool import Pool
+
+		@event.listens_for(Engine, "before_cursor_execute")
+		def count_statement(connection, cursor, statement, parameters, context, executemany):
+			if not executemany:
+				self.add()
+				return
+			page_size = getattr(connection.dialect, "executemany_values_page_size", None)
+			if page_size and statement.lstrip()[:6].upper() == "INSERT":
+				self.add(math.ceil(len(parameters) / page_size))
+			else:
+				self.add(len(parameters))
+
+		@event.listens_for(Engine, "commit")
+		def count_commit(connection):
+			self.add()
+
+		@event.listens_for(Engine, "rollback")
+		def count_rollback(connection):
+			self.add()
+
+		@event.listens_for(Pool, "reset")
+		def count_reset(dbapi_connection, connection_record):
+			self.add()
+
+
+@contextmanager
+def timed(cls, name, latencies):
+	"""
+	Record the duration of every call of a method, the per-patient unit of work of a round.
+
+	:param cls: Class
+	:param name: Method name, static methods included
+	:param latencies: Array of durations
+	:return: None
+	"""
+	original = cls.__dict__[name]
+	func = original.__func__ if isinstance(original, staticmethod) else original
+
+	@wraps(func)
+	def run(*args, **kwargs):
+		started = time.perf_counter()
+		try:
+			return func(*args, **kwargs)
+		finally:
+			latencies.append(time.perf_counter() - started)
+
+	setattr(cls, name, staticmethod(run) if isinstance(original, staticmethod) else run)
+	try:
+		yield
+	finally:
+		setattr(cls, name, original)
+
+
+def percentile(values, fraction):
+	"""
+	Get a percentile with the nearest-rank method.
+
+	:param values: Sorted list of values
+	:param fraction: Percentile, between 0 and 1
+	:return: Value, None if there are no values
+	"""
+	if not values:
+		return None
+	return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def reset_peak_rss():
+	"""
+	Reset the peak resident set size of the process, so peak_rss reports the peak of the next benchmark and not the
+	peak of the process so far. Only Linux can reset it.
+
+	:return: True if the peak was reset
+	"""
+	try:
+		with open("/proc/self/clear_refs", "w") as clear_refs:
+			clear_refs.write("5")
+		return True
+	except OSError:
+		return False
+
+
+def memory_status(field):
+	"""
+	Get a memory size of the process, e.g. VmRSS for the resident set size and VmHWM for its peak since the last
+	reset.
+
+	:param field: Field of /proc/self/status
+	:return: Megabytes
+	"""
+	with open("/proc/self/status") as status:
+		for line in status:
+			if line.startswith(field + ":"):
+				return int(line.split()[1]) / 1024
+	return None
+
+
+def database_uri(config, name):
+	"""
+	:param config: Configuration module
+	:param name: Database name
+	:return: Database URI
+	"""
+	return "postgresql://{}:{}@{}:{}/{}".format(
+		config.postgres_user, config.postgres_pass, config.postgres_host, config.postgres_port, name)
+
+
+def create_database(config, name):
+	"""
+	Create the benchmark database if it does not exist.
+
+	:param config: Configuration module
+	:param name: Database name
+	:return: None
+	"""
+	from sqlalchemy import create_engine, text
+
+	engine = create_engine(database_uri(config, "postgres"), isolation_level="AUTOCOMMIT")
+	with engine.connect() as connection:
+		exists = connection.execute(
+			text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": name}).scalar()
+		if exists is None:
+			connection.execute(text('CREATE DATABASE "{}" ENCODING \'UTF8\' TEMPLATE template0'.format(name)))
+	engine.dispose()
+
+
+def run(args, url):
+	"""
+	Seed every population size and run the benchmarks against the stub upstreams.
+
+	:param args: Command line arguments
+	:param url: Base URL of the stub upstreams
+	:return: List of results
+	"""
+	# The configuration and the upstream clients read the environment when they are imported
+	import requests
+	from flask import Flask
+
+	from benchmarks.population import population, seed_database
+	from helper import cache, config
+	from helper.utils import logger
+	from models import migrations
+	from models.patients import Notifications, RecommenderPatients, db
+
+	if args.database == config.postgres_db:
+		raise SystemExit("The benchmark drops its tables, use a database other than {}".format(config.postgres_db))
+	# Every patient of the population takes part in the rounds
+	config.test_flag = False
+	if not args.verbose:
+		logger.setLevel(logging.WARNING)
+
+	create_database(config, args.database)
+	app = Flask("benchmark")
+	app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(config, args.database)
+	app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+	app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {"pool_size": max(5, config.round_workers + 1)}
+	db.init_app(app)
+
+	round_trips = RoundTrips()
+	round_trips.listen()
+
+	# Benchmarks and their per-patient unit of work, timed to get the latencies and the patients processed
+	benchmarks = {
+		"update_db": (RecommenderPatients.update_db, None),
+		"check_ipaq": (Notifications.check_ipaq, (Notifications, "get_ipaq_date")),
+		"game_round": (RecommenderPatients.game_round, (RecommenderPatients, "game_notification")),
+	}
+	for receiver in receivers:
+		benchmarks[receiver] = (
+			partial(RecommenderPatients.notifications_round, receiver), (RecommenderPatients, "notify"))
+
+	def upstream_requests():
+		return requests.get(url + "/benchmark/requests").json()["requests"]
+
+	results = []
+	for size in args.sizes:
+		patients = population(size, args.seed)
+		active = sum(1 for patient in patients if patient["status"])
+		with app.app_context():
+			db.drop_all()
+			db.create_all()
+		migrations.upgrade(db, app)
+		started = time.perf_counter()
+		with app.app_context():
+			stored = seed_database(db.session, patients, args.notifications, args.seed)
+		print("Seeded {} patients ({} active) and {} notifications in {:.1f}s".format(
+			size, active, stored, time.perf_counter() - started), flush=True)
+		print(row(None), flush=True)
+
+		requests.post(url + "/benchmark/population", json={"size": size})
+		for response_cache in list(cache.caches.values()):
+			response_cache.clear()
+
+		for name in args.benchmarks:
+			func, unit = benchmarks[name]
+			latencies = array("d")
+			trips, calls = round_trips.count, upstream_requests()
+			rss = memory_status("VmRSS") if reset_peak_rss() else None
+			with app.app_context():
+				with timed(*unit, latencies) if unit else nullcontext():
+					started = time.perf_counter()
+					returned = func()
+					seconds = time.perf_counter() - started
+			# Every patient of the database is synchronized, the rounds only process some of them
+			processed = len(latencies) if unit else returned[1]
+			latencies = sorted(latencies)
+			peak = None if rss is None else memory_status("VmHWM")
+			p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+			result = {
+				"size": size,
+				"benchmark": name,
+				"seconds": round(seconds, 3),
+				"patients": processed,
+				"patients_per_second": round(processed / seconds, 1) if seconds else None,
+				"p50_ms": None if p50 is None else round(p50 * 1000, 2),
+				"p99_ms": None if p99 is None else round(p99 * 1000, 2),
+				"db_round_trips": round_trips.count - trips,
+				"upstream_requests": upstream_requests() - calls,
+				"peak_rss_mb": None if peak is None else round(peak, 1),
+				"rss_growth_mb": None if peak is None else round(peak - rss, 1),
+			}
+			results.append(result)
+			print(row(result), flush=True)
+	return results
+
+
+columns = [
+	("size", "{:>8}"), ("benchmark", "{:<12}"), ("seconds", "{:>9}"), ("patients", "{:>8}"),
+	("patients_per_second", "{:>11}"), ("p50_ms", "{:>9}"), ("p99_ms", "{:>9}"), ("db_round_trips", "{:>10}"),
+	("upstream_requests", "{:>10}"), ("peak_rss_mb", "{:>9}"), ("rss_growth_mb", "{:>9}"),
+]
+headers = {"patients_per_second": "patients/s", "db_round_trips": "db trips", "upstream_requests": "upstream",
+		   "peak_rss_mb": "rss (MB)", "rss_growth_mb": "+rss (MB)"}
+
+
+def row(result):
+	"""
+	:param result: Benchmark result, or None for the header
+	:return: Table row
+	"""
+	if result is None:
+		return " ".join(text.format(headers.get(name, name)) for name, text in columns)
+	return " ".join(text.format("-" if result[name] is None else result[name]) for name, text in columns)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+		description="Benchmark the rounds on a synthetic population, against local stub upstreams.")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Population sizes")
+	parser.add_argument("--benchmarks", nargs="+", default=benchmark_names, choices=benchmark_names,
+						help="Benchmarks, in the order they run")
+	parser.add_argument("--notifications", type=int, default=5, help="Stored notifications by patient")
+	parser.add_argument("--workers", type=int, default=1, help="Round workers (ROUND_WORKERS)")
+	parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every upstream response")
+	parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic data")
+	parser.add_argument("--database", default="procare_benchmark", help="Database, created if it does not exist")
+	parser.add_argument("--output", help="JSON file for the results")
+	parser.add_argument("--verbose", action="store_true", help="Keep the info logs of the rounds")
+	args = parser.parse_args(argv)
+
+	# The stub upstreams do not share the interpreter lock and the memory of the measured process
+	connection, stub_connection = multiprocessing.Pipe()
+	process = multiprocessing.Process(
+		target=stubs.serve, args=(args.seed, args.latency, stub_connection), name="stub-upstreams", daemon=True)
+	process.start()
+	url = connection.recv()
+	for variable in upstream_variables:
+		os.environ[variable] = url
+	os.environ["ROUND_WORKERS"] = str(args.workers)
+
+	try:
+		results = run(args, url)
+	finally:
+		connection.send("stop")
+		process.join(5)
+
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as output_file:
+			json.dump({
+				"seed": args.seed,
+				"workers": args.workers,
+				"latency": args.latency,
+				"notifications": args.notifications,
+				"python": sys.version.split()[0],
+				"results": results,
+			}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,276 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.population import population
+
+score_keys = ["css", "mfs", "mis", "pas", "ss"]
+deviation_keys = ["amf", "dca", "dpa", "sd", "ovd"]
+survey_date_format = "%a %b %d %H:%M:%S UTC %Y"
+
+
+class StubUpstreams:
+	"""
+	Local HTTP server answering every upstream endpoint (CCDR, IDM, RMQ, ActionLib and FusionLib) with synthetic data.
+	Responses only depend on the seed and the patient, so runs are reproducible.
+	"""
+
+	def __init__(self, seed=1, latency=0.0):
+		"""
+		:param seed: Seed of the synthetic data
+		:param latency: Seconds added to every response
+		"""
+		self.seed = seed
+		self.latency = latency
+		self.patients = b"[]"
+		self.requests = 0
+		self.lock = threading.Lock()
+		self.server = None
+		self.routes = {
+			"/api/v1/mobile/patient": self.patient_list,
+			"/getPilotThreePatientKeys": self.patient_keys,
+			"/api/v1/profile/getDiagnosis": self.diagnosis,
+			"/api/v1/web/questionnaire/getPatientQuestionnairesResponses": self.questionnaires,
+			"/api/v1/mobile/surveys/get_response/7.2": self.ipaq_responses,
+			"/api/v1/game/getSummarizationList": self.summarization_list,
+			"/api/v1/mobile/prescription/list/": self.prescriptions,
+			"/api/v1/par/getWeeklySteps": self.weekly_steps,
+			"/api/v1/fusionlib/getWeeklyScores": self.weekly_scores,
+			"/generate_scores": self.scores,
+			"/generate_deviations": self.deviations,
+			"/findUserByIdentityKey": self.identity,
+			"/notification/sendNotifications": self.notification,
+			"/notification/sendNotificationToMedicalProfessionalByPatient": self.notification,
+			# Control of the benchmark, when the server runs in its own process
+			"/benchmark/population": self.control_population,
+			"/benchmark/requests": self.control_requests,
+		}
+
+	def start(self):
+		"""
+		Start the server in a background thread on a free local port.
+
+		:return: Base URL of the server
+		"""
+		stubs = self
+
+		class Handler(BaseHTTPRequestHandler):
+			# Keep-alive, as the upstream connection pools do
+			protocol_version = "HTTP/1.1"
+			# Headers and body are written separately, delayed acknowledgements would add 40ms to every response
+			disable_nagle_algorithm = True
+
+			def log_message(self, *args):
+				pass
+
+			def do_GET(self):
+				stubs.handle(self, None)
+
+			def do_POST(self):
+				length = int(self.headers.get("Content-Length") or 0)
+				stubs.handle(self, json.loads(self.rfile.read(length) or b"null"))
+
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.server.daemon_threads = True
+		threading.Thread(target=self.server.serve_forever, name="stub-upstreams", daemon=True).start()
+		return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+	def stop(self):
+		"""
+		Stop the server.
+
+		:return: None
+		"""
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
+
+	def set_population(self, population):
+		"""
+		Set the patients returned by CCDR and IDM.
+
+		:param population: List of synthetic patients
+		:return: None
+		"""
+		self.patients = json.dumps([
+			{"identity_management_key": patient["ccdr_reference"], "organization_code": patient["organization"],
+			 "organization": patient["organization"]}
+			for patient in population if patient["status"]]).encode()
+
+	def handle(self, handler, body):
+		"""
+		Answer a request.
+
+		:param handler: Request handler
+		:param body: JSON body, None for GET requests
+		:return: None
+		"""
+		with self.lock:
+			self.requests = self.requests + 1
+		if self.latency:
+			time.sleep(self.latency)
+
+		url = urlparse(handler.path)
+		route = self.routes.get(url.path)
+		if route is None:
+			payload, status = b'{"error": "not found"}', 404
+		else:
+			query = {key: values[0] for key, values in parse_qs(url.query).items()}
+			payload, status = route(body or {}, query), 200
+			if not isinstance(payload, bytes):
+				payload = json.dumps(payload).encode()
+
+		handler.send_response(status)
+		handler.send_header("Content-Type", "application/json")
+		handler.send_header("Content-Length", str(len(payload)))
+		handler.end_headers()
+		handler.wfile.write(payload)
+
+	def random(self, reference, endpoint):
+		"""
+		Get the random generator of a patient and endpoint.
+
+		:param reference: Patient identification
+		:param endpoint: Endpoint name
+		:return: Random generator
+		"""
+		return random.Random("{}:{}:{}".format(self.seed, endpoint, reference))
+
+	def control_population(self, body, query):
+		self.set_population(population(body["size"], self.seed))
+		return {"size": body["size"]}
+
+	def control_requests(self, body, query):
+		with self.lock:
+			return {"requests": self.requests}
+
+	def patient_list(self, body, query):
+		return self.patients
+
+	def patient_keys(self, body, query):
+		return self.patients
+
+	def diagnosis(self, body, query):
+		generator = self.random(body.get("identity_management_key"), "diagnosis")
+		return {"diagnosis": str(generator.randint(0, 7))}
+
+	def questionnaires(self, body, query):
+		reference = body.get("identity_management_key")
+		generator = self.random(reference, "questionnaires")
+		now = datetime.now()
+		responses = []
+		for week in range(generator.randint(0, 3)):
+			answers = [generator.choice([0, 1, 2, 3, 5]) for _ in range(5)] + [generator.choice([0, 10, 30, 60])] + \
+					  [generator.choice([0, 2, 4]), generator.choice([0, 20, 45]), generator.choice([0, 30, 90]),
+					   generator.choice([2, 4, 6, 8]), generator.choice([0, 15, 30])]
+			responses.append({
+				"survey_id": "7.2",
+				"date": (now - timedelta(days=7 * week + generator.randint(0, 6))).strftime(survey_date_format),
+				"answers": [{"question_id": index, "text_input_value": str(value)} for index, value in enumerate(answers)]
+			})
+		return responses
+
+	def ipaq_responses(self, body, query):
+		generator = self.random(query.get("identity_management_key"), "ipaq")
+		if generator.random() < 0.2:
+			return []
+		filled = datetime.now() - timedelta(days=generator.randint(0, 10))
+		return [{"date": filled.strftime(survey_date_format)}]
+
+	def summarization_list(self, body, query):
+		generator = self.random(body.get("identity_management_key"), "games")
+		start = datetime.strptime(body["startDate"], "%d-%m-%Y").date()
+		end = datetime.strptime(body["endDate"], "%d-%m-%Y").date()
+		days = []
+		day = start
+		while day <= end:
+			days.append(StubUpstreams.summarization_day(generator, day))
+			day = day + timedelta(days=1)
+		return days
+
+	@staticmethod
+	def summarization_day(generator, day):
+		"""
+		Get the game sessions of a day.
+
+		:param generator: Random generator
+		:param day: Date
+		:return: Summarization day
+		"""
+		if generator.random() < 0.3:
+			return {"date": day.strftime("%d-%m-%Y"), "session_info": None}
+		sessions = []
+		for _ in range(generator.randint(1, 4)):
+			game = generator.choice("123456")
+			levels = game in "156"
+			sessions.append({
+				"id": "G" + game,
+				"category": generator.choice(["a", "b", "c", "d"]) if levels else None,
+				"level": generator.choice([1, 2, 3]) if levels else None,
+				"app_language": generator.choice(["en", "de", "es"]),
+				"app_style": generator.choice(["light", "dark"]),
+				"app_textsize": generator.choice([1, 2]),
+				"metric_global": round(generator.random(), 3),
+				"metric_score": round(generator.random(), 3),
+				"metric_time": round(generator.random(), 3),
+				"metric_interaction": round(generator.random(), 3),
+				"avg_time_between_clicks": generator.choice([2, 4, 6, 8, 10]),
+			})
+		return {
+			"date": day.strftime("%d-%m-%Y"),
+			"session_info": sessions,
+			"session_interaction_results": {
+				"nclicks_game_start": generator.randint(0, 12), "nclicks_game_restart": generator.randint(0, 3)}
+		}
+
+	def prescriptions(self, body, query):
+		generator = self.random(body.get("identity_management_key"), "prescriptions")
+		return [{"medicine": "M{}".format(index)} for index in range(generator.randint(0, 2))]
+
+	def weekly_steps(self, body, query):
+		generator = self.random(body.get("identity_management_key"), "steps")
+		objective = generator.choice([20000, 35000, 50000])
+		steps = generator.randint(5000, 60000)
+		return {"reached_goal": steps >= objective, "weekly_steps": steps,
+				"reached_goal_daily": generator.randint(0, 7), "weekly_objective": objective}
+
+	def weekly_scores(self, body, query):
+		generator = self.random(body.get("patient_identity_management_key"), "previous_scores")
+		return {"scores": {key: {"score": generator.choice([0, 0.25, 0.5, 0.75, 1])} for key in score_keys}}
+
+	def scores(self, body, query):
+		generator = self.random(body.get("patient_identity_management_key"), "scores")
+		return {"scores": {key: generator.choice([0, 0.25, 0.5, 0.75, 1]) for key in score_keys}}
+
+	def deviations(self, body, query):
+		generator = self.random(body.get("patient_identity_management_key"), "deviations")
+		return {"deviations": {key: round(generator.random(), 2) for key in deviation_keys}}
+
+	def identity(self, body, query):
+		return {"username": "user-{}".format(body.get("identity_management_key"))}
+
+	def notification(self, body, query):
+		return {"status": "sent"}
+
+
+def serve(seed, latency, connection):
+	"""
+	Run the stub upstreams in their own process, so they do not share the interpreter lock and memory of the measured
+	process.
+
+	:param seed: Seed of the synthetic data
+	:param latency: Seconds added to every response
+	:param connection: Pipe connection receiving the base URL, the process stops when it is closed
+	:return: None
+	"""
+	stubs = StubUpstreams(seed, latency)
+	connection.send(stubs.start())
+	try:
+		connection.recv()
+	except EOFError:
+		pass
+	stubs.stop()
@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Caches by name, for the statistics endpoint
+caches = {}
+
+
+class TTLCache:
+	"""
+	Thread-safe cache with time to live and least recently used eviction. Entries with tuple keys are also grouped by
+	the first element of the key, so related entries can be searched without scanning the whole cache.
+	"""
+
+	def __init__(self, name, maxsize, ttl):
+		"""
+		:param name: Cache name
+		:param maxsize: Maximum number of entries
+		:param ttl: Seconds an entry is valid
+		"""
+		self.name = name
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.entries = OrderedDict()
+		self.groups = {}
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		caches[name] = self
+
+	@staticmethod
+	def group_of(key):
+		"""
+		Get the group of a key.
+
+		:param key: Cache key
+		:return: First element of tuple keys, otherwise None
+		"""
+		return key[0] if isinstance(key, tuple) and key else None
+
+	def get(self, key, default=None):
+		"""
+		Get an entry of the cache.
+
+		:param key: Cache key
+		:param default: Value returned if the key is missing or expired
+		:return: Cached value
+		"""
+		with self.lock:
+			value = self._lookup(key)
+			if value is not None:
+				self.hits = self.hits + 1
+				return value[0]
+			self.misses = self.misses + 1
+			return default
+
+	def find(self, group, match, default=None):
+		"""
+		Get the first entry of a group whose key matches.
+
+		:param group: First element of the keys
+		:param match: Function called with the key, returns True if the entry can be used
+		:param default: Value returned if no entry matches
+		:return: Matching key and cached value, or None and the default value
+		"""
+		with self.lock:
+			for key in list(self.groups.get(group, ())):
+				if match(key):
+					value = self._lookup(key)
+					if value is not None:
+						self.hits = self.hits + 1
+						return key, value[0]
+			self.misses = self.misses + 1
+			return None, default
+
+	def set(self, key, value):
+		"""
+		Add or replace an entry, evicting the least recently used entries if the cache is full.
+
+		:param key: Cache key
+		:param value: Value to cache
+		:return: None
+		"""
+		with self.lock:
+			self._remove(key)
+			self.entries[key] = (value, time.monotonic() + self.ttl)
+			self.groups.setdefault(TTLCache.group_of(key), set()).add(key)
+			while len(self.entries) > self.maxsize:
+				self._remove(next(iter(self.entries)))
+				self.evictions = self.evictions + 1
+
+	def clear(self):
+		"""
+		Remove every entry of the cache.
+
+		:return: None
+		"""
+		with self.lock:
+			self.entries.clear()
+			self.groups.clear()
+
+	def stats(self):
+		"""
+		Get the cache statistics.
+
+		:return: Dictionary with size, hits, misses and evictions
+		"""
+		with self.lock:
+			return {
+				"size": len(self.entries),
+				"maxsize": self.maxsize,
+				"ttl": self.ttl,
+				"hits": self.hits,
+				"misses": self.misses,
+				"evictions": self.evictions
+			}
+
+	def _lookup(self, key):
+		"""
+		Get an entry and mark it as recently used. Expired entries are removed. The lock must be held.
+
+		:param key: Cache key
+		:return: Tuple with the cached value, or None if the key is missing or expired
+		"""
+		entry = self.entries.get(key)
+		if entry is None:
+			return None
+		if entry[1] <= time.monotonic():
+			self._remove(key)
+			return None
+		self.entries.move_to_end(key)
+		return entry[0],
+
+	def _remove(self, key):
+		"""
+		Remove an entry if present. The lock must be held.
+
+		:param key: Cache key
+		:return: None
+		"""
+		if self.entries.pop(key, None) is not None:
+			group = TTLCache.group_of(key)
+			keys = self.groups.get(group)
+			if keys is not None:
+				keys.discard(key)
+				if not keys:
+					del self.groups[group]
+
+
+def stats():
+	"""
+	Get the statistics of every cache.
+
+	:return: Dictionary of statistics by cache name
+	"""
+	return {name: cache.stats() for name, cache in caches.items()}
@@ -0,0 +1,261 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from string import Formatter
+
+from helper import config
+from helper.utils import logger
+
+languages = ["en", "de", "es", "it", "pt", "ro"]
+
+# Catalog files by category. General notifications hold one category per entry (IPAQ, MOTIVATION, ...).
+catalog_files = {
+	"GENERAL": "general_notifications.json",
+	"PAR": "par_notifications.json",
+	"IEQ": "ieq_notifications.json",
+	"GAME": "game_notifications.json",
+	"MULTIMODAL": "multimodal_notifications.json",
+}
+
+
+class CatalogError(ValueError):
+	pass
+
+
+class Template:
+	"""
+	Notification message compiled once: the text is interned and its placeholders are parsed when the catalog is
+	loaded, so malformed messages are rejected before any notification is sent.
+	"""
+	__slots__ = ("text", "fields")
+
+	def __init__(self, text):
+		self.text = sys.intern(text)
+		self.fields = sum(1 for parsed in Formatter().parse(text) if parsed[1] is not None)
+
+	def render(self, *args):
+		"""
+		Render the message with the values of the placeholders.
+
+		:param args: Positional values
+		:return: Message
+		"""
+		if not self.fields:
+			return self.text
+		return self.text.format(*args)
+
+
+class CatalogSnapshot:
+	"""
+	Validated content of every catalog file. Snapshots are never modified, a reload builds a new one.
+	"""
+
+	def __init__(self, files):
+		"""
+		:param files: Dictionary of file paths by category
+		"""
+		self.templates = {}
+		self.messages = {}
+		self.patterns = []
+		self.mtimes = {}
+
+		for category, path in files.items():
+			self.mtimes[path] = os.path.getmtime(path)
+			with open(path, encoding='utf-8') as json_file:
+				content = json.load(json_file)
+			if not isinstance(content, dict):
+				raise CatalogError("{}: the catalog must be an object".format(path))
+
+			for key, entry in content.items():
+				if not isinstance(entry, dict):
+					raise CatalogError("{}: {} must be an object".format(path, key))
+				if category == "GENERAL":
+					if CatalogSnapshot.is_language_entry(entry):
+						self.add(path, key, None, entry)
+					else:
+						for subkey, subentry in entry.items():
+							self.add(path, key, subkey, subentry)
+				else:
+					self.add(path, category, key, entry)
+
+	@staticmethod
+	def is_language_entry(entry):
+		"""
+		Check if the entry holds the messages of every language.
+
+		:param entry: Catalog entry
+		:return: Boolean value
+		"""
+		return isinstance(entry, dict) and all(not isinstance(value, dict) for value in entry.values())
+
+	def add(self, path, category, key, entry):
+		"""
+		Validate and compile the messages of an entry.
+
+		:param path: Catalog file
+		:param category: Notification category
+		:param key: Key in the category, None for single message categories
+		:param entry: Messages by language
+		:return: None
+		"""
+		category_key = Catalog.category_key(category, key)
+		if not CatalogSnapshot.is_language_entry(entry):
+			raise CatalogError("{}: {} must map languages to messages".format(path, category_key))
+		missing = [language for language in languages if language not in entry]
+		if missing:
+			logger.warning("{}: {} has no message for {}".format(path, category_key, ", ".join(missing)))
+
+		compiled = {}
+		for language, value in entry.items():
+			if isinstance(value, str):
+				items = [value]
+			elif isinstance(value, list) and all(isinstance(item, str) for item in value):
+				items = value
+			else:
+				raise CatalogError("{}: {}/{} must be a message or a list of messages".format(
+					path, category_key, language))
+
+			try:
+				templates = [Template(item) for item in items]
+			except ValueError as e:
+				raise CatalogError("{}: {}/{} is not a valid template: {}".format(path, category_key, language, e))
+
+			# Lists hold one message per diagnosis
+			compiled[language] = templates[0] if isinstance(value, str) else tuple(templates)
+			for item in items:
+				self.index(category_key, item)
+		self.templates[category_key] = compiled
+
+	def index(self, category_key, message):
+		"""
+		Add a message to the reverse index. Messages with placeholders are matched with regular expressions.
+
+		:param category_key: Category key of the message
+		:param message: Message
+		:return: None
+		"""
+		if not message:
+			return
+		if "{}" in message:
+			pattern = ".*".join(re.escape(part) for part in message.split("{}"))
+			self.patterns.append((re.compile(pattern + "$", re.DOTALL), category_key))
+		else:
+			self.messages.setdefault(sys.intern(message), category_key)
+
+
+class Catalog:
+	"""
+	Notification catalogs, loaded on first use and reloaded atomically when a file changes.
+	"""
+
+	def __init__(self, directory, reload_interval=None):
+		"""
+		:param directory: Directory of the catalog files
+		:param reload_interval: Minimum seconds between file modification checks
+		"""
+		self.files = {category: os.path.join(directory, name) for category, name in catalog_files.items()}
+		self.reload_interval = config.catalog_reload_interval if reload_interval is None else reload_interval
+		self.snapshot = None
+		self.checked = 0
+		self.lock = threading.Lock()
+
+	@staticmethod
+	def category_key(category, key):
+		"""
+		Get the category key stored with the notifications, e.g. PAR/17 or IPAQ.
+
+		:param category: Notification category
+		:param key: Key in the category
+		:return: Category key
+		"""
+		return category if key is None else category + "/" + str(key)
+
+	def get_snapshot(self):
+		"""
+		Get the current catalogs, reloading them if any file was modified.
+
+		:return: CatalogSnapshot
+		"""
+		snapshot = self.snapshot
+		if snapshot is None or time.monotonic() - self.checked >= self.reload_interval:
+			with self.lock:
+				if self.snapshot is None:
+					self.snapshot = CatalogSnapshot(self.files)
+				elif time.monotonic() - self.checked >= self.reload_interval:
+					self.reload()
+				self.checked = time.monotonic()
+				snapshot = self.snapshot
+		return snapshot
+
+	def reload(self):
+		"""
+		Replace the catalogs if a file was modified. Invalid files keep the previous catalogs.
+
+		:return: None
+		"""
+		try:
+			changed = any(os.path.getmtime(path) != mtime for path, mtime in self.snapshot.mtimes.items())
+			if changed:
+				self.snapshot = CatalogSnapshot(self.files)
+				logger.info("Notification catalogs reloaded")
+		except (OSError, ValueError) as e:
+			logger.error("Notification catalogs not reloaded: {}".format(e))
+
+	def message(self, category, key, language):
+		"""
+		Get the message, or the list of messages by diagnosis, without rendering it.
+
+		:param category: Notification category
+		:param key: Key in the category, None for single message categories
+		:param language: Country code of the message
+		:return: Message or tuple of messages
+		"""
+		template = self.get_snapshot().templates[Catalog.category_key(category, key)][language]
+		if isinstance(template, tuple):
+			return tuple(item.text for item in template)
+		return template.text
+
+	def render(self, category, key, language, *args):
+		"""
+		Render the message with the values of its placeholders.
+
+		:param category: Notification category
+		:param key: Key in the category, None for single message categories
+		:param language: Country code of the message
+		:param args: Positional values
+		:return: Message
+		"""
+		return self.get_snapshot().templates[Catalog.category_key(category, key)][language].render(*args)
+
+	def entry(self, category, key, language, *args):
+		"""
+		Render the message and return it with its category key.
+
+		:param category: Notification category
+		:param key: Key in the category
+		:param language: Country code of the message
+		:param args: Positional values
+		:return: Category key and message
+		"""
+		return Catalog.category_key(category, key), self.render(category, key, language, *args)
+
+	def category_of(self, message):
+		"""
+		Get the category key of a message from the reverse index.
+
+		:param message: Message
+		:return: Category key, or None if the message is not in the catalogs
+		"""
+		snapshot = self.get_snapshot()
+		category_key = snapshot.messages.get(message)
+		if category_key is None:
+			for pattern, pattern_category_key in snapshot.patterns:
+				if pattern.match(message):
+					return pattern_category_key
+		return category_key
+
+
+catalog = Catalog(os.path.join(os.path.dirname(__file__), "..", "notifications"))
@@ -0,0 +1,109 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from helper import config, profiling
+
+upstream_semaphores = {
+	upstream: threading.BoundedSemaphore(limit) for upstream, limit in config.upstream_concurrency.items()
+}
+
+
+@contextmanager
+def upstream_slot(upstream):
+	"""
+	Wait for a free slot of the upstream service before making a request.
+
+	:param upstream: Upstream service name (ccdr, actionlib, fusionlib, idm, rmq).
+	:return: None
+	"""
+	semaphore = upstream_semaphores.get(upstream)
+	if semaphore is None:
+		yield
+	else:
+		with semaphore:
+			yield
+
+
+class RoundExecutor:
+	"""
+	Run a notification round concurrently. Every worker thread pushes its own application context, so it works with
+	its own database session, and commits it in batches like the sequential rounds.
+	"""
+
+	def __init__(self, app, session, workers=None, batch_size=None):
+		"""
+		:param app: Application instance
+		:param session: Scoped database session
+		:param workers: Number of worker threads
+		:param batch_size: Tasks by commit of every worker. Notifications stored for the outbox are committed by
+		outbox batches, sent notifications are recorded right away.
+		"""
+		self.app = app
+		self.session = session
+		self.workers = workers or config.round_workers
+		if batch_size is None:
+			batch_size = config.outbox_batch_size if config.notification_mode == "outbox" else 1
+		self.batch_size = max(1, batch_size)
+
+	def run(self, tasks, handler):
+		"""
+		Run the handler once per task. Every worker takes the next pending task until none are left. After the first
+		error the workers stop taking tasks, and the error is raised when the running tasks finish.
+
+		:param tasks: List of argument tuples for the handler
+		:param handler: Function called inside the worker application context
+		:return: Number of tasks completed
+		"""
+		pending = iter(tasks)
+		lock = threading.Lock()
+		failed = threading.Event()
+
+		def next_task():
+			if failed.is_set():
+				return None
+			with lock:
+				return next(pending, None)
+
+		completed = 0
+		error = None
+		with ThreadPoolExecutor(max_workers=self.workers) as pool:
+			work = profiling.propagate(self._work)
+			futures = [pool.submit(work, handler, next_task, failed) for _ in range(min(self.workers, len(tasks)))]
+			for future in futures:
+				try:
+					completed = completed + future.result()
+				except Exception as e:
+					error = error or e
+		if error is not None:
+			raise error
+		return completed
+
+	def _work(self, handler, next_task, failed):
+		"""
+		Run tasks with the application context and database session of the worker thread. The session is committed
+		every batch_size tasks and when no tasks are left, an error rolls back the uncommitted tasks of the worker.
+
+		:param handler: Function to run
+		:param next_task: Function returning the argument tuple of the next task, None when no tasks are left
+		:param failed: Event set when a worker fails
+		:return: Number of tasks completed
+		"""
+		completed = 0
+		with self.app.app_context():
+			try:
+				task = next_task()
+				while task is not None:
+					handler(*task)
+					completed = completed + 1
+					if completed % self.batch_size == 0:
+						self.session.commit()
+					task = next_task()
+				self.session.commit()
+			except Exception:
+				failed.set()
+				self.session.rollback()
+				raise
+			finally:
+				self.session.remove()
+		return completed
@@ -103,3 +103,153 @@ if os.getenv("DROP_TABLES") is not None:
     drop_tables = os.getenv("DROP_TABLES")
 else:
     drop_tables = "no"
+
+# Concurrent notification rounds. One worker keeps the sequential round.
+if os.getenv("ROUND_WORKERS") is not None:
+    round_workers = int(os.getenv("ROUND_WORKERS"))
+else:
+    round_workers = 1
+
+# Maximum number of simultaneous requests to each upstream service, e.g. CCDR_CONCURRENCY=4
+upstream_concurrency = {}
+for upstream in ["ccdr", "actionlib", "fusionlib", "idm", "rmq"]:
+    upstream_concurrency[upstream] = int(os.getenv(upstream.upper() + "_CONCURRENCY", "4"))
+
+# Upstream HTTP client. Timeouts in seconds, retries with exponential backoff.
+if os.getenv("UPSTREAM_CONNECT_TIMEOUT") is not None:
+    upstream_connect_timeout = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT"))
+else:
+    upstream_connect_timeout = 3.05
+
+if os.getenv("UPSTREAM_READ_TIMEOUT") is not None:
+    upstream_read_timeout = float(os.getenv("UPSTREAM_READ_TIMEOUT"))
+else:
+    upstream_read_timeout = 30
+
+if os.getenv("UPSTREAM_RETRIES") is not None:
+    upstream_retries = int(os.getenv("UPSTREAM_RETRIES"))
+else:
+    upstream_retries = 2
+
+if os.getenv("UPSTREAM_BACKOFF") is not None:
+    upstream_backoff = float(os.getenv("UPSTREAM_BACKOFF"))
+else:
+    upstream_backoff = 0.5
+
+# Notification delivery: "direct" posts to RMQ inside the round, "outbox" stores the messages and a background
+# dispatcher sends them in batches.
+if os.getenv("NOTIFICATION_MODE") is not None:
+    notification_mode = os.getenv("NOTIFICATION_MODE")
+else:
+    notification_mode = "direct"
+
+if os.getenv("OUTBOX_BATCH_SIZE") is not None:
+    outbox_batch_size = int(os.getenv("OUTBOX_BATCH_SIZE"))
+else:
+    outbox_batch_size = 100
+
+if os.getenv("OUTBOX_INTERVAL") is not None:
+    outbox_interval = int(os.getenv("OUTBOX_INTERVAL"))
+else:
+    outbox_interval = 10
+
+if os.getenv("OUTBOX_MAX_ATTEMPTS") is not None:
+    outbox_max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS"))
+else:
+    outbox_max_attempts = 5
+
+# Notifications history pagination
+if os.getenv("NOTIFICATIONS_PAGE_LIMIT") is not None:
+    notifications_page_limit = int(os.getenv("NOTIFICATIONS_PAGE_LIMIT"))
+else:
+    notifications_page_limit = 1000
+
+if os.getenv("NOTIFICATIONS_STREAM_BATCH") is not None:
+    notifications_stream_batch = int(os.getenv("NOTIFICATIONS_STREAM_BATCH"))
+else:
+    notifications_stream_batch = 500
+
+# Minimum seconds between checks for modified notification catalogs
+if os.getenv("CATALOG_RELOAD_INTERVAL") is not None:
+    catalog_reload_interval = float(os.getenv("CATALOG_RELOAD_INTERVAL"))
+else:
+    catalog_reload_interval = 5
+
+# Upstream response caches
+if os.getenv("SUMMARIZATION_CACHE_TTL") is not None:
+    summarization_cache_ttl = float(os.getenv("SUMMARIZATION_CACHE_TTL"))
+else:
+    summarization_cache_ttl = 900
+
+if os.getenv("SUMMARIZATION_CACHE_SIZE") is not None:
+    summarization_cache_size = int(os.getenv("SUMMARIZATION_CACHE_SIZE"))
+else:
+    summarization_cache_size = 2048
+
+if os.getenv("IDENTITY_CACHE_TTL") is not None:
+    identity_cache_ttl = float(os.getenv("IDENTITY_CACHE_TTL"))
+else:
+    identity_cache_ttl = 3600
+
+if os.getenv("IDENTITY_CACHE_SIZE") is not None:
+    identity_cache_size = int(os.getenv("IDENTITY_CACHE_SIZE"))
+else:
+    identity_cache_size = 4096
+
+# Request the identities of every patient of the multimodal round before it starts (yes/no)
+if os.getenv("IDENTITY_PREFETCH") is not None:
+    identity_prefetch = os.getenv("IDENTITY_PREFETCH")
+else:
+    identity_prefetch = "no"
+
+# Days a stored patient diagnosis is used before requesting it again
+if os.getenv("DIAGNOSIS_TTL_DAYS") is not None:
+    diagnosis_ttl_days = int(os.getenv("DIAGNOSIS_TTL_DAYS"))
+else:
+    diagnosis_ttl_days = 30
+
+# Scheduler mode: local runs the jobs in every process, cluster runs each job in a single process using a lease
+# table in the database, off does not run scheduled jobs (web only processes)
+if os.getenv("SCHEDULER_MODE") is not None:
+    scheduler_mode = os.getenv("SCHEDULER_MODE")
+else:
+    scheduler_mode = "local"
+
+if os.getenv("JOB_LEASE_TTL") is not None:
+    job_lease_ttl = int(os.getenv("JOB_LEASE_TTL"))
+else:
+    job_lease_ttl = 3600
+
+# Seconds the application creation may take before a warning is logged
+if os.getenv("STARTUP_BUDGET") is not None:
+    startup_budget = float(os.getenv("STARTUP_BUDGET"))
+else:
+    startup_budget = 2.0
+
+# Log files are rotated at midnight (LOG_ROTATION_WHEN) and when they reach LOG_MAX_BYTES
+if os.getenv("LOG_MAX_BYTES") is not None:
+    log_max_bytes = int(os.getenv("LOG_MAX_BYTES"))
+else:
+    log_max_bytes = 10 * 1024 * 1024
+
+if os.getenv("LOG_ROTATION_WHEN") is not None:
+    log_rotation_when = os.getenv("LOG_ROTATION_WHEN")
+else:
+    log_rotation_when = "midnight"
+
+if os.getenv("LOG_BACKUP_COUNT") is not None:
+    log_backup_count = int(os.getenv("LOG_BACKUP_COUNT"))
+else:
+    log_backup_count = 7
+
+# Log records waiting to be written, further records are dropped
+if os.getenv("LOG_QUEUE_SIZE") is not None:
+    log_queue_size = int(os.getenv("LOG_QUEUE_SIZE"))
+else:
+    log_queue_size = 10000
+
+# Functions and spans listed in the summary of a profiled round
+if os.getenv("PROFILE_TOP") is not None:
+    profile_top = int(os.getenv("PROFILE_TOP"))
+else:
+    profile_top = 30
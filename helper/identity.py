@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from helper import config, profiling, upstream
+from helper.cache import TTLCache
+from helper.utils import logger
+
+identity_cache = TTLCache("identity", config.identity_cache_size, config.identity_cache_ttl)
+
+
+def request_identity(patient_reference):
+	"""
+	Request the identity of a patient to IDM and cache it.
+
+	:param patient_reference: Patient identification
+	:return: Identity information of the patient
+	"""
+	body = {
+		"identity_management_key": patient_reference
+	}
+	response = upstream.post("idm", "/findUserByIdentityKey", json=body)
+	response.raise_for_status()
+	identity = response.json()
+	identity_cache.set(patient_reference, identity)
+	return identity
+
+
+def get_identity(patient_reference):
+	"""
+	Get the identity of a patient, requesting IDM only if it is not cached.
+
+	:param patient_reference: Patient identification
+	:return: Identity information of the patient
+	"""
+	identity = identity_cache.get(patient_reference)
+	if identity is None:
+		identity = request_identity(patient_reference)
+	return identity
+
+
+def get_username(patient_reference):
+	"""
+	Get the username of a patient.
+
+	:param patient_reference: Patient identification
+	:return: Username
+	"""
+	return get_identity(patient_reference)["username"]
+
+
+def prefetch(patient_references):
+	"""
+	Request concurrently the identities that are not cached. Failed requests are retried on use.
+
+	:param patient_references: Patient identifications
+	:return: Number of identities requested
+	"""
+	missing = [reference for reference in set(patient_references) if identity_cache.get(reference) is None]
+	if not missing:
+		return 0
+
+	with ThreadPoolExecutor(max_workers=config.upstream_concurrency["idm"]) as pool:
+		fetch = profiling.propagate(request_identity)
+		futures = [pool.submit(fetch, reference) for reference in missing]
+		for reference, future in zip(missing, futures):
+			try:
+				future.result()
+			except requests.exceptions.RequestException as e:
+				logger.warning("Identity of patient {} not prefetched: {}".format(reference, e))
+	return len(missing)
@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+import queue
+from datetime import datetime
+from logging.handlers import QueueHandler, TimedRotatingFileHandler
+
+
+class JsonFormatter(logging.Formatter):
+	"""
+	Format log records as JSON lines.
+	"""
+
+	def format(self, record):
+		"""
+		:param record: Log record
+		:return: JSON line
+		"""
+		entry = {
+			"time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+			"level": record.levelname,
+			"logger": record.name,
+			"function": record.funcName,
+			"thread": record.threadName,
+			"message": record.getMessage(),
+		}
+		if record.exc_info and not record.exc_text:
+			record.exc_text = self.formatException(record.exc_info)
+		if record.exc_text:
+			entry["exception"] = record.exc_text
+		return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+	"""
+	Log file rotated at a time interval and when it reaches a maximum size. Files rotated by size in the same interval
+	get a numeric suffix, e.g. app.log.2022-08-12.1
+	"""
+
+	def __init__(self, filename, max_bytes=0, **kwargs):
+		"""
+		:param filename: Log file
+		:param max_bytes: Maximum size of the file, 0 rotates only by time
+		:param kwargs: Arguments of TimedRotatingFileHandler
+		"""
+		super().__init__(filename, **kwargs)
+		self.max_bytes = max_bytes
+
+	def shouldRollover(self, record):
+		if super().shouldRollover(record):
+			return True
+		if self.max_bytes > 0:
+			if self.stream is None:
+				self.stream = self._open()
+			return self.stream.tell() >= self.max_bytes
+		return False
+
+	def rotation_filename(self, default_name):
+		name = default_name
+		index = 1
+		while os.path.exists(name):
+			name = "{}.{}".format(default_name, index)
+			index = index + 1
+		return name
+
+
+class LogQueueHandler(QueueHandler):
+	"""
+	Put log records in a bounded queue, written by a QueueListener thread. Records are dropped when the queue is full,
+	so logging never blocks the calling thread.
+	"""
+
+	def __init__(self, log_queue):
+		"""
+		:param log_queue: Bounded queue
+		"""
+		super().__init__(log_queue)
+		self.dropped = 0
+
+	def prepare(self, record):
+		# The message is merged here, its arguments may change before the listener writes it
+		record.msg = record.getMessage()
+		record.args = None
+		if record.exc_info:
+			record.exc_text = logging.Formatter().formatException(record.exc_info)
+			record.exc_info = None
+		return record
+
+	def enqueue(self, record):
+		try:
+			self.queue.put_nowait(record)
+		except queue.Full:
+			self.dropped = self.dropped + 1
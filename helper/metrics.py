@@ -0,0 +1,213 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from helper import cache
+
+# Metrics by name, in the order they are rendered
+registry = {}
+
+upstream_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+round_buckets = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+
+class Metric:
+	"""
+	Metric with label values, rendered in the Prometheus text format. Values are kept by process.
+	"""
+	kind = None
+
+	def __init__(self, name, description, labels=()):
+		"""
+		:param name: Metric name
+		:param description: Help text
+		:param labels: Label names
+		"""
+		self.name = name
+		self.description = description
+		self.labels = tuple(labels)
+		self.values = {}
+		self.lock = threading.Lock()
+		registry[name] = self
+
+	@staticmethod
+	def escape(value):
+		"""
+		Escape a label value.
+
+		:param value: Label value
+		:return: Escaped value
+		"""
+		return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+	def label_text(self, label_values, extra=None):
+		"""
+		Get the label set of a sample, e.g. {upstream="ccdr"}.
+
+		:param label_values: Tuple of label values
+		:param extra: Additional label name and value
+		:return: Label set
+		"""
+		pairs = ['{}="{}"'.format(name, Metric.escape(value)) for name, value in zip(self.labels, label_values)]
+		if extra is not None:
+			pairs.append('{}="{}"'.format(extra[0], extra[1]))
+		return "{" + ",".join(pairs) + "}" if pairs else ""
+
+	def render(self):
+		"""
+		Render the metric in the Prometheus text format.
+
+		:return: List of lines
+		"""
+		lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} {}".format(self.name, self.kind)]
+		with self.lock:
+			items = sorted(self.values.items())
+		for label_values, value in items:
+			lines.extend(self.samples(label_values, value))
+		return lines
+
+	def samples(self, label_values, value):
+		return ["{}{} {}".format(self.name, self.label_text(label_values), float(value))]
+
+
+class Counter(Metric):
+	kind = "counter"
+
+	def inc(self, *label_values, amount=1):
+		"""
+		Increase the counter of the label values.
+
+		:param label_values: Label values, in the order of the label names
+		:param amount: Increment
+		:return: None
+		"""
+		with self.lock:
+			self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+	"""
+	Gauge read from a function when the metrics are rendered.
+	"""
+	kind = "gauge"
+
+	def __init__(self, name, description, labels, collect):
+		"""
+		:param collect: Function returning a dictionary of values by tuple of label values
+		"""
+		super().__init__(name, description, labels)
+		self.collect = collect
+
+	def render(self):
+		values = self.collect()
+		with self.lock:
+			self.values = values
+		return super().render()
+
+
+class Histogram(Metric):
+	kind = "histogram"
+
+	def __init__(self, name, description, labels=(), buckets=upstream_buckets):
+		"""
+		:param buckets: Upper bounds of the buckets
+		"""
+		super().__init__(name, description, labels)
+		self.buckets = tuple(buckets)
+
+	def observe(self, value, *label_values):
+		"""
+		Add an observation.
+
+		:param value: Observed value
+		:param label_values: Label values, in the order of the label names
+		:return: None
+		"""
+		index = bisect_left(self.buckets, value)
+		with self.lock:
+			state = self.values.get(label_values)
+			if state is None:
+				# Bucket counts, with the +Inf bucket last, and the sum of the observations
+				state = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+			state[0][index] = state[0][index] + 1
+			state[1] = state[1] + value
+
+	@contextmanager
+	def time(self, *label_values):
+		"""
+		Observe the duration of the block.
+
+		:param label_values: Label values, in the order of the label names
+		:return: None
+		"""
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - started, *label_values)
+
+	def samples(self, label_values, value):
+		counts, total = value
+		lines = []
+		cumulative = 0
+		for bound, count in zip(self.buckets + ("+Inf",), counts):
+			cumulative = cumulative + count
+			lines.append("{}_bucket{} {}".format(self.name, self.label_text(label_values, ("le", bound)), cumulative))
+		lines.append("{}_sum{} {}".format(self.name, self.label_text(label_values), total))
+		lines.append("{}_count{} {}".format(self.name, self.label_text(label_values), cumulative))
+		return lines
+
+
+def render():
+	"""
+	Render every metric in the Prometheus text format.
+
+	:return: Metrics text
+	"""
+	lines = []
+	for metric in list(registry.values()):
+		lines.extend(metric.render())
+	return "\n".join(lines) + "\n"
+
+
+def cache_values(field):
+	"""
+	Get a statistic of every response cache, as gauge values.
+
+	:param field: Statistic name
+	:return: Dictionary of values by cache name
+	"""
+	values = {}
+	for name, stats in cache.stats().items():
+		if field == "hit_ratio":
+			lookups = stats["hits"] + stats["misses"]
+			values[(name,)] = stats["hits"] / lookups if lookups else 0
+		else:
+			values[(name,)] = stats[field]
+	return values
+
+
+upstream_seconds = Histogram(
+	"recommender_upstream_request_seconds", "Duration of the requests to the upstream services",
+	("upstream", "endpoint"))
+upstream_errors = Counter(
+	"recommender_upstream_errors_total", "Failed requests to the upstream services, by status or exception",
+	("upstream", "endpoint", "error"))
+round_seconds = Histogram(
+	"recommender_round_seconds", "Duration of the notification rounds", ("receiver",), round_buckets)
+round_patients = Counter(
+	"recommender_round_patients_total", "Patients processed by the notification rounds", ("receiver",))
+notifications = Counter(
+	"recommender_notifications_total", "Notifications by category and status (sent, queued, failed)",
+	("category", "status"))
+outbox = Counter("recommender_outbox_total", "Outbox deliveries by status (sent, retried, failed)", ("status",))
+db_commits = Counter("recommender_db_commits_total", "Committed database transactions")
+cache_hit_ratio = Gauge(
+	"recommender_cache_hit_ratio", "Hit ratio of the upstream response caches", ("cache",),
+	lambda: cache_values("hit_ratio"))
+cache_size = Gauge(
+	"recommender_cache_size", "Entries in the upstream response caches", ("cache",), lambda: cache_values("size"))
+cache_evictions = Gauge(
+	"recommender_cache_evictions", "Entries evicted from the upstream response caches", ("cache",),
+	lambda: cache_values("evictions"))
@@ -0,0 +1,377 @@
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from flask import has_request_context, request
+
+from helper import config
+from helper.utils import logger, logs_directory
+
+# Profile of the running round and innermost open span, inherited by the threads started through propagate
+current_profile = contextvars.ContextVar("current_profile", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+# cProfile profilers of the current thread, by profile
+thread_profilers = threading.local()
+
+
+class LocalArmedRounds:
+	"""
+	Rounds profiled on their next run, kept in the memory of the process.
+	"""
+	names = set()
+	lock = threading.Lock()
+
+	@staticmethod
+	def arm(name):
+		"""
+		:param name: Round name
+		:return: None
+		"""
+		with LocalArmedRounds.lock:
+			LocalArmedRounds.names.add(name)
+
+	@staticmethod
+	def get_all():
+		"""
+		:return: Sorted list of round names
+		"""
+		with LocalArmedRounds.lock:
+			return sorted(LocalArmedRounds.names)
+
+	@staticmethod
+	def consume(name):
+		"""
+		Disarm a round before its run is profiled.
+
+		:param name: Round name
+		:return: True if the round was armed
+		"""
+		with LocalArmedRounds.lock:
+			if name in LocalArmedRounds.names:
+				LocalArmedRounds.names.discard(name)
+				return True
+		return False
+
+
+# Rounds profiled on their next run, e.g. the next scheduled run. The application shares them between its processes
+# through the database, so a round armed in a replica is profiled by the replica that runs it.
+armed_rounds = LocalArmedRounds
+
+
+class Span:
+	"""
+	Timed operation of a profiled round, e.g. a patient, an HTTP call or a database commit.
+	"""
+	__slots__ = ("name", "attributes", "started", "seconds", "children")
+
+	def __init__(self, name, attributes, started=None, seconds=None):
+		"""
+		:param name: Span name
+		:param attributes: Dictionary of attributes, e.g. the patient
+		:param started: Start time, from time.perf_counter
+		:param seconds: Duration, None while the span is open
+		"""
+		self.name = name
+		self.attributes = attributes
+		self.started = time.perf_counter() if started is None else started
+		self.seconds = seconds
+		self.children = []
+
+	def finish(self):
+		"""
+		Close the span.
+
+		:return: None
+		"""
+		self.seconds = time.perf_counter() - self.started
+
+	def to_dict(self, origin):
+		"""
+		Get the span tree as a dictionary.
+
+		:param origin: Start time of the round
+		:return: Span information
+		"""
+		return {
+			"name": self.name,
+			"attributes": self.attributes,
+			"start": round(self.started - origin, 6),
+			"seconds": None if self.seconds is None else round(self.seconds, 6),
+			"children": [child.to_dict(origin) for child in list(self.children)],
+		}
+
+	def walk(self):
+		"""
+		Iterate over the span and its descendants.
+
+		:return: Generator of spans
+		"""
+		yield self
+		for child in list(self.children):
+			yield from child.walk()
+
+
+class Profile:
+	"""
+	Profile of a single run of a round: the span tree and the cProfile profilers of every thread of the round.
+	"""
+
+	def __init__(self, name):
+		"""
+		:param name: Round name
+		"""
+		self.name = name
+		self.root = Span(name, {})
+		self.profilers = []
+		self.lock = threading.Lock()
+
+	def add_profiler(self, profiler):
+		"""
+		Add the profiler of a thread of the round.
+
+		:param profiler: cProfile.Profile
+		:return: None
+		"""
+		with self.lock:
+			self.profilers.append(profiler)
+
+	def write(self, directory):
+		"""
+		Write the profile (.prof, for pstats or snakeviz), the span tree (.spans.json) and the hotspots summary
+		(.txt) of the round.
+
+		:param directory: Output directory
+		:return: Path of the summary
+		"""
+		os.makedirs(directory, exist_ok=True)
+		base = os.path.join(directory, "{}-{}".format(self.name, datetime.now().strftime("%Y%m%d-%H%M%S")))
+
+		with open(base + ".spans.json", "w", encoding="utf-8") as spans_file:
+			json.dump(self.root.to_dict(self.root.started), spans_file, default=str)
+
+		summary = io.StringIO()
+		summary.write("Round {}: {:.3f}s\n\n".format(self.name, self.root.seconds))
+		self.write_spans(summary)
+
+		if self.profilers:
+			stats = pstats.Stats(self.profilers[0], stream=summary)
+			for profiler in self.profilers[1:]:
+				stats.add(profiler)
+			stats.dump_stats(base + ".prof")
+			summary.write("\nFunctions by cumulative time\n")
+			stats.sort_stats("cumulative").print_stats(config.profile_top)
+			summary.write("\nFunctions by internal time\n")
+			stats.sort_stats("tottime").print_stats(config.profile_top)
+
+		with open(base + ".txt", "w", encoding="utf-8") as summary_file:
+			summary_file.write(summary.getvalue())
+		return base + ".txt"
+
+	def write_spans(self, stream):
+		"""
+		Write the spans aggregated by name and the slowest patients.
+
+		:param stream: Text stream
+		:return: None
+		"""
+		totals = {}
+		patients = []
+		for node in self.root.walk():
+			if node is self.root or node.seconds is None:
+				continue
+			count, total, longest = totals.get(node.name, (0, 0.0, 0.0))
+			totals[node.name] = (count + 1, total + node.seconds, max(longest, node.seconds))
+			if node.name == "patient":
+				patients.append(node)
+
+		stream.write("{:<40} {:>8} {:>12} {:>12} {:>12}\n".format("Span", "Count", "Total (s)", "Mean (s)", "Max (s)"))
+		for name, (count, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+			stream.write("{:<40} {:>8} {:>12.3f} {:>12.4f} {:>12.4f}\n".format(
+				name, count, total, total / count, longest))
+
+		if patients:
+			stream.write("\nSlowest patients\n")
+			for node in sorted(patients, key=lambda item: -item.seconds)[:config.profile_top]:
+				spans = ", ".join("{} {:.3f}s".format(child.name, child.seconds or 0) for child in node.children)
+				stream.write("{:<40} {:>12.3f}  {}\n".format(node.attributes.get("patient"), node.seconds, spans))
+
+
+def arm(name):
+	"""
+	Profile the next run of a round, e.g. the next scheduled run.
+
+	:param name: Round name
+	:return: None
+	"""
+	armed_rounds.arm(name)
+
+
+def get_armed():
+	"""
+	Get the rounds profiled on their next run.
+
+	:return: Sorted list of round names
+	"""
+	return armed_rounds.get_all()
+
+
+def requested(name):
+	"""
+	Check if the run of a round must be profiled: the request has profile=yes, or the round was armed.
+
+	:param name: Round name
+	:return: Boolean value
+	"""
+	if has_request_context() and request.args.get("profile") == "yes":
+		return True
+	return armed_rounds.consume(name)
+
+
+def profiled(name):
+	"""
+	Decorator running the round under the profiler when requested.
+
+	:param name: Round name
+	:return: Decorator
+	"""
+	def decorator(func):
+		@wraps(func)
+		def run(*args, **kwargs):
+			if current_profile.get() is not None or not requested(name):
+				return func(*args, **kwargs)
+			return run_profiled(name, func, *args, **kwargs)
+		return run
+	return decorator
+
+
+def run_profiled(name, func, *args, **kwargs):
+	"""
+	Run a round under the profiler, recording its span tree, and write the results to the logs directory.
+
+	:param name: Round name
+	:param func: Round function
+	:return: Result of the function
+	"""
+	profile = Profile(name)
+	profile_token = current_profile.set(profile)
+	span_token = current_span.set(profile.root)
+	logger.info("Profiling %s round", name)
+	try:
+		return run_with_profiler(profile, func, *args, **kwargs)
+	finally:
+		profile.root.finish()
+		current_span.reset(span_token)
+		current_profile.reset(profile_token)
+		try:
+			path = profile.write(os.path.join(logs_directory(), "profiles"))
+			logger.info("Profile of %s round written to %s", name, path)
+		except OSError as e:
+			logger.error("Profile of {} round not written: {}".format(name, e))
+
+
+def run_with_profiler(profile, func, *args, **kwargs):
+	"""
+	Run a function under the cProfile profiler of the current thread, added to the profile when it is created.
+
+	:param profile: Profile of the round
+	:param func: Function
+	:return: Result of the function
+	"""
+	profilers = getattr(thread_profilers, "profilers", None)
+	if profilers is None:
+		profilers = thread_profilers.profilers = weakref.WeakKeyDictionary()
+	profiler = profilers.get(profile)
+	if profiler is None:
+		# A single profiler by thread, reused by the tasks of the round run in the thread
+		profiler = profilers[profile] = cProfile.Profile()
+		profile.add_profiler(profiler)
+	elif getattr(thread_profilers, "active", None) is profiler:
+		# Nested call, the profiler of the thread is already enabled
+		return func(*args, **kwargs)
+
+	try:
+		profiler.enable()
+	except ValueError:
+		# Another profiler is active in the thread, the span tree is still recorded
+		return func(*args, **kwargs)
+	thread_profilers.active = profiler
+	try:
+		return func(*args, **kwargs)
+	finally:
+		profiler.disable()
+		thread_profilers.active = None
+
+
+def propagate(func):
+	"""
+	Wrap a function run in a thread pool to keep the profile of the round. Threads do not inherit the context.
+
+	:param func: Function
+	:return: Wrapped function, or the same function if the round is not profiled
+	"""
+	profile = current_profile.get()
+	if profile is None:
+		return func
+	context = contextvars.copy_context()
+
+	@wraps(func)
+	def run(*args, **kwargs):
+		return context.copy().run(run_with_profiler, profile, func, *args, **kwargs)
+	return run
+
+
+@contextmanager
+def span(name, **attributes):
+	"""
+	Record a span of the profiled round. Nothing is recorded if the round is not profiled.
+
+	:param name: Span name
+	:param attributes: Span attributes
+	:return: None
+	"""
+	parent = current_span.get()
+	if parent is None:
+		yield
+		return
+
+	node = Span(name, attributes)
+	parent.children.append(node)
+	token = current_span.set(node)
+	try:
+		yield
+	finally:
+		node.finish()
+		current_span.reset(token)
+
+
+def record(name, started, **attributes):
+	"""
+	Record a finished span of the profiled round, for operations timed by event hooks.
+
+	:param name: Span name
+	:param started: Start time, from time.perf_counter
+	:param attributes: Span attributes
+	:return: None
+	"""
+	parent = current_span.get()
+	if parent is not None:
+		parent.children.append(Span(name, attributes, started, time.perf_counter() - started))
+
+
+def active():
+	"""
+	Check if the current round is profiled.
+
+	:return: Boolean value
+	"""
+	return current_span.get() is not None
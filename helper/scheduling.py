@@ -0,0 +1,165 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import wraps
+
+from apscheduler.executors.base import run_job
+from apscheduler.executors.pool import ThreadPoolExecutor as JobPoolExecutor
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from helper.utils import logger
+
+# Scheduled time of the job run by the current thread of the scheduler
+scheduled_run_time = contextvars.ContextVar("scheduled_run_time", default=None)
+
+
+def run_scheduled_job(job, jobstore_alias, run_times, logger_name):
+	"""
+	Run a job once per scheduled time, with the scheduled time available in scheduled_run_time.
+
+	:return: Scheduler events
+	"""
+	events = []
+	for run_time in run_times:
+		token = scheduled_run_time.set(run_time)
+		try:
+			events.extend(run_job(job, jobstore_alias, [run_time], logger_name))
+		finally:
+			scheduled_run_time.reset(token)
+	return events
+
+
+class ScheduledTimeExecutor(JobPoolExecutor):
+	"""
+	Scheduler thread pool that lets the jobs read their scheduled time, instead of the time they actually start.
+	"""
+
+	def _do_submit_job(self, job, run_times):
+		def callback(future):
+			exception = future.exception()
+			if exception:
+				self._run_job_error(job.id, exception, exception.__traceback__)
+			else:
+				self._run_job_success(job.id, future.result())
+
+		future = self._pool.submit(run_scheduled_job, job, job._jobstore_alias, run_times, self._logger.name)
+		future.add_done_callback(callback)
+
+
+class ClusterScheduler(BackgroundScheduler):
+	"""
+	Background scheduler for several processes or replicas. Cron jobs claim a lease before running, so every scheduled
+	run is done by a single process. Other triggers run in every process.
+	"""
+
+	def __init__(self, app, lease, **options):
+		"""
+		:param app: Application instance
+		:param lease: Lease model with acquire and release functions
+		:param options: BackgroundScheduler options
+		"""
+		options.setdefault("executors", {"default": ScheduledTimeExecutor()})
+		super().__init__(**options)
+		self.app = app
+		self.lease = lease
+
+	def add_job(self, func, trigger=None, args=None, kwargs=None, id=None, name=None, *positional, **options):
+		"""
+		Add a job to the scheduler. Cron jobs are wrapped to claim the lease of the run.
+
+		:return: Job
+		"""
+		if trigger == 'cron':
+			func = self.leased(func, id or func.__name__)
+		return super().add_job(func, trigger, args, kwargs, id, name, *positional, **options)
+
+	def leased(self, func, job_id):
+		"""
+		Wrap a job to run only if this process claims the lease of the run.
+
+		:param func: Job function
+		:param job_id: Job identification
+		:return: Wrapped function
+		"""
+		@wraps(func)
+		def run(*args, **kwargs):
+			# Every process gets the same scheduled time from the trigger, even if the run starts late
+			run_time = scheduled_run_time.get()
+			if run_time is not None:
+				scheduled_time = run_time.astimezone().replace(tzinfo=None)
+			else:
+				# Called outside the scheduler, cron jobs run at minute resolution
+				scheduled_time = datetime.now().replace(second=0, microsecond=0)
+			with self.app.app_context():
+				acquired = self.lease.acquire(job_id, scheduled_time)
+			if not acquired:
+				logger.info("Job {} of {} run by another process".format(job_id, scheduled_time))
+				return None
+
+			try:
+				return func(*args, **kwargs)
+			finally:
+				with self.app.app_context():
+					self.lease.release(job_id)
+		return run
+
+
+class BackgroundJobs:
+	"""
+	Run jobs on a background thread of the process, whatever the scheduler mode. A job is not queued again while
+	a run of it is waiting to start.
+	"""
+
+	def __init__(self, workers=1):
+		"""
+		:param workers: Number of worker threads
+		"""
+		self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="background")
+		self.queued = {}
+		self.lock = threading.Lock()
+
+	def submit(self, job_id, func):
+		"""
+		Run a job in the background.
+
+		:param job_id: Job identification
+		:param func: Job function
+		:return: Future of the run
+		"""
+		with self.lock:
+			future = self.queued.get(job_id)
+			if future is not None and not future.running() and not future.done():
+				return future
+			future = self.executor.submit(self.run, job_id, func)
+			self.queued[job_id] = future
+			return future
+
+	@staticmethod
+	def run(job_id, func):
+		"""
+		Run a job and log its errors, nobody waits for the result.
+
+		:param job_id: Job identification
+		:param func: Job function
+		:return: Result of the job
+		"""
+		try:
+			return func()
+		except Exception as e:
+			logger.error("Background job {} failed: {}".format(job_id, e))
+
+
+def app_job(app, func):
+	"""
+	Wrap a function to run as a scheduled job inside the application context.
+
+	:param app: Application instance
+	:param func: Job function
+	:return: Wrapped function
+	"""
+	@wraps(func)
+	def run(*args, **kwargs):
+		with app.app_context():
+			return func(*args, **kwargs)
+	return run
@@ -0,0 +1,102 @@
+import threading
+import time
+
+from helper.utils import logger
+
+
+class Warmup:
+	"""
+	Tasks run once in the background when the application starts, e.g. the first patient synchronization. Requests
+	are served meanwhile, the application is ready when every task finished.
+	"""
+
+	def __init__(self, app):
+		"""
+		:param app: Application instance
+		"""
+		self.app = app
+		self.tasks = []
+		self.required = set()
+		self.status = {}
+		self.startup = None
+		self.finished = threading.Event()
+		self.lock = threading.Lock()
+
+	def add(self, name, func, required=False):
+		"""
+		Add a task, run inside the application context.
+
+		:param name: Task name
+		:param func: Function without arguments
+		:param required: If the task fails, the tasks after it are skipped and the application is not ready
+		:return: None
+		"""
+		self.tasks.append((name, func))
+		if required:
+			self.required.add(name)
+		self.status[name] = {"status": "pending", "seconds": None}
+
+	def start(self):
+		"""
+		Run the tasks in a background thread.
+
+		:return: None
+		"""
+		threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+	def run(self):
+		"""
+		Run the tasks in order. A failing task is logged and does not stop the others, as the scheduled rounds repeat
+		the same work, unless it is required.
+
+		:return: None
+		"""
+		for index, (name, func) in enumerate(self.tasks):
+			started = time.perf_counter()
+			self.set_status(name, "running")
+			try:
+				with self.app.app_context():
+					func()
+				self.set_status(name, "done", started)
+				logger.info("Warm-up task {} done in {}s".format(name, self.status[name]["seconds"]))
+			except Exception as e:
+				self.set_status(name, "failed", started)
+				logger.error("Warm-up task {} failed: {}".format(name, e))
+				if name in self.required:
+					for skipped, _ in self.tasks[index + 1:]:
+						self.set_status(skipped, "skipped")
+					break
+		self.finished.set()
+
+	def set_status(self, name, status, started=None):
+		"""
+		Update the status of a task.
+
+		:param name: Task name
+		:param status: pending, running, done, failed or skipped
+		:param started: Start time of the task, to record its duration
+		:return: None
+		"""
+		with self.lock:
+			seconds = None if started is None else round(time.perf_counter() - started, 3)
+			self.status[name] = {"status": status, "seconds": seconds}
+
+	def get_status(self):
+		"""
+		Get the status of every task.
+
+		:return: Dictionary of task status and duration by name
+		"""
+		with self.lock:
+			return {name: dict(status) for name, status in self.status.items()}
+
+	def ready(self):
+		"""
+		Check if every task finished and no required task failed.
+
+		:return: Boolean value
+		"""
+		if not self.finished.is_set():
+			return False
+		with self.lock:
+			return all(self.status[name]["status"] == "done" for name in self.required)
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from helper import config, metrics, profiling
+from helper.concurrency import upstream_slot
+from helper.utils import logger
+
+base_urls = {
+	"ccdr": config.ccdr_url,
+	"actionlib": config.actionlib_url,
+	"fusionlib": config.fusionlib_url,
+	"idm": config.idm_url,
+	"rmq": config.rmq_url,
+}
+
+# Read timeout of the endpoint and whether it can be repeated after a read error or a 5xx response.
+# Requests that never reached the upstream (connection errors) are always retried.
+Endpoint = namedtuple("Endpoint", ["read_timeout", "idempotent"])
+
+endpoints = {
+	"/api/v1/mobile/patient": Endpoint(config.upstream_read_timeout, True),
+	"/api/v1/profile/getDiagnosis": Endpoint(config.upstream_read_timeout, True),
+	"/api/v1/web/questionnaire/getPatientQuestionnairesResponses": Endpoint(config.upstream_read_timeout, True),
+	"/api/v1/fusionlib/getWeeklyScores": Endpoint(config.upstream_read_timeout, True),
+	"/api/v1/par/getWeeklySteps": Endpoint(config.upstream_read_timeout, True),
+	"/api/v1/mobile/surveys/get_response/7.2": Endpoint(config.upstream_read_timeout, True),
+	"/api/v1/game/getSummarizationList": Endpoint(config.upstream_read_timeout, True),
+	"/api/v1/mobile/prescription/list/": Endpoint(config.upstream_read_timeout, True),
+	"/getPilotThreePatientKeys": Endpoint(config.upstream_read_timeout, True),
+	"/findUserByIdentityKey": Endpoint(config.upstream_read_timeout, True),
+	"/generate_scores": Endpoint(120, False),
+	"/generate_deviations": Endpoint(120, False),
+	"/notification/sendNotifications": Endpoint(config.upstream_read_timeout, False),
+	"/notification/sendNotificationToMedicalProfessionalByPatient": Endpoint(config.upstream_read_timeout, False),
+}
+default_endpoint = Endpoint(config.upstream_read_timeout, False)
+
+retry_status = [502, 503, 504]
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def get_session(upstream):
+	"""
+	Get the keep-alive session of the upstream, creating its connection pool on first use.
+
+	:param upstream: Upstream service name (ccdr, actionlib, fusionlib, idm, rmq).
+	:return: Session
+	"""
+	session = sessions.get(upstream)
+	if session is None:
+		with sessions_lock:
+			session = sessions.get(upstream)
+			if session is None:
+				pool_size = config.upstream_concurrency.get(upstream, 1)
+				# Only retry connection errors here, the request was not sent to the upstream. Read errors are raised
+				# as they are (ReadTimeout), request() decides whether the endpoint can be repeated
+				retries = Retry(
+					total=None, connect=config.upstream_retries, read=False, status=0, redirect=0,
+					backoff_factor=config.upstream_backoff)
+				adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+				session = requests.Session()
+				session.mount(base_urls[upstream], adapter)
+				sessions[upstream] = session
+	return session
+
+
+def request(method, upstream, path, **kwargs):
+	"""
+	Make a request to an upstream service using its connection pool, the endpoint timeouts and bounded retries.
+
+	:param method: HTTP method
+	:param upstream: Upstream service name (ccdr, actionlib, fusionlib, idm, rmq).
+	:param path: Endpoint path, including the query string if any.
+	:param kwargs: Arguments of requests.Session.request
+	:return: Response
+	"""
+	name = path.split("?")[0]
+	endpoint = endpoints.get(name, default_endpoint)
+	kwargs.setdefault("timeout", (config.upstream_connect_timeout, endpoint.read_timeout))
+	session = get_session(upstream)
+	url = base_urls[upstream] + path
+
+	attempt = 0
+	while True:
+		try:
+			with upstream_slot(upstream), profiling.span("http", upstream=upstream, endpoint=name):
+				started = time.perf_counter()
+				try:
+					response = session.request(method, url, **kwargs)
+				except requests.exceptions.RequestException as e:
+					metrics.upstream_errors.inc(upstream, name, type(e).__name__)
+					raise
+				finally:
+					metrics.upstream_seconds.observe(time.perf_counter() - started, upstream, name)
+			if response.status_code >= 400:
+				metrics.upstream_errors.inc(upstream, name, str(response.status_code))
+			if response.status_code not in retry_status or not endpoint.idempotent \
+					or attempt >= config.upstream_retries:
+				return response
+			logger.warning("{} {} returned {}. Retrying".format(method, url, response.status_code))
+		except (requests.exceptions.ReadTimeout, requests.exceptions.ChunkedEncodingError) as e:
+			if not endpoint.idempotent or attempt >= config.upstream_retries:
+				raise
+			logger.warning("{} {} failed: {}. Retrying".format(method, url, e))
+
+		time.sleep(config.upstream_backoff * (2 ** attempt))
+		attempt = attempt + 1
+
+
+def get(upstream, path, **kwargs):
+	"""
+	Make a GET request to an upstream service.
+
+	:param upstream: Upstream service name
+	:param path: Endpoint path
+	:return: Response
+	"""
+	return request("GET", upstream, path, **kwargs)
+
+
+def post(upstream, path, **kwargs):
+	"""
+	Make a POST request to an upstream service.
+
+	:param upstream: Upstream service name
+	:param path: Endpoint path
+	:return: Response
+	"""
+	return request("POST", upstream, path, **kwargs)
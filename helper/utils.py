@@ -1,49 +1,32 @@
-import json
+import atexit
 import logging
 import os
-import shutil
-import time
+import queue
+from logging.handlers import QueueListener
 
 import colorlog
 
+from helper import config
 from helper.config import testing_mode
+from helper.logs import JsonFormatter, LogQueueHandler, SizedTimedRotatingFileHandler
 
 
-def check_directory_expired_date(total_time=3600, app_logs_dir="app_logs"):
+def logs_directory():
 	"""
-	Check if the directory is expired.
+	Get the logs directory.
 
-	:param total_time:
-	:param app_logs_dir:
-	:return:
+	:return: Directory path
 	"""
-	try:
-
-		# If not exists
-		if not os.path.exists(app_logs_dir):
-			print('Create New APP Logs Folder')
-			os.makedirs(app_logs_dir)
-		else:
-			# if exists check the date
-			prev_date = os.path.getmtime(app_logs_dir)
-			current_date = time.time()
-
-			# Date has expired
-			if int(current_date - prev_date) >= total_time:
-				print('Update APP Logs folder')
-				try:
-					# Delete directory and create it again
-					shutil.rmtree(app_logs_dir)
-					os.makedirs(app_logs_dir)
-				except Exception as e:
-					print(e)
-	except Exception as e:
-		print(e)
+	parent_dir = os.getenv('GLOBAL_PARENT_DIR')
+	if parent_dir is not None:
+		return os.path.join(parent_dir, "app_logs")
+	return os.path.join("", "app_logs")
 
 
 def init_logger(dunder_name, testing_logger) -> logging.Logger:
 	"""
-	Initialize the logger.
+	Initialize the logger. Records are put in a queue and written by a listener thread to the console and to JSON
+	lines files rotated by size and time.
 
 	:param dunder_name:
 	:param testing_logger:
@@ -63,45 +46,40 @@ def init_logger(dunder_name, testing_logger) -> logging.Logger:
 		'%(log_color)s '
 		f'{log_format}'
 	)
+	# Libraries log to the root logger
 	colorlog.basicConfig(format=colorlog_format)
 	logger = logging.getLogger(dunder_name)
+	logger.propagate = False
 
 	if testing_logger:
 		logger.setLevel(logging.DEBUG)
 	else:
 		logger.setLevel(logging.INFO)
 
-	# Logs directory
-	parent_dir = os.getenv('GLOBAL_PARENT_DIR')
-	if parent_dir is not None:
-		app_logs_dir = os.path.join(parent_dir, "app_logs")
-	else:
-		app_logs_dir = os.path.join("", "app_logs")
-
-	# Output full log
-	check_directory_expired_date(app_logs_dir=app_logs_dir)
-	log_path = os.path.join(app_logs_dir, "app.log")
-	fh = logging.FileHandler(log_path)
-	fh.setLevel(logging.DEBUG)
-	formatter = logging.Formatter(log_format)
-	fh.setFormatter(formatter)
-	logger.addHandler(fh)
-
-	# Output warning log
-	log_path_w = os.path.join(app_logs_dir, "app.warning.log")
-	fh = logging.FileHandler(log_path_w)
-	fh.setLevel(logging.WARNING)
-	formatter = logging.Formatter(log_format)
-	fh.setFormatter(formatter)
-	logger.addHandler(fh)
-
-	# Output error log
-	log_path_e = os.path.join(app_logs_dir, "app.error.log")
-	fh = logging.FileHandler(log_path_e)
-	fh.setLevel(logging.ERROR)
-	formatter = logging.Formatter(log_format)
-	fh.setFormatter(formatter)
-	logger.addHandler(fh)
+	app_logs_dir = logs_directory()
+	os.makedirs(app_logs_dir, exist_ok=True)
+
+	console = colorlog.StreamHandler()
+	console.setFormatter(colorlog.ColoredFormatter(colorlog_format))
+	handlers = [console]
+
+	# Full, warning and error logs
+	formatter = JsonFormatter()
+	for name, level in (("app.log", logging.DEBUG), ("app.warning.log", logging.WARNING),
+						("app.error.log", logging.ERROR)):
+		fh = SizedTimedRotatingFileHandler(
+			os.path.join(app_logs_dir, name), max_bytes=config.log_max_bytes, when=config.log_rotation_when,
+			backupCount=config.log_backup_count, encoding="utf-8", delay=True)
+		fh.setLevel(level)
+		fh.setFormatter(formatter)
+		handlers.append(fh)
+
+	log_queue = queue.Queue(maxsize=config.log_queue_size)
+	logger.addHandler(LogQueueHandler(log_queue))
+	listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+	listener.start()
+	# Write the queued records on exit
+	atexit.register(listener.stop)
 	return logger
 
 
@@ -127,32 +105,3 @@ if testing_mode == "yes":
 	logger = init_logger(__name__, testing_logger=True)
 else:
 	logger = init_logger(__name__, testing_logger=False)
-
-# Notifications files
-script_dir = os.path.dirname(__file__)  # <-- absolute dir the script is in
-
-rel_path_general = "../notifications/general_notifications.json"
-abs_file_path_general = os.path.join(script_dir, rel_path_general)
-
-rel_path_par = "../notifications/par_notifications.json"
-abs_file_path_par = os.path.join(script_dir, rel_path_par)
-
-rel_path_ieq = "../notifications/ieq_notifications.json"
-abs_file_path_ieq = os.path.join(script_dir, rel_path_ieq)
-
-rel_path_game = "../notifications/game_notifications.json"
-abs_file_path_game = os.path.join(script_dir, rel_path_game)
-
-rel_path_multimodal = "../notifications/multimodal_notifications.json"
-abs_file_path_multimodal = os.path.join(script_dir, rel_path_multimodal)
-
-with open(abs_file_path_general, encoding='utf-8') as json_file:
-	general_notifications = json.load(json_file)
-with open(abs_file_path_par, encoding='utf-8') as json_file:
-	par_notifications = json.load(json_file)
-with open(abs_file_path_ieq, encoding='utf-8') as json_file:
-	ieq_notifications = json.load(json_file)
-with open(abs_file_path_game, encoding='utf-8') as json_file:
-	game_notifications = json.load(json_file)
-with open(abs_file_path_multimodal, encoding='utf-8') as json_file:
-	multimodal_notifications = json.load(json_file)
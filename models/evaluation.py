@@ -2,10 +2,66 @@ from datetime import datetime, timedelta
 from random import sample
 
 import numpy as np
-import requests
 
-from helper import config
-from helper.utils import game_notifications, multimodal_notifications
+from helper import config, identity, upstream
+from helper.cache import TTLCache
+from helper.catalog import catalog
+
+summarization_cache = TTLCache("summarization", config.summarization_cache_size, config.summarization_cache_ttl)
+
+# Date formats of the summarization days
+day_formats = ["%d-%m-%Y", "%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d"]
+
+
+# CCDR data
+
+def parse_day(value):
+	"""
+	Get the day of a summarization list item.
+
+	:param value: Date returned by CCDR
+	:return: Date, or None if the format is unknown
+	"""
+	if not isinstance(value, str):
+		return None
+	for day_format in day_formats:
+		try:
+			return datetime.strptime(value[:10], day_format).date()
+		except ValueError:
+			pass
+	return None
+
+
+def get_summarization_list(patient_reference, start_date, end_date):
+	"""
+	Get the game summarization list of the patient between two days. Lists are cached by patient and window, and a
+	cached window that covers the requested one is filtered instead of requesting CCDR again.
+
+	:param patient_reference: Patient identification
+	:param start_date: First day
+	:param end_date: Last day
+	:return: List of summarization days
+	"""
+	key, summarization_list = summarization_cache.find(
+		patient_reference, lambda cached: cached[1] <= start_date and end_date <= cached[2])
+	if key is not None:
+		if key == (patient_reference, start_date, end_date):
+			return list(summarization_list)
+		days = [parse_day(summarization_day["date"]) for summarization_day in summarization_list]
+		if None not in days:
+			return [item for item, day in zip(summarization_list, days) if start_date <= day <= end_date]
+
+	body = {
+		"identity_management_key": patient_reference,
+		"role": "patient",
+		"startDate": start_date.strftime("%d-%m-%Y"),
+		"endDate": end_date.strftime("%d-%m-%Y")
+	}
+	response = upstream.post("ccdr", "/api/v1/game/getSummarizationList", json=body)
+	response.raise_for_status()
+	summarization_list = response.json()
+	summarization_cache.set((patient_reference, start_date, end_date), summarization_list)
+	return list(summarization_list)
 
 
 # Mobile recommendations
@@ -18,8 +74,8 @@ def multimodal_evaluation(patient_reference, country_code, scores, deviations):
 	:param country_code: Patient country code
 	:param scores: Data list of scores for two consecutive weeks
 	:param deviations: Data list of deviations for two consecutive weeks
-	:return: messages_scores: A list of messages containing deviations notifications.
-	messages_deviations: A list of messages containing deviations notifications
+	:return: messages_scores: A list of category keys and messages containing scores notifications.
+	messages_deviations: A list of category keys and messages containing deviations notifications
 	"""
 
 	messages_scores = []
@@ -31,30 +87,25 @@ def multimodal_evaluation(patient_reference, country_code, scores, deviations):
 	# Cognitive State Score (CSS)
 	if scores[1]["css"] == 0:
 		# Check if the patient has not played cognitive games in the last two weeks
-		body = {
-			"identity_management_key": patient_reference,
-			"role": "patient",
-			"startDate": (datetime.now() - timedelta(days=14)).strftime("%d-%m-%Y"),
-			"endDate": (datetime.now() - timedelta(days=1)).strftime("%d-%m-%Y")
-		}
-
-		summarization_list = requests.post(config.ccdr_url + "/api/v1/game/getSummarizationList", json=body)
-		cognitive_played = [True for session in summarization_list.json() if not session["session_info"]]
+		today = datetime.now().date()
+		summarization_list = get_summarization_list(
+			patient_reference, today - timedelta(days=14), today - timedelta(days=1))
+		cognitive_played = [True for session in summarization_list if not session["session_info"]]
 		cognitive_played = True if any(cognitive_played) else False
 
 		if cognitive_played:  # Patient did not perform well
-			messages_scores.append(multimodal_notifications['CSS_11'][country_code])
+			messages_scores.append(catalog.entry("MULTIMODAL", "CSS_11", country_code))
 		else:  # Patient might not be playing any games in the last two weeks
-			messages_scores.append(multimodal_notifications['CSS_12'][country_code])
+			messages_scores.append(catalog.entry("MULTIMODAL", "CSS_12", country_code))
 	else:
 		if scores_result["css"] < 0:
-			msg1 = multimodal_notifications['CSS_21'][country_code]  # Patient is not playing well
-			msg2 = multimodal_notifications['CSS_22'][country_code]  # Suggest to decrease the level
+			msg1 = catalog.entry("MULTIMODAL", "CSS_21", country_code)  # Patient is not playing well
+			msg2 = catalog.entry("MULTIMODAL", "CSS_22", country_code)  # Suggest to decrease the level
 			# Select a random message between ms1 and msg2
 			messages_scores.append(sample([msg1, msg2], 1)[0])
 		else:
-			msg1 = multimodal_notifications['CSS_31'][country_code]  # Patient is doing great
-			msg2 = multimodal_notifications['CSS_32'][country_code]  # Suggest to increase level
+			msg1 = catalog.entry("MULTIMODAL", "CSS_31", country_code)  # Patient is doing great
+			msg2 = catalog.entry("MULTIMODAL", "CSS_32", country_code)  # Suggest to increase level
 			# Select a random message between ms1 and msg2
 			messages_scores.append(sample([msg1, msg2], 1)[0])
 
@@ -65,42 +116,48 @@ def multimodal_evaluation(patient_reference, country_code, scores, deviations):
 			"identity_management_key": patient_reference,
 		}
 
-		prescription_list = requests.post(config.ccdr_url + "/api/v1/mobile/prescription/list/", json=body)
+		prescription_list = upstream.post("ccdr", "/api/v1/mobile/prescription/list/", json=body)
 
 		if prescription_list:
-			messages_scores.append(multimodal_notifications['MIS_11'][country_code])  # Patient did not register medicine
+			# Patient did not register medicine
+			messages_scores.append(catalog.entry("MULTIMODAL", "MIS_11", country_code))
 	else:
 		if scores_result["mis"] < 0:
-			messages_scores.append(multimodal_notifications['MIS_21'][country_code])  # Register the medicine
+			messages_scores.append(catalog.entry("MULTIMODAL", "MIS_21", country_code))  # Register the medicine
 		else:
-			messages_scores.append(multimodal_notifications['MIS_31'][country_code])  # Continue daily medicine intake
+			# Continue daily medicine intake
+			messages_scores.append(catalog.entry("MULTIMODAL", "MIS_31", country_code))
 
 	# Motor Functions Score (MFS)
 	if scores[1]["mfs"] == 1:
-		messages_scores.append(multimodal_notifications['MFS_11'][country_code])  # No symptoms detected
+		messages_scores.append(catalog.entry("MULTIMODAL", "MFS_11", country_code))  # No symptoms detected
 	else:
 		if scores_result["mfs"] < 0:
-			messages_scores.append(multimodal_notifications['MFS_21'][country_code])  # Contact doctor to get feedback
+			# Contact doctor to get feedback
+			messages_scores.append(catalog.entry("MULTIMODAL", "MFS_21", country_code))
 		else:
-			messages_scores.append(multimodal_notifications['MFS_31'][country_code])  # Improving motor functions
+			messages_scores.append(catalog.entry("MULTIMODAL", "MFS_31", country_code))  # Improving motor functions
 
 	# Physical Activity Score (PAS)
 	if scores[1]["pas"] == 0:
-		messages_scores.append(multimodal_notifications['PAS_11'][country_code])  # No activity detected
+		messages_scores.append(catalog.entry("MULTIMODAL", "PAS_11", country_code))  # No activity detected
 	else:
 		if scores_result["pas"] < 0:
-			messages_scores.append(multimodal_notifications['PAS_21'][country_code])  # Encourage to be physically active
+			# Encourage to be physically active
+			messages_scores.append(catalog.entry("MULTIMODAL", "PAS_21", country_code))
 		else:
-			messages_scores.append(multimodal_notifications['PAS_31'][country_code])  # Physical activity are improving
+			# Physical activity are improving
+			messages_scores.append(catalog.entry("MULTIMODAL", "PAS_31", country_code))
 
 	# Sleep Score (SS)
 	if scores[1]["ss"] == 0:
-		messages_scores.append(multimodal_notifications['SS_11'][country_code])  # No sleep detected, wear the wristband
+		# No sleep detected, wear the wristband
+		messages_scores.append(catalog.entry("MULTIMODAL", "SS_11", country_code))
 	else:
 		if scores_result["ss"] < 0:
-			messages_scores.append(multimodal_notifications['SS_21'][country_code])  # Encourage to sleep
+			messages_scores.append(catalog.entry("MULTIMODAL", "SS_21", country_code))  # Encourage to sleep
 		else:
-			messages_scores.append(multimodal_notifications['SS_31'][country_code])  # Sleep score is improving
+			messages_scores.append(catalog.entry("MULTIMODAL", "SS_31", country_code))  # Sleep score is improving
 
 	# Deviations
 	# Alarm by type of alert (key) if probability is greater than 0.5
@@ -115,15 +172,14 @@ def multimodal_evaluation(patient_reference, country_code, scores, deviations):
 	start_date = today - timedelta(days=14)
 	end_date = today - timedelta(days=1)
 
-	# Extract username and email from patient_reference
-	body = {
-		"identity_management_key": patient_reference
-	}
-	patient_information = requests.post(config.idm_url + "/findUserByIdentityKey", json=body).json()
-	username = patient_information["username"]
+	# Username of the patient, only requested if there are alerts
+	username = None
 
 	for category in alert_list:
-		messages_deviations.append(multimodal_notifications["D_1"][country_code].format(
+		if username is None:
+			username = identity.get_username(patient_reference)
+		messages_deviations.append(catalog.entry(
+			"MULTIMODAL", "D_1", country_code,
 			username, patient_reference, start_date.strftime("%d/%m/%Y"), end_date.strftime("%d/%m/%Y"),
 			"{:.3f}".format(deviations[1][category]), category_dict[category]))
 
@@ -135,268 +191,312 @@ def multimodal_evaluation(patient_reference, country_code, scores, deviations):
 
 # Game recommendations
 
+class GameSessions:
+	"""
+	Game sessions of one or more patients stored as typed columns, one row per session. Categories, levels and
+	personalization values are stored as vocabulary codes, 0 being an empty category or level.
+	"""
+
+	def __init__(self, summarization_lists):
+		"""
+		:param summarization_lists: Summarization days returned by CCDR for every patient, one item per day
+		"""
+		self.patients = len(summarization_lists)
+		self.vocabularies = {"category": {}, "level": {}, "language": {}, "style": {}, "textsize": {}}
+
+		rows = []
+		days_played = []
+		started = []
+		for patient, summarization_list in enumerate(summarization_lists):
+			patient_days_played = 0
+			patient_started = 0
+			date = None
+			day = 0
+			for summarization_day in summarization_list:
+				# Filter duplicate dates
+				if date != summarization_day["date"]:
+					day += 1
+					date = summarization_day["date"]
+					if summarization_day["session_info"]:
+						patient_days_played += 1
+
+				# Days not played are returned as None in session_info
+				if summarization_day["session_info"]:
+					for session in summarization_day["session_info"]:
+						rows.append((
+							patient, game_index[session["id"][-1:]], day,
+							self.encode("category", session["category"], True),
+							self.encode("level", session["level"], True),
+							session["metric_global"], session["metric_score"], session["metric_time"],
+							session["metric_interaction"], session["avg_time_between_clicks"],
+							self.encode("language", session["app_language"]),
+							self.encode("style", session["app_style"]),
+							self.encode("textsize", session["app_textsize"])))
+					patient_started += summarization_day["session_interaction_results"]["nclicks_game_start"]
+			days_played.append(patient_days_played)
+			started.append(patient_started)
+
+		columns = list(zip(*rows)) or [()] * 13
+		self.days_played = np.array(days_played, dtype=np.int32)
+		self.started = np.array(started, dtype=np.int64)
+		self.patient = np.array(columns[0], dtype=np.int64)
+		self.game = np.array(columns[1], dtype=np.int64)
+		self.day = np.array(columns[2], dtype=np.int16)
+		self.category = np.array(columns[3], dtype=np.int64)
+		self.level = np.array(columns[4], dtype=np.int64)
+		# Global, score, time and interaction metrics. Missing values are NaN
+		self.metrics = np.array(columns[5:9], dtype=np.float64).reshape(4, len(rows))
+		self.click_time = np.array(columns[9], dtype=np.float64)
+		# Language, style and text size
+		self.personalization = np.array(columns[10:13], dtype=np.int64).reshape(3, len(rows))
+
+	def encode(self, name, value, empty=False):
+		"""
+		Get the code of a value in a vocabulary.
+
+		:param name: Vocabulary name
+		:param value: Value
+		:param empty: True if empty values are stored as 0
+		:return: Code
+		"""
+		if empty and not value:
+			return 0
+		vocabulary = self.vocabularies[name]
+		code = vocabulary.get(value)
+		if code is None:
+			code = vocabulary[value] = len(vocabulary) + 1
+		return code
+
+	def __len__(self):
+		return len(self.game)
+
+	def count_by_patient(self, mask=None):
+		"""
+		Count the sessions of every patient.
+
+		:param mask: Boolean array of the sessions to count
+		:return: Array of counts by patient
+		"""
+		patient = self.patient if mask is None else self.patient[mask]
+		return np.bincount(patient, minlength=self.patients)
+
+	def game_means(self):
+		"""
+		Get the mean of every metric by patient and game.
+
+		:return: Array of means (metric, patient, game), NaN for games not played, and boolean array of games played
+		(patient, game)
+		"""
+		cells = self.patients * 7
+		cell = self.patient * 7 + self.game
+		counts = np.bincount(cell, minlength=cells).reshape(self.patients, 7)[:, 1:]
+		index = (np.arange(4)[:, np.newaxis] * cells + cell).ravel()
+		sums = np.bincount(index, weights=self.metrics.ravel(), minlength=4 * cells)
+		sums = sums.reshape(4, self.patients, 7)[:, :, 1:]
+		means = np.full(sums.shape, np.nan)
+		np.divide(sums, counts, out=means, where=counts > 0)
+		return means, counts > 0
+
+	def global_means(self):
+		"""
+		Get the mean global metric of every patient, ignoring missing values.
+
+		:return: Array of means by patient, NaN for patients without values
+		"""
+		values = self.metrics[0]
+		valid = ~np.isnan(values)
+		sums = np.bincount(self.patient[valid], weights=values[valid], minlength=self.patients)
+		counts = self.count_by_patient(valid)
+		means = np.full(self.patients, np.nan)
+		np.divide(sums, counts, out=means, where=counts > 0)
+		return means
+
+	def distinct(self, group, column, groups):
+		"""
+		Count the distinct non-empty values of a column by group.
+
+		:param group: Array of group indexes
+		:param column: Array of codes
+		:param groups: Number of groups
+		:return: Array of counts by group
+		"""
+		mask = column > 0
+		size = int(column.max(initial=0)) + 1
+		pairs = np.unique(group[mask] * size + column[mask])
+		return np.bincount(pairs // size, minlength=groups)
+
+	def distinct_by_game(self, column):
+		"""
+		Count the distinct non-empty values of a column by patient and game.
+
+		:param column: Array of codes
+		:return: Array of counts (patient, game id)
+		"""
+		cells = self.distinct(self.patient * 7 + self.game, column, self.patients * 7)
+		return cells.reshape(self.patients, 7)
+
+
+# Game ids by session id suffix
+game_index = {"1": 1, "2": 2, "3": 3, "4": 4, "5": 5, "6": 6}
+
+# Games with categories and levels, and the number of categories that should be played
+category_limits = {1: 4, 5: 3, 6: 3}
+
+
+def get_game_summarization_list(patient_reference):
+	"""
+	Get the game summarization list of the last week.
+
+	:param patient_reference: Patient identification
+	:return: List of summarization days
+	"""
+	today = datetime.now().date()
+	return get_summarization_list(patient_reference, today - timedelta(days=6), today)
+
+
 def game_evaluation(patient_reference, country_code):
 	"""
 	Evaluate data for specific patient based on weekly game data.
 
 	:param country_code: Country code of the patient
 	:param patient_reference: Reference to identify patient.
-	:return: A list of messages containing a notifications for game.
+	:return: A list of category keys and messages containing a notifications for game.
 	"""
+	return game_evaluation_batch([get_game_summarization_list(patient_reference)], [country_code])[0]
 
-	messages = []
-	messages_tier2 = []
-	messages_tier3 = []
 
-	body = {
-		"identity_management_key": patient_reference,
-		"role": "patient",
-		"startDate": (datetime.now() - timedelta(days=6)).strftime("%d-%m-%Y"),
-		"endDate": datetime.now().strftime("%d-%m-%Y")
-	}
+def game_evaluation_batch(summarization_lists, country_codes):
+	"""
+	Evaluate the weekly game data of several patients in a single pass.
 
-	summarization_list = requests.post(config.ccdr_url + "/api/v1/game/getSummarizationList", json=body)
-
-	game_summarization = {
-		"days_played": 0,
-		"games": {
-			"global": [],  # Games completed
-			"specific": {  # Games played per day
-				"1": [], "2": [], "3": [], "4": [], "5": [], "6": [], "7": [],
-			},
-			"type": {  # Games played per type of game
-				"1": 0, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0
-			},
-		},
-		"stats": {
-			"started": {  # Games started
-				"1": 0, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0
-			},
-			"restarted": {  # Games restarted
-				"1": 0, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0
-			},
-			"categories": {
-				"global": [],  # Total list of categories
-				"specific": {  # List of categories per day
-					"1": [], "2": [], "3": [], "4": [], "5": [], "6": [], "7": [],
-				},
-				"type": {  # Categories played per game
-					"1": [], "5": [], "6": [],
-				}
-			},
-			"level": {
-				"global": [],  # Total list of levels
-				"specific": {  # List of levels per day
-					"1": [], "2": [], "3": [], "4": [], "5": [], "6": [], "7": []
-				},
-				"type": {  # Level played per game
-					"1": [], "5": [], "6": [],
-				}
-			},
-			"time_between_clicks": [],  # List of times per game
-		},
-		"personalization": {  # Total list
-			"language": [], "style": [], "textsize": [],
-		},
-		"metrics": {
-			"total": {  # Total metrics per session
-				"global": [], "score": [], "time": [], "interaction": []
-			},
-			"type": {  # Metrics per game
-				"global": {"1": [], "2": [], "3": [], "4": [], "5": [], "6": []},
-				"score": {"1": [], "2": [], "3": [], "4": [], "5": [], "6": []},
-				"time": {"1": [], "2": [], "3": [], "4": [], "5": [], "6": []},
-				"interaction": {"1": [], "2": [], "3": [], "4": [], "5": [], "6": []},
-			}
-		}
-	}
+	:param summarization_lists: Summarization list of every patient
+	:param country_codes: Country code of every patient
+	:return: A list of category keys and messages containing a notifications for game, for every patient.
+	"""
+	results = []
+	for messages, messages_tier2, messages_tier3 in game_recommendations(GameSessions(summarization_lists),
+																		 country_codes):
+		# Select randomly a message if there are more than two notifications, sorting by priority
+		if len(messages) < 2:
+			if messages_tier2:
+				try:
+					msg_sample = sample(messages_tier2, 2 - len(messages))
+					messages.extend(msg_sample)
+				except ValueError:
+					messages.extend(messages_tier2)
+			if len(messages) < 2 and messages_tier3:
+				try:
+					msg_sample = sample(messages_tier3, 2 - len(messages))
+					messages.extend(msg_sample)
+				except ValueError:
+					messages.extend(messages_tier3)
+		results.append(messages)
+
+	return results
+
+
+def game_recommendations(sessions, country_codes):
+	"""
+	Apply the game recommendation rules to the sessions of every patient.
 
-	date = None
-	day = 0
-
-	# Loop over general list, being one item per day. Assign data based on parameters obtained.
-	for summarization_day in summarization_list.json():
-		# Filter duplicate dates
-		if date != summarization_day["date"]:
-			day += 1
-			date = summarization_day["date"]
-			if summarization_day["session_info"]:
-				game_summarization["days_played"] += 1
-
-		# Days not played are returned as None in session_info
-		if summarization_day["session_info"]:
-			# Loop through every session of the day and save the games played
-			for session in summarization_day["session_info"]:
-				game_summarization["games"]["global"].append(session["id"][-1:])
-				game_summarization["games"]["specific"][str(day)].append(session["id"][-1:])
-				game_summarization["games"]["type"][session["id"][-1:]] += 1
-
-				game_summarization["stats"]["categories"]["global"].append(session["category"])
-				if session["category"]:
-					game_summarization["stats"]["categories"]["specific"][str(day)].append(session["category"])
-					game_summarization["stats"]["categories"]["type"][session["id"][-1:]].append(session["category"])
-
-				game_summarization["stats"]["level"]["global"].append(session["level"])
-				if session["level"]:
-					game_summarization["stats"]["level"]["specific"][str(day)].append(session["level"])
-					game_summarization["stats"]["level"]["type"][session["id"][-1:]].append(session["level"])
-
-				game_summarization["personalization"]["language"].append(session["app_language"])
-				game_summarization["personalization"]["style"].append(session["app_style"])
-				game_summarization["personalization"]["textsize"].append(session["app_textsize"])
-
-				game_summarization["metrics"]["total"]["global"].append(session["metric_global"])
-				game_summarization["metrics"]["total"]["score"].append(session["metric_score"])
-				game_summarization["metrics"]["total"]["time"].append(session["metric_time"])
-				game_summarization["metrics"]["total"]["interaction"].append(session["metric_interaction"])
-
-				game_summarization["metrics"]["type"]["global"][session["id"][-1:]].append(session["metric_global"])
-				game_summarization["metrics"]["type"]["score"][session["id"][-1:]].append(session["metric_score"])
-				game_summarization["metrics"]["type"]["time"][session["id"][-1:]].append(session["metric_time"])
-				game_summarization["metrics"]["type"]["interaction"][session["id"][-1:]].append(
-					session["metric_interaction"])
-
-				game_summarization["stats"]["time_between_clicks"].append(session["avg_time_between_clicks"])
-
-			game_summarization["stats"]["started"][str(day)] += summarization_day["session_interaction_results"][
-				"nclicks_game_start"]
-			game_summarization["stats"]["restarted"][str(day)] += summarization_day["session_interaction_results"][
-				"nclicks_game_restart"]
-
-	# Summarize mean stats
-	global_mean = []
-	score_mean = []
-	time_mean = []
-	interaction_mean = []
-	for game in range(6):
-		if game_summarization["metrics"]["type"]["global"][str(game + 1)]:
-			global_mean.append(np.mean(game_summarization["metrics"]["type"]["global"][str(game + 1)]))
-			score_mean.append(np.mean(game_summarization["metrics"]["type"]["score"][str(game + 1)]))
-			time_mean.append(np.mean(game_summarization["metrics"]["type"]["time"][str(game + 1)]))
-			interaction_mean.append(np.mean(game_summarization["metrics"]["type"]["interaction"][str(game + 1)]))
-		else:
-			global_mean.append(None)
-			score_mean.append(None)
-			time_mean.append(None)
-			interaction_mean.append(None)
-
-	# Recommendation 1.1
-	# Use frequently cognitive game app
-	if game_summarization["days_played"] < 3 and not game_summarization["days_played"] == 0:
-		messages.append(game_notifications['R11'][country_code])
-
-	# Recommendation 1.2
-	# Play slowly
-	# If by average, any click value is lower than 5 seconds
-	avg_clicks_values_lower = [value for value in game_summarization["stats"]["time_between_clicks"] if value < 5]
-
-	# Check if len of appended values are more than 30% of the games completed and send notification if metrics are low
-	games_notification = []
-	if game_summarization["days_played"] > 0:
-		if len(avg_clicks_values_lower) / len(game_summarization["stats"]["time_between_clicks"]) < 0.3:
-			for idx, game_mean in enumerate(global_mean):
-				if game_mean and game_mean < 0.5:
-					games_notification.append(idx + 1)
-		if games_notification:
-			games_notification = ",".join([str(item) for item in games_notification])
-			messages.append(game_notifications['R12'][country_code].format(str(games_notification)))
-
-	# Recommendation 1.3
-	# Complete the games
-	if game_summarization["days_played"] > 0:
-		if len(game_summarization["games"]["global"]) < sum(game_summarization["stats"]["started"].values()) / 2:
-			messages.append(game_notifications['R13'][country_code])
-
-	# Recommendation 1.4
-	# Start a different game. Check the games played and compare with the whole list of 6 games
-	if game_summarization["days_played"] > 0:
-		unique, counts = np.unique(game_summarization["games"]["global"], return_counts=True)
-		list_diff = np.setdiff1d(["1", "2", "3", "4", "5", "6"], list(unique))
-		if len(list_diff) > 0:
-			messages.append(game_notifications['R14'][country_code])
-
-	# Recommendation 2.1
-	# Change game category
-	game_categories = []
-	if game_summarization["days_played"] > 0:
-		for game in ["1", "5", "6"]:
-			unique, counts = np.unique(game_summarization["stats"]["categories"]["type"][game], return_counts=True)
-			if game == "1":
-				if 0 < len(unique) < 4:
-					game_categories.append(game)
-			else:
-				if 0 < len(unique) < 3:
-					game_categories.append(game)
-
-		if game_categories:
-			game_categories = ",".join([str(item) for item in game_categories])
-			messages_tier2.append(game_notifications['R21'][country_code].format(game_categories))
-
-	# Recommendation 2.2 / 2.3
-	# Change game level
-	if game_summarization["days_played"] > 0:
-		game_levels_pos = []
-		game_levels_neg = []
-		for game in ["1", "5", "6"]:
-			unique, counts = np.unique(game_summarization["stats"]["level"]["type"][game], return_counts=True)
-			if 0 < len(unique) == 1:
-				if game_summarization["metrics"]["type"]["global"][game]:
-					if np.mean(game_summarization["metrics"]["type"]["global"][game]) > 0.5:
-						game_levels_pos.append(game)
+	:param sessions: GameSessions of the patients
+	:param country_codes: Country code of every patient
+	:return: Lists of category keys and messages by priority tier, for every patient
+	"""
+	means, played = sessions.game_means()
+	# Games with a low mean, a mean of 0 is not considered
+	low_means = played & (means != 0) & (means < 0.5)
+
+	# Group-by results as lists, rules below only read scalars
+	days_played = sessions.days_played.tolist()
+	started = sessions.started.tolist()
+	session_counts = sessions.count_by_patient().tolist()
+	slow_clicks = sessions.count_by_patient(sessions.click_time < 5).tolist()
+	low_global = low_means[0].tolist()
+	any_low = low_means.any(axis=(0, 2)).tolist()
+	all_played = played.all(axis=1).tolist()
+	global_game_means = means[0].tolist()
+	categories = sessions.distinct_by_game(sessions.category).tolist()
+	levels = sessions.distinct_by_game(sessions.level).tolist()
+	personalization = [sessions.distinct(sessions.patient, column, sessions.patients).tolist()
+					   for column in sessions.personalization]
+	global_means = sessions.global_means().tolist()
+
+	results = []
+	for patient, country_code in enumerate(country_codes):
+		messages = []
+		messages_tier2 = []
+		messages_tier3 = []
+
+		# Recommendation 1.1
+		# Use frequently cognitive game app
+		if 0 < days_played[patient] < 3:
+			messages.append(catalog.entry("GAME", "R11", country_code))
+
+		if days_played[patient] > 0:
+			# Recommendation 1.2
+			# Play slowly
+			# Check if less than 30% of the games completed have an average click time lower than 5 seconds, and
+			# send notification if metrics are low
+			if slow_clicks[patient] / session_counts[patient] < 0.3:
+				games_notification = [str(game + 1) for game, low in enumerate(low_global[patient]) if low]
+				if games_notification:
+					messages.append(catalog.entry("GAME", "R12", country_code, ",".join(games_notification)))
+
+			# Recommendation 1.3
+			# Complete the games
+			if session_counts[patient] < started[patient] / 2:
+				messages.append(catalog.entry("GAME", "R13", country_code))
+
+			# Recommendation 1.4
+			# Start a different game
+			if not all_played[patient]:
+				messages.append(catalog.entry("GAME", "R14", country_code))
+
+			# Recommendation 2.1
+			# Change game category
+			game_categories = [str(game) for game, limit in category_limits.items()
+							   if 0 < categories[patient][game] < limit]
+			if game_categories:
+				messages_tier2.append(catalog.entry("GAME", "R21", country_code, ",".join(game_categories)))
+
+			# Recommendation 2.2 / 2.3
+			# Change game level
+			game_levels_pos = []
+			game_levels_neg = []
+			for game in category_limits:
+				if levels[patient][game] == 1:
+					if global_game_means[patient][game - 1] > 0.5:
+						game_levels_pos.append(str(game))
 					else:
-						game_levels_neg.append(game)
-
-		if game_levels_pos:
-			game_levels_pos = ",".join([str(item) for item in game_levels_pos])
-			messages_tier2.append(game_notifications['R22'][country_code].format(game_levels_pos))
-		if game_levels_neg:
-			game_levels_neg = ",".join([str(item) for item in game_levels_neg])
-			messages_tier2.append(game_notifications['R23'][country_code].format(game_levels_neg))
-
-	# Recommendation 2.4
-	# Read carefully game information
-	# Get games with values less than 0.5
-	if game_summarization["days_played"] > 0:
-		for param in [global_mean, score_mean, time_mean, interaction_mean]:
-			values = [value for value in param if value if value < 0.5]
-
-			if values:
-				messages_tier2.append(game_notifications['R24'][country_code])
-				break
-
-	# Recommendation 3.1
-	# Customize the app
-	if game_summarization["days_played"] > 0:
-		for key in game_summarization["personalization"]:
-			uniques = np.unique(game_summarization["personalization"][key])
-
-			if not len(uniques) > 1:
-				messages_tier3.append(game_notifications['R31'][country_code])
-
-	# Recommendation 3.2 / 3.3 / 3.4
-	# Extract mean global metric and send notification based on results
-	if game_summarization["metrics"]["total"]["global"]:
-		mean_score_global = np.nanmean(np.array(game_summarization["metrics"]["total"]["global"], dtype=np.float64))
-		if mean_score_global > 0.8:
-			messages_tier3.append(game_notifications['R32'][country_code])
-		elif 0.5 < mean_score_global < 0.8:
-			messages_tier3.append(game_notifications['R33'][country_code])
-		else:
-			messages_tier3.append(game_notifications['R34'][country_code])
-
-	# Select randomly a message if there are more than two notifications, sorting by priority
-	if len(messages) < 2:
-		if messages_tier2:
-			try:
-				msg_sample = sample(messages_tier2, 2 - len(messages))
-				messages.extend(msg_sample)
-			except ValueError:
-				messages.extend(messages_tier2)
-		if len(messages) < 2 and messages_tier3:
-			try:
-				msg_sample = sample(messages_tier3, 2 - len(messages))
-				messages.extend(msg_sample)
-			except ValueError:
-				messages.extend(messages_tier3)
-
-	return messages
+						game_levels_neg.append(str(game))
+			if game_levels_pos:
+				messages_tier2.append(catalog.entry("GAME", "R22", country_code, ",".join(game_levels_pos)))
+			if game_levels_neg:
+				messages_tier2.append(catalog.entry("GAME", "R23", country_code, ",".join(game_levels_neg)))
+
+			# Recommendation 2.4
+			# Read carefully game information if any metric is low
+			if any_low[patient]:
+				messages_tier2.append(catalog.entry("GAME", "R24", country_code))
+
+			# Recommendation 3.1
+			# Customize the app, once per personalization never changed
+			for distinct_values in personalization:
+				if not distinct_values[patient] > 1:
+					messages_tier3.append(catalog.entry("GAME", "R31", country_code))
+
+		# Recommendation 3.2 / 3.3 / 3.4
+		# Extract mean global metric and send notification based on results
+		if session_counts[patient]:
+			mean_score_global = global_means[patient]
+			if mean_score_global > 0.8:
+				messages_tier3.append(catalog.entry("GAME", "R32", country_code))
+			elif 0.5 < mean_score_global < 0.8:
+				messages_tier3.append(catalog.entry("GAME", "R33", country_code))
+			else:
+				messages_tier3.append(catalog.entry("GAME", "R34", country_code))
+
+		results.append((messages, messages_tier2, messages_tier3))
+
+	return results
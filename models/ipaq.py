@@ -0,0 +1,98 @@
+import numpy as np
+
+# MET values by intensity
+vigorous_met_value = 8.0
+moderate_met_value = 4.0
+walk_met_value = 3.3
+
+# Activity categories, 0 being an incomplete questionnaire
+category_names = {0: "unknown", 1: "inactive", 2: "minimally_active", 3: "hepa_active"}
+
+
+def answers_matrix(answers_list):
+	"""
+	Build the answers matrix of several IPAQ questionnaires.
+
+	:param answers_list: List of IPAQ answers (vigorous, moderate and walk days, hours and minutes, and sitting hours
+	and minutes), None for patients without questionnaire
+	:return: Array of answers (patient, question), NaN for missing answers
+	"""
+	empty = [None] * 11
+	return np.array([answers or empty for answers in answers_list], dtype=np.float64).reshape(len(answers_list), 11)
+
+
+def met_values(matrix):
+	"""
+	Compute the MET values of every questionnaire.
+
+	:param matrix: Array of answers (patient, question)
+	:return: Dictionary of arrays with the vigorous, moderate, walk and total MET values, and the activity times
+	"""
+	vigorous_days, vigorous_hours, vigorous_minutes, moderate_days, moderate_hours, moderate_minutes, \
+		walk_days, walk_hours, walk_minutes = matrix[:, :9].T
+
+	vigorous_time = vigorous_minutes + (60 * vigorous_hours)
+	moderate_time = moderate_minutes + (60 * moderate_hours)
+	walk_time = walk_minutes + (60 * walk_hours)
+	vigorous_met = vigorous_met_value * vigorous_days * vigorous_time
+	moderate_met = moderate_met_value * moderate_days * moderate_time
+	walk_met = walk_met_value * walk_days * walk_time
+	return {
+		"vigorous_time": vigorous_time,
+		"moderate_time": moderate_time,
+		"walk_time": walk_time,
+		"vigorous": vigorous_met,
+		"moderate": moderate_met,
+		"walk": walk_met,
+		"total": vigorous_met + moderate_met + walk_met
+	}
+
+
+def categories(matrix):
+	"""
+	Compute the activity category of every questionnaire.
+
+	:param matrix: Array of answers (patient, question)
+	:return: Array of categories: 1 inactive, 2 minimally active, 3 HEPA active, 0 incomplete questionnaire
+	"""
+	met = met_values(matrix)
+	vigorous_days, moderate_days, walk_days = matrix[:, 0], matrix[:, 3], matrix[:, 6]
+	days = walk_days + moderate_days + vigorous_days
+
+	# Vigorous activity: minimally active, HEPA active with enough MET
+	vigorous = (vigorous_days >= 3) & (met["vigorous_time"] >= 20)
+	hepa = (met["vigorous"] >= 1500) | ((days >= 7) & (met["total"] >= 3000))
+	# Moderate activity and walking: minimally active with enough time or MET, otherwise inactive
+	minimal = (moderate_days + walk_days >= 5) & (
+		(met["moderate_time"] + met["walk_time"] >= 30) | ((days >= 5) & (met["total"] >= 600)))
+
+	category = np.where(vigorous, np.where(hepa, 3, 2), np.where(minimal, 2, 1))
+	category[np.isnan(matrix).any(axis=1)] = 0
+	return category
+
+
+def report(organizations, answers_list):
+	"""
+	Summarize the activity categories and MET values by organization.
+
+	:param organizations: Organization of every patient
+	:param answers_list: IPAQ answers of every patient
+	:return: Dictionary of category counts and mean MET value by organization
+	"""
+	matrix = answers_matrix(answers_list)
+	category = categories(matrix)
+	total_met = met_values(matrix)["total"]
+
+	names, organization = np.unique(np.array(organizations, dtype=str), return_inverse=True)
+	counts = np.bincount(organization * 4 + category, minlength=len(names) * 4).reshape(len(names), 4)
+	complete = category > 0
+	met_sums = np.bincount(organization[complete], weights=total_met[complete], minlength=len(names))
+
+	result = {}
+	for index, name in enumerate(names.tolist()):
+		result[name] = {"patients": int(counts[index].sum())}
+		for code, category_name in category_names.items():
+			result[name][category_name] = int(counts[index, code])
+		complete_count = int(counts[index, 1:].sum())
+		result[name]["mean_met"] = round(float(met_sums[index]) / complete_count, 1) if complete_count else None
+	return result
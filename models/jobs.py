@@ -0,0 +1,103 @@
+import os
+import socket
+from datetime import timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from helper import config
+from models.patients import db
+
+# Process identification stored in the leases
+owner = "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+class JobLease(db.Model):
+	__tablename__ = 'JobLeases'
+
+	name = db.Column(db.String, primary_key=True)
+	owner = db.Column(db.String, nullable=False)
+	expires = db.Column(db.DateTime(timezone=True), nullable=False)
+	last_run = db.Column(db.DateTime, nullable=False)  # Scheduled time of the latest run
+
+	@staticmethod
+	def acquire(name, scheduled_time, ttl=None):
+		"""
+		Claim a scheduled run of a job. The lease is granted if no process holds it and the run was not claimed
+		before, in a single statement so concurrent processes cannot both get it.
+
+		:param name: Job identification
+		:param scheduled_time: Scheduled time of the run
+		:param ttl: Seconds the lease is held if the process does not release it
+		:return: True if this process must run the job
+		"""
+		table = JobLease.__table__
+		expires = func.now() + timedelta(seconds=ttl or config.job_lease_ttl)
+		statement = insert(table).values(name=name, owner=owner, expires=expires, last_run=scheduled_time)
+		statement = statement.on_conflict_do_update(
+			index_elements=[table.c.name],
+			set_={"owner": owner, "expires": expires, "last_run": scheduled_time},
+			where=(table.c.expires < func.now()) & (table.c.last_run < statement.excluded.last_run)
+		).returning(table.c.name)
+
+		with db.engine.begin() as connection:
+			return connection.execute(statement).first() is not None
+
+	@staticmethod
+	def release(name):
+		"""
+		Release the lease of a job held by this process. The scheduled time is kept, so the run is not repeated.
+
+		:param name: Job identification
+		:return: None
+		"""
+		table = JobLease.__table__
+		with db.engine.begin() as connection:
+			connection.execute(
+				table.update()
+				.where(table.c.name == name, table.c.owner == owner)
+				.values(expires=func.now()))
+
+
+class ArmedRound(db.Model):
+	__tablename__ = 'ArmedRounds'
+
+	name = db.Column(db.String, primary_key=True)
+	armed = db.Column(db.DateTime(timezone=True), nullable=False)
+
+	@staticmethod
+	def arm(name):
+		"""
+		Profile the next run of a round, in whichever process of the cluster runs it.
+
+		:param name: Round name
+		:return: None
+		"""
+		table = ArmedRound.__table__
+		with db.engine.begin() as connection:
+			connection.execute(
+				insert(table).values(name=name, armed=func.now()).on_conflict_do_nothing(index_elements=[table.c.name]))
+
+	@staticmethod
+	def get_all():
+		"""
+		Get the rounds profiled on their next run.
+
+		:return: Sorted list of round names
+		"""
+		table = ArmedRound.__table__
+		with db.engine.begin() as connection:
+			return [name for name, in connection.execute(select(table.c.name).order_by(table.c.name))]
+
+	@staticmethod
+	def consume(name):
+		"""
+		Disarm a round before its run is profiled, in a single statement so only one process profiles the run.
+
+		:param name: Round name
+		:return: True if the round was armed
+		"""
+		table = ArmedRound.__table__
+		with db.engine.begin() as connection:
+			statement = table.delete().where(table.c.name == name).returning(table.c.name)
+			return connection.execute(statement).first() is not None
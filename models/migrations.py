@@ -0,0 +1,57 @@
+from sqlalchemy import text
+
+from helper.utils import logger
+from models.patients import Notifications
+
+# Schema changes on tables that already exist, since create_all only creates missing tables.
+# Every statement must be idempotent, as they run on every start.
+migrations = [
+	# Notification dates stored as "%d-%m-%Y %H:%M:%S" strings become timestamps
+	"""
+	DO $$
+	BEGIN
+		IF EXISTS (
+			SELECT 1 FROM information_schema.columns
+			WHERE table_name = 'Notifications' AND column_name = 'datetime_sent' AND data_type = 'character varying'
+		) THEN
+			ALTER TABLE "Notifications"
+				ALTER COLUMN datetime_sent TYPE TIMESTAMP
+					USING to_timestamp(datetime_sent, 'DD-MM-YYYY HH24:MI:SS')::timestamp,
+				ALTER COLUMN datetime_read TYPE TIMESTAMP
+					USING to_timestamp(datetime_read, 'DD-MM-YYYY HH24:MI:SS')::timestamp;
+		END IF;
+	END $$;
+	""",
+	'CREATE INDEX IF NOT EXISTS ix_notifications_patient_datetime_sent ON "Notifications" (patient, datetime_sent)',
+	# Catalog category key of the notifications
+	'ALTER TABLE "Notifications" ADD COLUMN IF NOT EXISTS category VARCHAR',
+	'CREATE INDEX IF NOT EXISTS ix_notifications_category_datetime_sent ON "Notifications" (category, datetime_sent)',
+	# Stored patient diagnosis
+	'ALTER TABLE "RecommenderPatients" ADD COLUMN IF NOT EXISTS diagnosis VARCHAR',
+	'ALTER TABLE "RecommenderPatients" ADD COLUMN IF NOT EXISTS diagnosis_updated TIMESTAMP',
+	# Stored patient activity
+	'ALTER TABLE "RecommenderPatients" ADD COLUMN IF NOT EXISTS ipaq_date TIMESTAMP',
+	'ALTER TABLE "RecommenderPatients" ADD COLUMN IF NOT EXISTS ipaq_answers JSON',
+	'ALTER TABLE "RecommenderPatients" ADD COLUMN IF NOT EXISTS ipaq_category INTEGER',
+	'ALTER TABLE "RecommenderPatients" ADD COLUMN IF NOT EXISTS inactivity_minutes INTEGER',
+	'ALTER TABLE "RecommenderPatients" ADD COLUMN IF NOT EXISTS activity_updated TIMESTAMP',
+]
+
+
+def upgrade(_db, app):
+	"""
+	Apply the schema migrations in a single transaction.
+
+	:param _db: Database object.
+	:param app: Application instance
+	:return: None
+	"""
+	with app.app_context():
+		with _db.engine.begin() as connection:
+			for statement in migrations:
+				connection.execute(text(statement))
+
+		updated = Notifications.backfill_categories()
+		if updated:
+			logger.info("Category set for {} stored notifications".format(updated))
+	logger.debug("Database migrations applied")
@@ -1,19 +1,54 @@
 import json
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 from uuid import uuid4
 
 import requests
+from flask import current_app
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import relationship
+from sqlalchemy import bindparam, event, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, relationship
 
-from helper import config
-from helper.utils import logger, general_notifications, ieq_notifications, par_notifications
-from models import evaluation
+from helper import config, identity, metrics, profiling, upstream
+from helper.concurrency import RoundExecutor
+from helper.catalog import catalog
+from helper.utils import logger
 
 db = SQLAlchemy()
 
 
+@event.listens_for(Engine, "commit")
+def count_commit(connection):
+	metrics.db_commits.inc()
+
+
+@event.listens_for(Session, "before_commit")
+def commit_started(session):
+	if profiling.active():
+		session.info["commit_started"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def commit_finished(session):
+	started = session.info.pop("commit_started", None)
+	if started is not None:
+		profiling.record("db.commit", started)
+
+
+# Par days with weekly game notifications
+game_days = [7, 14, 21, 28, 35]
+
+# Previous week scores requested while the multimodal round generates the current week ones. Threads are started on
+# first use.
+previous_scores_pool = ThreadPoolExecutor(
+	max_workers=config.upstream_concurrency["ccdr"], thread_name_prefix="previous-scores")
+
+
 class RecommenderPatients(db.Model, UserMixin):
 	__tablename__ = 'RecommenderPatients'
 
@@ -22,12 +57,27 @@ class RecommenderPatients(db.Model, UserMixin):
 	organization = db.Column(db.String, nullable=False)
 	notification = relationship("Notifications", backref="RecommenderPatient")
 	status = db.Column(db.Boolean, nullable=False)
+	diagnosis = db.Column(db.String, nullable=True)  # CCDR diagnosis code
+	diagnosis_updated = db.Column(db.DateTime, nullable=True)
+	# Activity from the latest IPAQ questionnaire, refreshed after the PAR round
+	ipaq_date = db.Column(db.DateTime, nullable=True)
+	ipaq_answers = db.Column(db.JSON, nullable=True)
+	ipaq_category = db.Column(db.Integer, nullable=True)
+	inactivity_minutes = db.Column(db.Integer, nullable=True)
+	activity_updated = db.Column(db.DateTime, nullable=True)
 
 	def __init__(self, ccdr_reference, organization, par_day=0):
 		self.ccdr_reference = ccdr_reference
 		self.par_day = par_day
 		self.organization = organization
 		self.status = True
+		self.diagnosis = None
+		self.diagnosis_updated = None
+		self.ipaq_date = None
+		self.ipaq_answers = None
+		self.ipaq_category = None
+		self.inactivity_minutes = None
+		self.activity_updated = None
 
 	def get_dict(self):
 		"""
@@ -78,63 +128,62 @@ class RecommenderPatients(db.Model, UserMixin):
 			message = None
 			country_code = self.organization_mapping()
 			if self.par_day in range(1, 41):
-				message = par_notifications[str(self.par_day)][country_code]
+				message = catalog.message("PAR", self.par_day, country_code)
 			# Latest notifications in the cycle may contain different message based on diagnosis
 			if self.par_day in range(36, 41) and len(message) == 3:
-				body = {
-					"identity_management_key": self.ccdr_reference
-				}
-				response = requests.post(
-					config.ccdr_url + "/api/v1/profile/getDiagnosis",
-					json=body).json()
-				diagnosis = RecommenderPatients.diagnosis_mapping(response["diagnosis"])
+				diagnosis = RecommenderPatients.diagnosis_mapping(self.get_diagnosis())
 				try:
 					message = message[diagnosis]
 				except (IndexError, TypeError):
 					message = ""
 			if message:
-				notification = Notifications(self.ccdr_reference, message, receiver)
+				notification = Notifications(self.ccdr_reference, message, receiver, "PAR/" + str(self.par_day))
 				self.notification.append(notification)
 				notification.send()
 
 			# IEQ notifications
 			if self.par_day in [10, 15, 25, 30, 35, 40]:
-				message = ieq_notifications[str(self.par_day)][country_code]
+				message = catalog.message("IEQ", self.par_day, country_code)
 				if message:
-					notification = Notifications(self.ccdr_reference, message, receiver)
+					notification = Notifications(self.ccdr_reference, message, receiver, "IEQ/" + str(self.par_day))
 					self.notification.append(notification)
 					notification.send()
 
 		# IPAQ notification
 		if self.par_day in [7, 14, 21, 28, 35] or ipaq:
 			country_code = self.organization_mapping()
-			message = general_notifications["IPAQ"][country_code]
-			ipaq_notification = Notifications(self.ccdr_reference, message, receiver)
+			message = catalog.message("IPAQ", None, country_code)
+			ipaq_notification = Notifications(self.ccdr_reference, message, receiver, "IPAQ")
 			self.notification.append(ipaq_notification)
 			ipaq_notification.send()
 
 		db.session.commit()
 
-	def game_notification(self):
+	def game_notification(self, messages=None):
 		"""
 		Send game notification to the patient
 
+		:param messages: Game messages of the patient, already evaluated by the game round
 		:return: None
 		"""
-		if self.par_day in [7, 14, 21, 28, 35]:
+		if self.par_day in game_days:
 			country_code = self.organization_mapping()
-			messages = evaluation.game_evaluation(self.ccdr_reference, country_code)
+			if messages is None:
+				# The evaluation modules load NumPy, they are imported on first use
+				from models import evaluation
+				with profiling.span("evaluation"):
+					messages = evaluation.game_evaluation(self.ccdr_reference, country_code)
 
 			if messages:
 				receiver = "game"
-				for message in messages:
-					notification = Notifications(self.ccdr_reference, message, receiver)
+				for category, message in messages:
+					notification = Notifications(self.ccdr_reference, message, receiver, category)
 					self.notification.append(notification)
 					notification.send()
 			else:
 				receiver = "mobile"
-				message = general_notifications["COGNITIVE"][country_code]
-				notification = Notifications(self.ccdr_reference, message, receiver)
+				message = catalog.message("COGNITIVE", None, country_code)
+				notification = Notifications(self.ccdr_reference, message, receiver, "COGNITIVE")
 				self.notification.append(notification)
 				notification.send()
 
@@ -158,106 +207,186 @@ class RecommenderPatients(db.Model, UserMixin):
 
 	def par_analysis(self):
 		"""
-		Make par analysys to provide patient category and variables
+		Make par analysys to provide patient category and variables, and store the result in the patient
 
 		:return: category: Patient category.
 		variables: Dictionary with patient quest data
 		"""
-		logger.info("Evaluating activity for patient " + self.ccdr_reference)
+		logger.info("Evaluating activity for patient %s", self.ccdr_reference)
+		try:
+			quests = RecommenderPatients.request_questionnaires(self.ccdr_reference)
+		except requests.exceptions.RequestException:
+			logger.error("Error in par_analysis. No connection to CCDR.")
+			return None, None
+
+		activity = RecommenderPatients.analyse_activity(quests, datetime.today())
+		if activity["ipaq_answers"] is not None:
+			activity["ipaq_category"] = RecommenderPatients.activity_category(activity["ipaq_answers"])
+		for key, value in activity.items():
+			setattr(self, key, value)
+		self.activity_updated = datetime.now()
+		return self.ipaq_category, self.ipaq_answers
+
+	def get_activity(self):
+		"""
+		Get the activity of the patient from the IPAQ questionnaire of the last week. The stored analysis is used,
+		the questionnaires are only requested if the patient was never analysed.
+
+		:return: category: Patient category.
+		inactivity_minutes: Minutes sitting per day
+		"""
+		if self.activity_updated is None:
+			self.par_analysis()
+			db.session.commit()
+
+		today = datetime.today()
+		if self.ipaq_date is None or not today > self.ipaq_date > today - timedelta(weeks=1):
+			return None, None
+		return self.ipaq_category, self.inactivity_minutes
+
+	@staticmethod
+	def request_questionnaires(ccdr_reference):
+		"""
+		Function to request the questionnaire responses of a patient to CCDR.
+
+		:param ccdr_reference: Patient identification
+		:return: List of questionnaire responses
+		"""
 		body = {
-			"identity_management_key": self.ccdr_reference
+			"identity_management_key": ccdr_reference
 		}
+		response = upstream.post("ccdr", "/api/v1/web/questionnaire/getPatientQuestionnairesResponses", json=body)
+		if not response:
+			logger.debug('No questionnaire for patient %s', ccdr_reference)
+			return []
+		return response.json()
 
-		# Initialize variables
-		category = None
-		variables = None
+	@staticmethod
+	def analyse_activity(quests, today):
+		"""
+		Function to get the activity of a patient from the first IPAQ questionnaire answered in the last week.
+
+		:param quests: List of questionnaire responses
+		:param today: Date of the analysis
+		:return: activity: Dictionary with the questionnaire date, answers and inactivity minutes. The category is
+		computed by the caller.
+		"""
+		activity = {
+			"ipaq_date": None,
+			"ipaq_answers": None,
+			"ipaq_category": None,
+			"inactivity_minutes": None
+		}
 
-		today = datetime.today()
 		week_ago = today - timedelta(weeks=1)
-		try:
-			response = requests.post(
-				config.ccdr_url + "/api/v1/web/questionnaire/getPatientQuestionnairesResponses", json=body).json()
-
-			valid_quests = []
-			if response:
-				for quest in response.json():
-					survey_id = quest["survey_id"].split(".")[0]
-					if survey_id == "7":
-						# test = "Mon Jun 28 09:07:16 UTC 2021".replace(" UTC ", " ")
-						survey_datetime = datetime.strptime(quest["date"].replace(" UTC ", " "), '%a %b %d %H:%M:%S %Y')
-						if today > survey_datetime > week_ago:
-							valid_quests.append(quest)
-							logger.debug(quest)
-			else:
-				logger.debug('No questionnaire for patient {}'.format(self.ccdr_reference))
-
-			if valid_quests:
-				final_quest = valid_quests[0]
-				vigorous_days, vigorous_hours, vigorous_minutes, moderate_days, moderate_hours, moderate_minutes, \
-					walk_days, walk_hours, walk_minutes, sitting_hours, sitting_minutes = (None,) * 11
-				for answer in final_quest["answers"]:
-					question_id = answer["question_id"]
-					if question_id == 0:
-						vigorous_days = int(answer["text_input_value"])
-					if question_id == 1:
-						vigorous_hours = int(answer["text_input_value"])
-					if question_id == 2:
-						vigorous_minutes = int(answer["text_input_value"])
-					if question_id == 3:
-						moderate_days = int(answer["text_input_value"])
-					if question_id == 4:
-						moderate_hours = int(answer["text_input_value"])
-					if question_id == 5:
-						moderate_minutes = int(answer["text_input_value"])
-					if question_id == 6:
-						walk_days = int(answer["text_input_value"])
-					if question_id == 7:
-						walk_hours = int(answer["text_input_value"])
-					if question_id == 8:
-						walk_minutes = int(answer["text_input_value"])
-					if question_id == 9:
-						sitting_hours = int(answer["text_input_value"])
-					if question_id == 10:
-						sitting_minutes = int(answer["text_input_value"])
-
-				variables = vigorous_days, vigorous_hours, vigorous_minutes, moderate_days, moderate_hours, \
-					moderate_minutes, walk_days, walk_hours, walk_minutes, sitting_hours, sitting_minutes
-
-				if None not in variables:
-					vigorous_met_value = 8.0
-					moderate_met_value = 4.0
-					walk_met_value = 3.3
-					vigorous_time = vigorous_minutes + (60 * vigorous_hours)
-					moderate_time = moderate_minutes + (60 * moderate_hours)
-					walk_time = walk_minutes + (60 * walk_hours)
-					vigorous_met = vigorous_met_value * vigorous_days * vigorous_time
-					moderate_met = moderate_met_value * moderate_days * moderate_time
-					walk_met = walk_met_value * walk_days * walk_time
-					total_met_value = vigorous_met + moderate_met + walk_met
-
-					if vigorous_days >= 3 and vigorous_time >= 20:
-						category = 2  # Minimally active
-						if vigorous_met >= 1500:
-							category = 3  # HEPA Active
-						else:
-							if walk_days + moderate_days + vigorous_days >= 7 and total_met_value >= 3000:
-								category = 3  # HEPA Active
-					else:
-						if moderate_days + walk_days >= 5:
-							if moderate_time + walk_time >= 30:
-								category = 2  # Minimally active
-							else:
-								if walk_days + moderate_days + vigorous_days >= 5 and total_met_value >= 600:
-									category = 2  # Minimally active
-								else:
-									category = 1  # Inactive
-						else:
-							category = 1  # Inactive
-		except requests.exceptions.ConnectionError:
-			logger.error("Error in par_analysis. No connection to CCDR.")
-			category = None
-			variables = None
-		return category, variables
+		for quest in quests:
+			survey_id = quest["survey_id"].split(".")[0]
+			if survey_id == "7":
+				# test = "Mon Jun 28 09:07:16 UTC 2021".replace(" UTC ", " ")
+				survey_datetime = datetime.strptime(quest["date"].replace(" UTC ", " "), '%a %b %d %H:%M:%S %Y')
+				if today > survey_datetime > week_ago:
+					logger.debug(quest)
+					break
+		else:
+			return activity
+
+		variables = RecommenderPatients.ipaq_variables(quest)
+		activity["ipaq_date"] = survey_datetime
+		activity["ipaq_answers"] = list(variables)
+		sitting_hours, sitting_minutes = variables[9], variables[10]
+		if sitting_hours is not None and sitting_minutes is not None:
+			activity["inactivity_minutes"] = sitting_minutes + (60 * sitting_hours)
+		return activity
+
+	@staticmethod
+	def ipaq_variables(quest):
+		"""
+		Function to get the answers of an IPAQ questionnaire.
+
+		:param quest: Questionnaire response
+		:return: variables: Vigorous, moderate and walk days, hours and minutes, and sitting hours and minutes
+		"""
+		variables = [None] * 11
+		for answer in quest["answers"]:
+			question_id = answer["question_id"]
+			if question_id in range(11):
+				variables[question_id] = int(answer["text_input_value"])
+		return tuple(variables)
+
+	@staticmethod
+	def activity_category(variables):
+		"""
+		Function to get the activity category from the IPAQ answers.
+
+		:param variables: IPAQ answers
+		:return: category: Patient category, or None if the questionnaire is incomplete
+		"""
+		from models import ipaq
+		category = int(ipaq.categories(ipaq.answers_matrix([variables]))[0])
+		return category or None
+
+	@staticmethod
+	def refresh_activity():
+		"""
+		Function to request concurrently the questionnaires of the active patients and store their activity in one
+		statement, so reading a PAR notification does not wait for CCDR.
+
+		:return: Number of patients refreshed
+		"""
+		patients, total = RecommenderPatients.get_patients_db()
+		references = [patient.ccdr_reference for patient in patients if patient and patient.status]
+
+		rows = []
+		today = datetime.today()
+		with ThreadPoolExecutor(max_workers=config.upstream_concurrency["ccdr"]) as pool:
+			futures = [pool.submit(RecommenderPatients.request_questionnaires, ref) for ref in references]
+			for ref, future in zip(references, futures):
+				try:
+					activity = RecommenderPatients.analyse_activity(future.result(), today)
+				except requests.exceptions.RequestException as e:
+					logger.error("Getting questionnaires of patient {}: {}".format(ref, e))
+					continue
+				except (KeyError, ValueError, TypeError) as e:
+					# A malformed questionnaire only skips its patient
+					logger.error("Invalid questionnaires of patient {}: {!r}".format(ref, e))
+					continue
+				activity["ref"] = ref
+				activity["activity_updated"] = datetime.now()
+				rows.append(activity)
+
+		if rows:
+			from models import ipaq
+			# Categories of every questionnaire in a single pass
+			answers = ipaq.answers_matrix([row["ipaq_answers"] for row in rows])
+			for row, category in zip(rows, ipaq.categories(answers).tolist()):
+				row["ipaq_category"] = category or None
+
+			table = RecommenderPatients.__table__
+			db.session.execute(
+				table.update()
+				.where(table.c.ccdr_reference == bindparam("ref"))
+				.values(
+					ipaq_date=bindparam("ipaq_date"), ipaq_answers=bindparam("ipaq_answers"),
+					ipaq_category=bindparam("ipaq_category"), inactivity_minutes=bindparam("inactivity_minutes"),
+					activity_updated=bindparam("activity_updated")),
+				rows)
+			db.session.commit()
+		return len(rows)
+
+	@staticmethod
+	def activity_report():
+		"""
+		Function to summarize the stored activity of the active patients by organization.
+
+		:return: report: Category counts and mean MET value by organization
+		"""
+		query = db.session.query(RecommenderPatients.organization, RecommenderPatients.ipaq_answers) \
+			.filter(RecommenderPatients.status.is_(True))
+		if config.test_flag:
+			query = query.filter(RecommenderPatients.ccdr_reference.in_(config.test_references))
+		rows = query.all()
+		from models import ipaq
+		return ipaq.report([organization for organization, _ in rows], [answers for _, answers in rows])
 
 	@staticmethod
 	def get_patients_db():
@@ -283,76 +412,262 @@ class RecommenderPatients(db.Model, UserMixin):
 		:param receiver: Environment for receiving messages.
 		:return: patient_count: Number of patients that have been notified.
 		"""
+		started = time.perf_counter()
 		patient_references, patients_total = RecommenderPatients.get_patients_db()
 		patient_count = 0
 
-		for patient in patient_references:
-			patient_count = patient_count + 1
-			if patient.status:
+		# Patients already notified by an interrupted run of the round are skipped
+		run = RoundRun.start(receiver)
+		done = run.completed_patients()
+
+		if receiver == "multimodal" and config.identity_prefetch == "yes":
+			identity.prefetch([patient.ccdr_reference for patient in patient_references
+							   if patient.status and patient.par_day % 8 == 0 and patient.par_day != 0
+							   and patient.ccdr_reference not in done])
+
+		if config.round_workers > 1:
+			tasks = []
+			for patient in patient_references:
+				patient_count = patient_count + 1
+				if patient.status and patient.ccdr_reference not in done:
+					tasks.append((run.id, patient.ccdr_reference, receiver, patient_count, patients_total))
+
+			executor = RoundExecutor(current_app._get_current_object(), db.session, config.round_workers)
+			executor.run(tasks, RecommenderPatients.notify_round_patient)
+			# Workers committed through their own sessions
+			db.session.expire_all()
+			processed = len(tasks)
+		else:
+			processed = 0
+			for patient in patient_references:
+				patient_count = patient_count + 1
+				if patient.status and patient.ccdr_reference not in done:
+					patient.notify(receiver, patient_count, patients_total, run.id)
+					processed = processed + 1
+				RecommenderPatients.commit_round(patient_count)
+			db.session.commit()
+
+		run.finish()
+		metrics.round_patients.inc(receiver, amount=processed)
+		metrics.round_seconds.observe(time.perf_counter() - started, receiver)
+		return patient_count
+
+	@staticmethod
+	def game_round():
+		"""
+		Function to send the weekly game notifications. Game data of the patients is requested concurrently and
+		evaluated in a single batch.
+
+		:return: patient_count: Number of patients in the round.
+		"""
+		started = time.perf_counter()
+		patients, patients_total = RecommenderPatients.get_patients_db()
+		run = RoundRun.start("game")
+		done = run.completed_patients()
+		due = [patient for patient in patients
+			   if patient.status and patient.par_day in game_days and patient.ccdr_reference not in done]
+
+		from models import evaluation
+		fetched = []
+		summarization_lists = []
+		with ThreadPoolExecutor(max_workers=config.upstream_concurrency["ccdr"]) as pool:
+			fetch = profiling.propagate(evaluation.get_game_summarization_list)
+			futures = [pool.submit(fetch, patient.ccdr_reference) for patient in due]
+			for patient, future in zip(due, futures):
+				try:
+					summarization_lists.append(future.result())
+					fetched.append(patient)
+				except requests.exceptions.RequestException as e:
+					logger.error("Patient {} skipped in game round: {}".format(patient.ccdr_reference, e))
+
+		country_codes = [patient.organization_mapping() for patient in fetched]
+		with profiling.span("evaluation", patients=len(fetched)):
+			results = evaluation.game_evaluation_batch(summarization_lists, country_codes)
+
+		if config.round_workers > 1:
+			tasks = [(run.id, patient.ccdr_reference, "game", patient_count, len(fetched), messages)
+					 for patient_count, (patient, messages) in enumerate(zip(fetched, results), 1)]
+			executor = RoundExecutor(current_app._get_current_object(), db.session, config.round_workers)
+			executor.run(tasks, RecommenderPatients.notify_round_patient)
+			# Workers committed through their own sessions
+			db.session.expire_all()
+		else:
+			for patient_count, (patient, messages) in enumerate(zip(fetched, results), 1):
+				patient.notify("game", patient_count, len(fetched), run.id, messages)
+				RecommenderPatients.commit_round(patient_count)
+			db.session.commit()
+
+		run.finish()
+		metrics.round_patients.inc("game", amount=len(fetched))
+		metrics.round_seconds.observe(time.perf_counter() - started, "game")
+		return patients_total
+
+	@staticmethod
+	def notify_round_patient(run_id, ref, receiver, patient_count, patients_total, messages=None):
+		"""
+		Send the notifications of the round to a patient and record it in the round checkpoint, in the same
+		transaction.
+
+		:param run_id: Round run identification
+		:param ref: Patient identification
+		:param receiver: Environment for receiving messages.
+		:param patient_count: Position of the patient in the round.
+		:param patients_total: Number of patients in the round.
+		:param messages: Game messages of the patient, already evaluated by the game round
+		:return: None
+		"""
+		RecommenderPatients.notify_by_ccdr_ref(ref, receiver, patient_count, patients_total, run_id, messages)
+
+	@staticmethod
+	def notify_by_ccdr_ref(ref, receiver, patient_count, patients_total, run_id=None, messages=None):
+		"""
+		Load the patient in the current session and send the notifications of the round.
+
+		:param ref: Patient identification
+		:param receiver: Environment for receiving messages.
+		:param patient_count: Position of the patient in the round.
+		:param patients_total: Number of patients in the round.
+		:param run_id: Round run identification, to record the patient in the round checkpoint
+		:param messages: Game messages of the patient, already evaluated by the game round
+		:return: None
+		"""
+		patient = RecommenderPatients.get_by_ccdr_ref(ref)
+		if patient:
+			patient.notify(receiver, patient_count, patients_total, run_id, messages)
+
+	@staticmethod
+	def commit_round(patient_count):
+		"""
+		Commit the notified patients of a round. Notifications stored for the outbox are committed in batches, sent
+		notifications are recorded right away.
+
+		:param patient_count: Position of the patient in the round.
+		:return: None
+		"""
+		if config.notification_mode != "outbox" or patient_count % config.outbox_batch_size == 0:
+			db.session.commit()
+
+	def notify(self, receiver, patient_count, patients_total, run_id=None, messages=None):
+		"""
+		Send the notifications of the round to the patient. Its changes and round checkpoint are kept in a savepoint,
+		a failing upstream only rolls back this patient and not the uncommitted patients before it.
+
+		:param receiver: Environment for receiving messages.
+		:param patient_count: Position of the patient in the round.
+		:param patients_total: Number of patients in the round.
+		:param run_id: Round run identification, to record the patient in the round checkpoint
+		:param messages: Game messages of the patient, already evaluated by the game round
+		:return: None
+		"""
+		ccdr_reference = self.ccdr_reference
+		with profiling.span("patient", patient=ccdr_reference, receiver=receiver):
+			savepoint = db.session.begin_nested()
+			try:
+				if run_id is not None:
+					db.session.add(RoundCheckpoint(run_id, ccdr_reference))
 				if receiver == "par":
-					logger.info("[PAR] Patient " + patient.ccdr_reference + ": " + str(patient_count) + "/" + str(
-						patients_total))
-					patient.par_notification()
+					logger.info("[PAR] Patient %s: %s/%s", ccdr_reference, patient_count, patients_total)
+					self.par_notification()
 				elif receiver == "game":
-					logger.info("[Game] Patient " + patient.ccdr_reference + ": " + str(patient_count) + "/" + str(
-						patients_total))
-					patient.game_notification()
+					logger.info("[Game] Patient %s: %s/%s", ccdr_reference, patient_count, patients_total)
+					self.game_notification(messages)
 				elif receiver == "goals":
-					logger.info("[Goals] Patient " + patient.ccdr_reference + ": " + str(patient_count) + "/" + str(
-						patients_total))
-					patient.goals_notifications()
+					logger.info("[Goals] Patient %s: %s/%s", ccdr_reference, patient_count, patients_total)
+					self.goals_notifications()
 				elif receiver == "multimodal":
-					logger.info("[Multimodal] Patient " + patient.ccdr_reference + ": " + str(patient_count) + "/" + str(
-						patients_total))
-					patient.multimodal_notification()
+					logger.info("[Multimodal] Patient %s: %s/%s", ccdr_reference, patient_count, patients_total)
+					self.multimodal_notification()
 				elif receiver == "hydration":
-					logger.info("[Hydration] Patient " + patient.ccdr_reference + ": " + str(patient_count) + "/" + str(
-						patients_total))
-					patient.hydration_notification()
-
-		return patient_count
+					logger.info("[Hydration] Patient %s: %s/%s", ccdr_reference, patient_count, patients_total)
+					self.hydration_notification()
+				# Commits of sent notifications already released the savepoint
+				if savepoint.is_active:
+					savepoint.commit()
+			except requests.exceptions.RequestException as e:
+				# A failing upstream skips the patient instead of stopping the round
+				if savepoint.is_active:
+					savepoint.rollback()
+				logger.error("Patient {} skipped in {} round: {}".format(ccdr_reference, receiver, e))
 
 	@staticmethod
 	def update_db():
 		"""
 		Update the database with the new patient data.
 
-		:return: List of patients.
+		:return: List of patients, total number of patients and synchronization counts.
 		"""
 		try:
 			if config.platform == "local":
-				response = requests.get(config.ccdr_url + "/api/v1/mobile/patient").json()
+				response = upstream.get("ccdr", "/api/v1/mobile/patient").json()
 				org = "organization_code"
 			else:
-				response = requests.get(config.idm_url + "/getPilotThreePatientKeys").json()
+				response = upstream.get("idm", "/getPilotThreePatientKeys").json()
 				org = "organization"
-			ccdr_list = []
+
+			# Keep the first organization reported for every reference
+			central_patients = {}
 			for patient in response:
-				ccdr_ref = patient["identity_management_key"]
-				organization = patient[org]
+				central_patients.setdefault(patient["identity_management_key"], patient[org])
 
-				ccdr_list.append(ccdr_ref)
+			sync = RecommenderPatients.bulk_sync(central_patients)
+			logger.info("Patients synchronized. Inserted: {inserted}, reactivated: {reactivated}, "
+						"deactivated: {deactivated}".format(**sync))
 
-				# Add new patients to internal recommender database
-				rec_patient = RecommenderPatients.get_by_ccdr_ref(ccdr_ref)
-				if not rec_patient:
-					rec_patient = RecommenderPatients(ccdr_ref, organization)
-					rec_patient.save()
-				else:
-					rec_patient.status = True
-					rec_patient.save()
+			refreshed = RecommenderPatients.refresh_diagnoses()
+			if refreshed:
+				logger.info("Diagnosis refreshed for {} patients".format(refreshed))
 
-			# Clean deleted patients from central database in the internal one
-			patients_rmdr, total = RecommenderPatients.get_patients_db()
-			for patient in patients_rmdr:
-				if patient.ccdr_reference not in ccdr_list:
-					patient.status = False
-					patient.save()
-			return RecommenderPatients.get_patients_db()
+			patients, total = RecommenderPatients.get_patients_db()
+			return patients, total, sync
 
 		except requests.exceptions.RequestException as e:
 			logger.error("Getting all patients from CCDR.")
-			return str(e), 0
+			return str(e), 0, None
+
+	@staticmethod
+	def bulk_sync(central_patients):
+		"""
+		Synchronize the internal database with the central patient list using set-based statements in one transaction.
+
+		:param central_patients: Dictionary of organization codes by patient reference.
+		:return: sync: Number of patients inserted, reactivated and deactivated.
+		"""
+		table = RecommenderPatients.__table__
+		existing = dict(db.session.query(RecommenderPatients.ccdr_reference, RecommenderPatients.status).all())
+
+		new_patients = [
+			{"ccdr_reference": ref, "organization": organization, "par_day": 0, "status": True}
+			for ref, organization in central_patients.items() if ref not in existing]
+		reactivate = [ref for ref in central_patients if ref in existing and not existing[ref]]
+
+		# Patients removed from the central database. In test mode only the test references are managed.
+		managed = config.test_references if config.test_flag else existing
+		deactivate = [ref for ref in managed if existing.get(ref) and ref not in central_patients]
+
+		inserted = 0
+		try:
+			# Patients inserted meanwhile by a concurrent synchronization, e.g. the warm-up of another replica, are
+			# skipped. Multi-row inserts by pages return the patients actually inserted.
+			for start in range(0, len(new_patients), 1000):
+				statement = insert(table).values(new_patients[start:start + 1000]) \
+					.on_conflict_do_nothing(index_elements=[table.c.ccdr_reference]).returning(table.c.ccdr_reference)
+				inserted = inserted + len(db.session.execute(statement).fetchall())
+			if reactivate:
+				db.session.execute(
+					table.update().where(table.c.ccdr_reference.in_(reactivate)).values(status=True))
+			if deactivate:
+				db.session.execute(
+					table.update().where(table.c.ccdr_reference.in_(deactivate)).values(status=False))
+			db.session.commit()
+		except Exception:
+			db.session.rollback()
+			raise
+
+		return {
+			"inserted": inserted,
+			"reactivated": len(reactivate),
+			"deactivated": len(deactivate)
+		}
 
 	def multimodal_notification(self):
 		"""
@@ -364,40 +679,67 @@ class RecommenderPatients(db.Model, UserMixin):
 		deviations = []
 
 		if self.par_day % 8 == 0 and self.par_day != 0:
-			actionlib_response_prev, fusionlib_response_prev = self.calculate_scores(True)
+			# Previous week scores are stored by the previous multimodal round. If they are missing, CCDR is requested
+			# while the current week scores and deviations are generated
+			previous_start, previous_end = RecommenderPatients.scores_dates(True)
+			history = WeeklyScores.get_previous(self.ccdr_reference, previous_start.date(), previous_end.date())
+			previous = None
+			if history is None:
+				previous = previous_scores_pool.submit(profiling.propagate(RecommenderPatients.request_scores),
+													   self.ccdr_reference, self.scores_body(True), True)
 			actionlib_response, fusionlib_response = self.calculate_scores()
 
-			if actionlib_response.status_code == 200 and fusionlib_response.status_code == 200:
-				logger.debug("ActionLib Response:\nStatus: {}\nContent: {}\n".format(
-					str(actionlib_response.status_code), str(actionlib_response.content)))
-				logger.debug("FusionLib Response:\nStatus: {}\nContent: {}\n".format(
-					str(actionlib_response.status_code), str(actionlib_response.content)))
+			scores_prev = None
+			if history is not None:
+				scores_prev = history.scores
+			else:
+				actionlib_response_prev, fusionlib_response_prev = previous.result()
+				if actionlib_response_prev is not None and actionlib_response_prev.status_code == 200:
+					scores_prev = {
+						key: item["score"] for key, item in actionlib_response_prev.json()["scores"].items()}
+
+			if fusionlib_response is not None and fusionlib_response.status_code == 200:
+				logger.debug("ActionLib Response:\nStatus: %s\nContent: %s\n",
+							 actionlib_response.status_code, actionlib_response.content)
+				logger.debug("FusionLib Response:\nStatus: %s\nContent: %s\n",
+							 actionlib_response.status_code, actionlib_response.content)
+
+				start_date, end_date = RecommenderPatients.scores_dates()
+				weekly_scores = WeeklyScores(
+					self.ccdr_reference, start_date.date(), end_date.date(), actionlib_response.json()["scores"],
+					fusionlib_response.json()["deviations"])
+				db.session.add(weekly_scores)
+
+				if scores_prev is None:
+					logger.error("Previous week scores not found for patient {}".format(self.ccdr_reference))
+					return
 
 				# Scores and deviations information
-				scores_prev = {key: item["score"] for key, item in actionlib_response_prev.json()["scores"].items()}
 				scores.append(scores_prev)
-				scores.append(actionlib_response.json()["scores"])
+				scores.append(weekly_scores.scores)
 				deviations.append(None)
-				deviations.append(fusionlib_response.json()["deviations"])
+				deviations.append(weekly_scores.deviations)
 
 				logger.debug(scores)
 				logger.debug(deviations)
 
 				# Scores and deviations recommendations
 				country_code = self.organization_mapping()
-				messages_scores, messages_deviations = evaluation.multimodal_evaluation(
-					self.ccdr_reference, country_code, scores, deviations)
+				from models import evaluation
+				with profiling.span("evaluation"):
+					messages_scores, messages_deviations = evaluation.multimodal_evaluation(
+						self.ccdr_reference, country_code, scores, deviations)
 
-				for message in messages_scores:
+				for category, message in messages_scores:
 					if message:
 						receiver = "mobile"
-						notification = Notifications(self.ccdr_reference, message, receiver)
+						notification = Notifications(self.ccdr_reference, message, receiver, category)
 						self.notification.append(notification)
 						notification.send()
-				for message in messages_deviations:
+				for category, message in messages_deviations:
 					if message:
 						receiver = "web"
-						notification = Notifications(self.ccdr_reference, message, receiver)
+						notification = Notifications(self.ccdr_reference, message, receiver, category)
 						self.notification.append(notification)
 						notification.send()
 				# logger.info("--------------")
@@ -411,8 +753,8 @@ class RecommenderPatients(db.Model, UserMixin):
 		"""
 		country_code = self.organization_mapping()
 		receiver = "mobile"
-		message = general_notifications["HYDRATION"][country_code]
-		notification = Notifications(self.ccdr_reference, message, receiver)
+		message = catalog.message("HYDRATION", None, country_code)
+		notification = Notifications(self.ccdr_reference, message, receiver, "HYDRATION")
 		self.notification.append(notification)
 		notification.send()
 
@@ -422,21 +764,32 @@ class RecommenderPatients(db.Model, UserMixin):
 		Function to calculate the scores and deviations for a specific patient and date.
 
 		:param previous: Compute previous week scores and deviations.
-		:return: None
+		:return: ActionLib and FusionLib responses
 		"""
+		return RecommenderPatients.request_scores(self.ccdr_reference, self.scores_body(previous), previous)
 
-		actionlib_response = None
-		fusionlib_response = None
+	@staticmethod
+	def scores_dates(previous=False):
+		"""
+		Function to get the measurement dates of the weekly scores.
 
+		:param previous: Previous week dates.
+		:return: start_date, end_date: First and last day of the week
+		"""
 		today = datetime.today()
 		if previous:
-			start_date = today - timedelta(days=14)
-			end_date = today - timedelta(days=8)
-		else:
-			start_date = today - timedelta(days=7)
-			end_date = today - timedelta(days=1)
+			return today - timedelta(days=14), today - timedelta(days=8)
+		return today - timedelta(days=7), today - timedelta(days=1)
 
-		body = {
+	def scores_body(self, previous=False):
+		"""
+		Function to build the body of the scores and deviations requests.
+
+		:param previous: Previous week dates.
+		:return: body: Request body
+		"""
+		start_date, end_date = RecommenderPatients.scores_dates(previous)
+		return {
 			"identity_management_key": "recommendLib",
 			"organization": self.organization,
 			"role": "system",
@@ -446,32 +799,62 @@ class RecommenderPatients(db.Model, UserMixin):
 			"measurements_end_date": end_date.strftime("%d-%m-%Y"),
 		}
 
+	@staticmethod
+	def request_scores(ccdr_reference, body, previous=False):
+		"""
+		Function to request the scores and deviations of a patient. It does not use the database session, so it can
+		run in a worker thread.
+
+		:param ccdr_reference: Patient identification
+		:param body: Request body
+		:param previous: Get the stored previous week scores instead of generating them.
+		:return: ActionLib (or CCDR for the previous week) and FusionLib responses
+		"""
+		actionlib_response = None
+		fusionlib_response = None
+
 		# Generate scores and deviatons into the platform
 		headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
 
 		try:
 			if previous:
-				actionlib_response = requests.post(
-					config.ccdr_url + "/api/v1/fusionlib/getWeeklyScores", data=json.dumps(body), headers=headers
-				)
+				actionlib_response = RecommenderPatients.timed_post(
+					ccdr_reference, "ccdr", "/api/v1/fusionlib/getWeeklyScores", data=json.dumps(body), headers=headers)
 			else:
-				actionlib_response = requests.post(
-					config.actionlib_url + "/generate_scores", data=json.dumps(body), headers=headers)
+				actionlib_response = RecommenderPatients.timed_post(
+					ccdr_reference, "actionlib", "/generate_scores", data=json.dumps(body), headers=headers)
 
 				# If there is no response from actionLib, we can skip the fusionLib request and save time
 				if actionlib_response.status_code != 200:
 					logger.error(actionlib_response.text)
 				else:
-					fusionlib_response = requests.post(
-						config.fusionlib_url + "/generate_deviations", data=json.dumps(body), headers=headers)
+					fusionlib_response = RecommenderPatients.timed_post(
+						ccdr_reference, "fusionlib", "/generate_deviations", data=json.dumps(body), headers=headers)
 					if fusionlib_response.status_code != 200:
 						logger.error(fusionlib_response.text)
 
 		except requests.exceptions.RequestException:
-			logger.error("Calculating scores for patient {}".format(self.ccdr_reference))
+			logger.error("Calculating scores for patient {}".format(ccdr_reference))
 
 		return actionlib_response, fusionlib_response
 
+	@staticmethod
+	def timed_post(ccdr_reference, service, path, **kwargs):
+		"""
+		Function to make a POST request to an upstream service and log its duration.
+
+		:param ccdr_reference: Patient identification
+		:param service: Upstream service name
+		:param path: Endpoint path
+		:return: Response
+		"""
+		start = time.perf_counter()
+		try:
+			return upstream.post(service, path, **kwargs)
+		finally:
+			logger.debug("[Multimodal] Patient %s: %s %s took %.3fs", ccdr_reference, service, path,
+						 time.perf_counter() - start)
+
 	@staticmethod
 	def get_color_category(category):
 		"""
@@ -510,6 +893,72 @@ class RecommenderPatients(db.Model, UserMixin):
 			return "en"  # Default English
 
 	# Map the diagnosis code to the disease code
+	@staticmethod
+	def request_diagnosis(ccdr_reference):
+		"""
+		Function to request the diagnosis of a patient to CCDR.
+
+		:param ccdr_reference: Patient identification
+		:return: Diagnosis code
+		"""
+		body = {
+			"identity_management_key": ccdr_reference
+		}
+		return upstream.post("ccdr", "/api/v1/profile/getDiagnosis", json=body).json()["diagnosis"]
+
+	def get_diagnosis(self):
+		"""
+		Function to get the diagnosis of the patient, requesting it again if the stored one expired.
+
+		:return: Diagnosis code
+		"""
+		if self.diagnosis_updated is None \
+				or self.diagnosis_updated < datetime.now() - timedelta(days=config.diagnosis_ttl_days):
+			self.diagnosis = RecommenderPatients.request_diagnosis(self.ccdr_reference)
+			self.diagnosis_updated = datetime.now()
+		return self.diagnosis
+
+	@staticmethod
+	def refresh_diagnoses():
+		"""
+		Function to request concurrently the expired diagnoses of the active patients that get diagnosis based
+		notifications in the next par days, and store them in one statement.
+
+		:return: Number of diagnoses refreshed
+		"""
+		expired = datetime.now() - timedelta(days=config.diagnosis_ttl_days)
+		query = db.session.query(RecommenderPatients.ccdr_reference) \
+			.filter(RecommenderPatients.status.is_(True)) \
+			.filter(RecommenderPatients.par_day.between(35, 40)) \
+			.filter(or_(
+				RecommenderPatients.diagnosis_updated.is_(None), RecommenderPatients.diagnosis_updated < expired))
+		references = [ref for ref, in query.all()]
+		if not references:
+			return 0
+
+		rows = []
+		with ThreadPoolExecutor(max_workers=config.upstream_concurrency["ccdr"]) as pool:
+			fetch = profiling.propagate(RecommenderPatients.request_diagnosis)
+			futures = [pool.submit(fetch, ref) for ref in references]
+			for ref, future in zip(references, futures):
+				try:
+					rows.append({"ref": ref, "diagnosis": future.result(), "updated": datetime.now()})
+				except requests.exceptions.RequestException as e:
+					logger.error("Getting diagnosis of patient {}: {}".format(ref, e))
+				except (KeyError, ValueError, TypeError) as e:
+					# A malformed response only skips its patient
+					logger.error("Invalid diagnosis of patient {}: {!r}".format(ref, e))
+
+		if rows:
+			table = RecommenderPatients.__table__
+			db.session.execute(
+				table.update()
+				.where(table.c.ccdr_reference == bindparam("ref"))
+				.values(diagnosis=bindparam("diagnosis"), diagnosis_updated=bindparam("updated")),
+				rows)
+			db.session.commit()
+		return len(rows)
+
 	@staticmethod
 	def diagnosis_mapping(diagnosis):
 		"""
@@ -534,6 +983,7 @@ class RecommenderPatients(db.Model, UserMixin):
 		:return: None
 		"""
 		message = None
+		category = None
 		if self.par_day % 8 == 0 and self.par_day != 0:
 
 			# Get the steps from the platform
@@ -545,50 +995,59 @@ class RecommenderPatients(db.Model, UserMixin):
 			}
 
 			# Get the steps from the platform
-			response = requests.post(
-				config.ccdr_url + "/api/v1/par/getWeeklySteps",
-				json=body).json()
+			response = upstream.post("ccdr", "/api/v1/par/getWeeklySteps", json=body).json()
 
 			# Create notification based on reached goals
 			country_code = self.organization_mapping()
 			if response["reached_goal"]:
-				message = general_notifications["MOTIVATION"]["STP1"][country_code].format(
+				category, message = catalog.entry(
+					"MOTIVATION", "STP1", country_code,
 					str(response["weekly_steps"]),
 					str(response["reached_goal_daily"]),
 					str(response["weekly_objective"]))
 			else:
-				message = general_notifications["MOTIVATION"]["STP2"][country_code].format(str(response["weekly_steps"]))
+				category, message = catalog.entry("MOTIVATION", "STP2", country_code, str(response["weekly_steps"]))
 
 		if message:
 			receiver = "mobile"
-			notification = Notifications(self.ccdr_reference, message, receiver)
+			notification = Notifications(self.ccdr_reference, message, receiver, category)
 			self.notification.append(notification)
 			notification.send()
 
 
 class Notifications(db.Model, UserMixin):
 	__tablename__ = 'Notifications'
+	__table_args__ = (
+		db.Index('ix_notifications_patient_datetime_sent', 'patient', 'datetime_sent'),
+		db.Index('ix_notifications_category_datetime_sent', 'category', 'datetime_sent'),
+	)
+
+	datetime_format = "%d-%m-%Y %H:%M:%S"
 
 	id = db.Column(db.String, primary_key=True)
 	read = db.Column(db.Boolean, nullable=False)
 	msg = db.Column(db.String, nullable=False)
-	datetime_sent = db.Column(db.String, nullable=True)
-	datetime_read = db.Column(db.String, nullable=True)
+	datetime_sent = db.Column(db.DateTime, nullable=True)
+	datetime_read = db.Column(db.DateTime, nullable=True)
 	receiver = db.Column(db.String, nullable=True)
 	patient = db.Column(db.String, db.ForeignKey('RecommenderPatients.ccdr_reference'))
+	category = db.Column(db.String, nullable=True)  # Catalog category key, e.g. PAR/17, IPAQ
 
-	def __init__(self, ccdr_reference, msg, receiver):
+	def __init__(self, ccdr_reference, msg, receiver, category=None):
 		self.id = str(uuid4())
 		self.msg = msg
+		self.category = category
 		self.read = False
-		self.datetime_sent = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+		self.datetime_sent = datetime.now()
 		self.datetime_read = None
 		self.receiver = receiver
 		self.patient = ccdr_reference
 
 	def send(self):
 		"""
-		Function to send a notification to the patient.
+		Function to send a notification to the patient. In outbox mode the notification is only stored, and committed
+		by the round, for the outbox dispatcher to send it.
+
 		:return: None
 		"""
 		body = {
@@ -601,28 +1060,51 @@ class Notifications(db.Model, UserMixin):
 
 		logger.debug(body)
 
+		# Top level catalog category, e.g. PAR for PAR/17
+		category = self.category.split("/")[0] if self.category else "unknown"
+		if config.notification_mode == "outbox":
+			self.save_notification(commit=False)
+			db.session.add(NotificationOutbox(self, self.receiver, body))
+			metrics.notifications.inc(category, "queued")
+			return
+
 		try:
-			headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
-			if self.receiver == "web":
-				notification_response = requests.post(
-					config.rmq_url + "/notification/sendNotificationToMedicalProfessionalByPatient",
-					data=json.dumps(body), headers=headers
-				)
-				destination = "hcp"
-			else:  # Mobile, game
-				notification_response = requests.post(
-					config.rmq_url + "/notification/sendNotifications",
-					data=json.dumps(body), headers=headers
-				)
-				destination = "patient"
+			notification_response, destination = Notifications.post_rmq(self.receiver, body)
 
 			Notifications.check_response(destination, notification_response, body)
+			metrics.notifications.inc(category, "sent" if notification_response.status_code == 200 else "failed")
 
 			self.save_notification()
 
-		except requests.exceptions.ConnectionError:
+		except requests.exceptions.RequestException:
+			metrics.notifications.inc(category, "failed")
 			logger.error("Sending notification.")
 
+	@staticmethod
+	def post_rmq(receiver, body):
+		"""
+		Function to post a notification body to the RMQ service.
+
+		:param receiver: Receiver device type
+		:param body: Notification body
+		:return: notification_response: Request response.
+		destination: patient or hcp
+		"""
+		headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+		if receiver == "web":
+			notification_response = upstream.post(
+				"rmq", "/notification/sendNotificationToMedicalProfessionalByPatient",
+				data=json.dumps(body), headers=headers
+			)
+			destination = "hcp"
+		else:  # Mobile, game
+			notification_response = upstream.post(
+				"rmq", "/notification/sendNotifications",
+				data=json.dumps(body), headers=headers
+			)
+			destination = "patient"
+		return notification_response, destination
+
 	def get_dict(self):
 		"""
 		Function to get the notification as a dictionary.
@@ -633,24 +1115,26 @@ class Notifications(db.Model, UserMixin):
 			"id": self.id,
 			"msg": self.msg,
 			"read": self.read,
-			"datetime_sent": self.datetime_sent,
-			"datetime_read": self.datetime_read,
+			"datetime_sent": self.datetime_sent.strftime(Notifications.datetime_format) if self.datetime_sent else None,
+			"datetime_read": self.datetime_read.strftime(Notifications.datetime_format) if self.datetime_read else None,
 			"receiver": self.receiver,
 			"patient": self.patient,
 		}
 
-	def save_notification(self):
+	def save_notification(self, commit=True):
 		"""
 		Function to save the notification in the database.
 
+		:param commit: Commit the session. Otherwise the notification is committed with the next batch.
 		:return: None
 		"""
 		if self.id and self.msg and self.patient and self.datetime_sent:
 			db.session.add(self)
-			logger.debug("Notification " + str(self.id) + " saved")
+			logger.debug("Notification %s saved", self.id)
 		else:
 			logger.error("Incomplete notification couldn't be saved")
-		db.session.commit()
+		if commit:
+			db.session.commit()
 
 	@staticmethod
 	def get_by_id(_id):
@@ -674,8 +1158,8 @@ class Notifications(db.Model, UserMixin):
 		"""
 		if response:
 			if response.status_code == 200:
-				logger.debug('Notification sent to {} via {}'.format(
-					body['identity_management_key'], body['receiver_device_type']))
+				logger.debug('Notification sent to %s via %s', body['identity_management_key'],
+							 body['receiver_device_type'])
 			elif response.status_code == 1000:
 				logger.error('NOTIFICATION ERROR: Request returned general error.')
 			elif response.status_code == 1007:
@@ -702,10 +1186,11 @@ class Notifications(db.Model, UserMixin):
 		notification = Notifications.get_by_id(notification_id)
 
 		if notification:
-			par = Notifications.check_par_notification(notification.msg)
+			notification_category = notification.category or catalog.category_of(notification.msg)
+			par = Notifications.check_par_notification(notification_category)
 
 			notification.read = True
-			notification.datetime_read = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+			notification.datetime_read = datetime.now()
 			notification.save_notification()
 
 			if not par:
@@ -715,12 +1200,12 @@ class Notifications(db.Model, UserMixin):
 				}
 			else:
 				patient = RecommenderPatients.get_by_ccdr_ref(notification.patient)
-				category, sitting_minutes = patient.par_analysis()
+				category, inactivity_minutes = patient.get_activity()
 				category = RecommenderPatients.get_color_category(category)
 
 				return {
 					"activity_level_color": category,
-					"inactivity_minutes": sitting_minutes
+					"inactivity_minutes": inactivity_minutes
 				}
 		else:
 			return {
@@ -729,36 +1214,107 @@ class Notifications(db.Model, UserMixin):
 			}
 
 	@staticmethod
-	def check_par_notification(msg):
+	def check_par_notification(category):
 		"""
 		Function to check if the notification is a PAR notification.
 
-		:param msg: Message
+		:param category: Notification category key
 		:return: par: Boolean value
 		"""
-		par = False
-		if any(msg in day.values() for day in par_notifications.values()):
-			par = True
-		return par
+		return category is not None and category.startswith("PAR/")
 
 	@staticmethod
-	def check_timestamp(dates):
+	def backfill_categories():
 		"""
-		Function to check the timestamp of the notification between dates.
+		Function to set the category key of the notifications stored before categories were recorded, with one update
+		per category. Messages not found in the catalogs are set to OTHER.
 
-		:param dates: Range of dates
-		:return: date: Boolean value
+		:return: Number of notifications updated
 		"""
-		for i, date_ts in enumerate(dates):
-			date_ts = ''.join(filter(str.isdigit, date_ts[:10]))
-			date_ts = datetime.strptime(date_ts, "%d%m%Y")
-			date_ts = datetime.timestamp(date_ts)
-			dates[i] = date_ts
+		query = db.session.query(Notifications.msg).filter(Notifications.category.is_(None)).distinct()
+		messages = [msg for msg, in query]
+		categories = {}
+		for msg in messages:
+			categories.setdefault(catalog.category_of(msg) or "OTHER", []).append(msg)
+
+		updated = 0
+		for category, category_messages in categories.items():
+			updated = updated + Notifications.query \
+				.filter(Notifications.category.is_(None), Notifications.msg.in_(category_messages)) \
+				.update({Notifications.category: category}, synchronize_session=False)
+		db.session.commit()
+		return updated
 
-		if dates[2] >= dates[0] >= dates[1]:
-			return True
-		else:
-			return False
+	@staticmethod
+	def get_by_patient(patient_reference, date_start=None, date_end=None, after=None, paginated=False):
+		"""
+		Function to get the notifications sent to a patient between dates, both days included.
+
+		:param patient_reference: Patient identification
+		:param date_start: First day, as day, month and year (e.g. 22/04/2022)
+		:param date_end: Last day, as day, month and year (e.g. 30/05/2022)
+		:param after: Cursor of the last notification already returned
+		:param paginated: Keyset pagination, notifications without date sent have no cursor and are left out
+		:return: Query of notifications ordered by date sent
+		"""
+		query = Notifications.query.filter(Notifications.patient == patient_reference)
+		if paginated:
+			query = query.filter(Notifications.datetime_sent.isnot(None))
+		if date_start:
+			query = query.filter(Notifications.datetime_sent >= Notifications.parse_date(date_start))
+		if date_end:
+			query = query.filter(Notifications.datetime_sent < Notifications.parse_date(date_end) + timedelta(days=1))
+		if after:
+			query = query.filter(
+				tuple_(Notifications.datetime_sent, Notifications.id) > Notifications.decode_cursor(after))
+		return query.order_by(Notifications.datetime_sent, Notifications.id)
+
+	def get_cursor(self):
+		"""
+		Function to get the pagination cursor pointing to the notification.
+
+		:return: Opaque cursor
+		"""
+		position = self.datetime_sent.isoformat() + "|" + self.id
+		return urlsafe_b64encode(position.encode()).decode()
+
+	@staticmethod
+	def decode_cursor(cursor):
+		"""
+		Function to get the notification position from a pagination cursor.
+
+		:param cursor: Opaque cursor
+		:return: Date sent and id of the notification
+		"""
+		datetime_sent, _id = urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+		return datetime.fromisoformat(datetime_sent), _id
+
+	@staticmethod
+	def parse_date(date_ts):
+		"""
+		Function to get the day of a date given as day, month and year with any separator, or as a datetime.
+
+		:param date_ts: Date
+		:return: Datetime at the start of the day
+		"""
+		if isinstance(date_ts, datetime):
+			return datetime(date_ts.year, date_ts.month, date_ts.day)
+		date_ts = ''.join(filter(str.isdigit, date_ts[:10]))
+		return datetime.strptime(date_ts, "%d%m%Y")
+
+	@staticmethod
+	def get_ipaq_date(ccdr_reference):
+		"""
+		Function to get the date of the latest IPAQ questionnaire answered by the patient.
+
+		:param ccdr_reference: Patient reference
+		:return: ipaq_date: Date of the latest questionnaire, or None if the patient has not answered
+		"""
+		ipaq_response = upstream.post(
+			"ccdr", "/api/v1/mobile/surveys/get_response/7.2?identity_management_key=" + ccdr_reference).json()
+		if not ipaq_response:
+			return None
+		return datetime.strptime(ipaq_response[-1]["date"][4:].replace("UTC ", ""), '%b %d %H:%M:%S %Y').date()
 
 	@staticmethod
 	def check_ipaq():
@@ -767,41 +1323,250 @@ class Notifications(db.Model, UserMixin):
 
 		:return: patient_count: Number of patients with unanswered IPAQ
 		"""
-		patients, total = RecommenderPatients.get_patients_db()
 		patient_count = 0
 
 		today = date.today()
 		yesterday = today - timedelta(days=1)
 
-		for patient in patients:
-			if patient.status:
+		# Active patients that got an IPAQ reminder yesterday or today
+		reminded = db.session.query(Notifications.patient) \
+			.filter(Notifications.category == "IPAQ") \
+			.filter(Notifications.datetime_sent >= datetime.combine(yesterday, datetime.min.time())) \
+			.filter(Notifications.datetime_sent < datetime.combine(today + timedelta(days=1), datetime.min.time()))
+		query = RecommenderPatients.query \
+			.filter(RecommenderPatients.status.is_(True)) \
+			.filter(RecommenderPatients.ccdr_reference.in_(reminded))
+		if config.test_flag:
+			query = query.filter(RecommenderPatients.ccdr_reference.in_(config.test_references))
+		patients = query.all()
+
+		# Questionnaires are requested concurrently, reminders are sent from this thread and its database session
+		with ThreadPoolExecutor(max_workers=config.upstream_concurrency["ccdr"]) as pool:
+			fetch = profiling.propagate(Notifications.get_ipaq_date)
+			futures = [pool.submit(fetch, patient.ccdr_reference) for patient in patients]
+			for patient, future in zip(patients, futures):
 				try:
-					# Get patient notifications
-					notifications = patient.get_notifications()
-
-					for notification in notifications:
-						dates = [notification.datetime_sent, yesterday.strftime("%d-%m-%Y"), today.strftime("%d-%m-%Y")]
-
-						# IPAQ notifications always start with "IPAQ"
-						if notification.msg in general_notifications["IPAQ"].values() and Notifications.check_timestamp(dates):
-							ipaq_response = requests.post(
-								config.ccdr_url + "/api/v1/mobile/surveys/get_response/7.2?identity_management_key=" +
-								patient.ccdr_reference).json()
-
-							ipaq_datetime = None
-							if ipaq_response:
-								ipaq_datetime = datetime.strptime(
-									ipaq_response[-1]["date"][4:].replace("UTC ", ""),
-									'%b %d %H:%M:%S %Y').strftime("%d-%m-%Y")
-
-							# Send notification if the survey is not present or if the last survey is not from yesterday
-							if not ipaq_response or ipaq_datetime not in [yesterday, today]:
-								logger.info("[IPAQ] Patient {}: ".format(patient.ccdr_reference))
-
-								patient.par_notification(True)
-								patient_count = patient_count + 1
-								break
-				except requests.exceptions.ConnectionError:
+					ipaq_date = future.result()
+
+					# Send notification if the survey is not present or if the last survey is not from yesterday
+					if ipaq_date not in [yesterday, today]:
+						logger.info("[IPAQ] Patient %s: ", patient.ccdr_reference)
+
+						patient.par_notification(True)
+						patient_count = patient_count + 1
+				except requests.exceptions.RequestException:
 					logger.error("Connection error.")
+		db.session.commit()
 
 		return patient_count
+
+
+class NotificationOutbox(db.Model):
+	__tablename__ = 'NotificationOutbox'
+	__table_args__ = (db.Index('ix_outbox_status_next_attempt', 'status', 'next_attempt'),)
+
+	id = db.Column(db.Integer, primary_key=True)
+	notification_id = db.Column(db.String, db.ForeignKey('Notifications.id'), nullable=False)
+	notification = relationship("Notifications")
+	receiver = db.Column(db.String, nullable=False)
+	body = db.Column(db.JSON, nullable=False)
+	status = db.Column(db.String, nullable=False)  # pending, sent, failed
+	attempts = db.Column(db.Integer, nullable=False)
+	next_attempt = db.Column(db.DateTime, nullable=False)
+	last_error = db.Column(db.String, nullable=True)
+
+	def __init__(self, notification, receiver, body):
+		self.notification = notification
+		self.receiver = receiver
+		self.body = body
+		self.status = "pending"
+		self.attempts = 0
+		self.next_attempt = datetime.now()
+		self.last_error = None
+
+	@staticmethod
+	def deliver(receiver, body):
+		"""
+		Function to post a notification of the outbox without touching the database session.
+
+		:param receiver: Receiver device type
+		:param body: Notification body
+		:return: status: sent, retry or failed.
+		error: Error description
+		"""
+		try:
+			response, destination = Notifications.post_rmq(receiver, body)
+		except requests.exceptions.RequestException as e:
+			return "retry", str(e)
+
+		Notifications.check_response(destination, response, body)
+		if response.status_code == 200:
+			return "sent", None
+		elif response.status_code >= 500:
+			return "retry", "RMQ returned {}".format(response.status_code)
+		else:
+			return "failed", "RMQ returned {}".format(response.status_code)
+
+	@staticmethod
+	def dispatch(batch_size=None):
+		"""
+		Function to send the pending notifications of the outbox in batches. Rows are locked while they are sent,
+		so several dispatchers can drain the outbox at the same time.
+
+		:param batch_size: Number of notifications per batch
+		:return: result: Number of notifications sent, retried and failed.
+		"""
+		batch_size = batch_size or config.outbox_batch_size
+		result = {
+			"sent": 0,
+			"retried": 0,
+			"failed": 0
+		}
+
+		with ThreadPoolExecutor(max_workers=config.upstream_concurrency["rmq"]) as pool:
+			while True:
+				rows = NotificationOutbox.query \
+					.filter(NotificationOutbox.status == "pending", NotificationOutbox.next_attempt <= datetime.now()) \
+					.order_by(NotificationOutbox.id) \
+					.limit(batch_size) \
+					.with_for_update(skip_locked=True) \
+					.all()
+				if not rows:
+					break
+
+				messages = [(row.receiver, row.body) for row in rows]
+				outcomes = pool.map(lambda message: NotificationOutbox.deliver(*message), messages)
+				for row, (status, error) in zip(rows, outcomes):
+					row.attempts = row.attempts + 1
+					row.last_error = error
+					if status == "retry" and row.attempts < config.outbox_max_attempts:
+						# Exponential backoff between attempts
+						delay = config.outbox_interval * 2 ** row.attempts
+						row.next_attempt = datetime.now() + timedelta(seconds=delay)
+						result["retried"] = result["retried"] + 1
+					elif status == "sent":
+						row.status = "sent"
+						result["sent"] = result["sent"] + 1
+					else:
+						row.status = "failed"
+						result["failed"] = result["failed"] + 1
+				db.session.commit()
+
+				if len(rows) < batch_size:
+					break
+
+		for status, count in result.items():
+			if count:
+				metrics.outbox.inc(status, amount=count)
+		if result["sent"] or result["retried"] or result["failed"]:
+			logger.info("Outbox dispatched. Sent: {sent}, retried: {retried}, failed: {failed}".format(**result))
+		return result
+
+
+class WeeklyScores(db.Model):
+	__tablename__ = 'WeeklyScores'
+	__table_args__ = (db.Index('ix_weekly_scores_patient_end_date', 'patient', 'end_date'),)
+
+	id = db.Column(db.Integer, primary_key=True)
+	patient = db.Column(db.String, db.ForeignKey('RecommenderPatients.ccdr_reference'), nullable=False)
+	start_date = db.Column(db.Date, nullable=False)
+	end_date = db.Column(db.Date, nullable=False)
+	scores = db.Column(db.JSON, nullable=False)
+	deviations = db.Column(db.JSON, nullable=True)
+	datetime_created = db.Column(db.DateTime, nullable=False)
+
+	def __init__(self, patient, start_date, end_date, scores, deviations=None):
+		self.patient = patient
+		self.start_date = start_date
+		self.end_date = end_date
+		self.scores = scores
+		self.deviations = deviations
+		self.datetime_created = datetime.now()
+
+	@staticmethod
+	def get_previous(patient_reference, start_date, end_date):
+		"""
+		Function to get the latest stored scores of a patient for a week ending between two dates.
+
+		:param patient_reference: Patient identification
+		:param start_date: First day of the week
+		:param end_date: Last day of the week
+		:return: WeeklyScores, or None if no scores were stored
+		"""
+		return WeeklyScores.query \
+			.filter(WeeklyScores.patient == patient_reference) \
+			.filter(WeeklyScores.end_date >= start_date, WeeklyScores.end_date <= end_date) \
+			.order_by(WeeklyScores.end_date.desc(), WeeklyScores.id.desc()) \
+			.first()
+
+
+class RoundRun(db.Model):
+	__tablename__ = 'RoundRuns'
+	__table_args__ = (db.Index('ix_round_runs_receiver_status', 'receiver', 'status'),)
+
+	id = db.Column(db.String, primary_key=True)
+	receiver = db.Column(db.String, nullable=False)
+	round_date = db.Column(db.Date, nullable=False)
+	status = db.Column(db.String, nullable=False)  # running, completed
+	datetime_started = db.Column(db.DateTime, nullable=False)
+	datetime_finished = db.Column(db.DateTime, nullable=True)
+
+	def __init__(self, receiver):
+		self.id = str(uuid4())
+		self.receiver = receiver
+		self.round_date = date.today()
+		self.status = "running"
+		self.datetime_started = datetime.now()
+		self.datetime_finished = None
+
+	@staticmethod
+	def start(receiver):
+		"""
+		Function to resume the unfinished run of the round started today, or start a new run.
+
+		:param receiver: Environment for receiving messages.
+		:return: run: Round run
+		"""
+		run = RoundRun.query \
+			.filter_by(receiver=receiver, status="running", round_date=date.today()) \
+			.order_by(RoundRun.datetime_started.desc()) \
+			.first()
+		if run is not None:
+			logger.info("Resuming {} round {} started at {}".format(receiver, run.id, run.datetime_started))
+			return run
+
+		run = RoundRun(receiver)
+		db.session.add(run)
+		db.session.commit()
+		return run
+
+	def completed_patients(self):
+		"""
+		Function to get the patients already notified in the run.
+
+		:return: Set of patient references
+		"""
+		query = db.session.query(RoundCheckpoint.patient).filter(RoundCheckpoint.run_id == self.id)
+		return {patient for patient, in query}
+
+	def finish(self):
+		"""
+		Function to mark the run as completed. Its checkpoints are not needed anymore.
+
+		:return: None
+		"""
+		RoundCheckpoint.query.filter(RoundCheckpoint.run_id == self.id).delete(synchronize_session=False)
+		self.status = "completed"
+		self.datetime_finished = datetime.now()
+		db.session.commit()
+
+
+class RoundCheckpoint(db.Model):
+	__tablename__ = 'RoundCheckpoints'
+
+	run_id = db.Column(db.String, db.ForeignKey('RoundRuns.id'), primary_key=True)
+	patient = db.Column(db.String, primary_key=True)
+
+	def __init__(self, run_id, patient):
+		self.run_id = run_id
+		self.patient = patient
@@ -0,0 +1,53 @@
+import socket
+import threading
+
+import pytest
+import requests
+
+from helper import config, metrics, upstream
+
+
+@pytest.fixture
+def silent_upstream(monkeypatch):
+	"""
+	Upstream that accepts the connections and never answers, so every request ends with a read timeout.
+
+	:return: List of accepted connections
+	"""
+	server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	server.bind(("127.0.0.1", 0))
+	server.listen(8)
+	accepted = []
+
+	def accept():
+		while True:
+			try:
+				connection, _ = server.accept()
+			except OSError:
+				return
+			accepted.append(connection)
+
+	threading.Thread(target=accept, daemon=True).start()
+	monkeypatch.setitem(upstream.base_urls, "ccdr", "http://127.0.0.1:{}".format(server.getsockname()[1]))
+	monkeypatch.setitem(upstream.sessions, "ccdr", None)
+	monkeypatch.setattr(config, "upstream_retries", 2)
+	monkeypatch.setattr(config, "upstream_backoff", 0)
+	yield accepted
+	server.close()
+	for connection in accepted:
+		connection.close()
+
+
+def test_get_retries_read_timeout(silent_upstream):
+	path = "/api/v1/mobile/patient"
+	errors = metrics.upstream_errors.values.get(("ccdr", path, "ReadTimeout"), 0)
+	with pytest.raises(requests.exceptions.ReadTimeout):
+		upstream.get("ccdr", path, timeout=(1, 0.2))
+	assert len(silent_upstream) == config.upstream_retries + 1
+	assert metrics.upstream_errors.values[("ccdr", path, "ReadTimeout")] == errors + config.upstream_retries + 1
+
+
+def test_post_does_not_repeat_read_timeout(silent_upstream):
+	with pytest.raises(requests.exceptions.ReadTimeout):
+		upstream.post("ccdr", "/notification/sendNotifications", json={}, timeout=(1, 0.2))
+	assert len(silent_upstream) == 1